@@ -0,0 +1,190 @@
+"""
+CSV parsing through pyarrow that gives exactly what pandas gives.
+
+pandas' C parser spends most of a sample sheet's read building its text
+columns; pyarrow's CSV parser reads the same file several times faster.
+Issue output depends on the dtype and values pandas gives each column, so
+pyarrow only stands in where the result is the same:
+
+- every cell is read as text, with pandas' default missing-value strings
+  as nulls;
+- a column holding any cell pandas could not read as a number or a boolean
+  (IDs, barcodes, free text) is text either way, and is used as read;
+- every other column is parsed by pandas itself, one column at a time,
+  which is cheap for numbers;
+- files pyarrow rejects or reads differently (ragged rows, duplicate or
+  blank header names, single-column files, NUL bytes, ...) give None, and
+  the caller parses them with pandas as before.
+"""
+import io
+from typing import Any, Iterator, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+from pandas._libs.parsers import STR_NA_VALUES
+
+# Cells pandas' C parser might read as a number or a boolean. This is a
+# superset (pandas decides the rest); RE2's \s lacks \v, which pandas skips
+_NUMBER_LIKE = r"(?i)^[\t\n\v\f\r ]*[-+]?(\d*\.?\d*(e[-+]?\d*)?|inf|infinity|nan|true|false)[\t\n\v\f\r ]*$"
+# Cells matched before the whole column, which rules out most text columns
+_SAMPLE_CELLS = 64
+# Bytes looked at to estimate the size of a row
+_ROW_SAMPLE_BYTES = 1024 * 1024
+# Block read to check pyarrow's column names; only the header row matters
+_HEADER_BLOCK_BYTES = 64 * 1024
+
+
+def _input(source: Union[bytes, str]):
+    return io.BytesIO(source) if isinstance(source, bytes) else source
+
+
+def _header(source: Union[bytes, str]) -> Optional[List[str]]:
+    """pandas' column names for the file, or None if pyarrow could not match them."""
+    try:
+        header = list(pd.read_csv(_input(source), nrows=0).columns)
+    except Exception:
+        return None
+    # pandas renames duplicate and blank names; a single column can hold blank lines
+    if len(header) < 2 or any(not isinstance(name, str) or name.startswith("Unnamed: ") for name in header):
+        return None
+    return header
+
+
+def _convert_options(header: List[str], columns: Optional[List[str]] = None) -> pa_csv.ConvertOptions:
+    return pa_csv.ConvertOptions(
+        column_types={name: pa.string() for name in header},
+        null_values=sorted(STR_NA_VALUES),
+        strings_can_be_null=True,
+        quoted_strings_can_be_null=True,
+        include_columns=columns,
+    )
+
+
+_PARSE_OPTIONS = pa_csv.ParseOptions(newlines_in_values=True)
+
+
+def _has_nul(values: Union[pa.Array, pa.ChunkedArray]) -> bool:
+    """Whether any cell holds a NUL byte (or the data buffer does, past the cells)."""
+    chunks = values.chunks if isinstance(values, pa.ChunkedArray) else [values]
+    for chunk in chunks:
+        data = chunk.buffers()[2]
+        if data is not None and not np.frombuffer(data, dtype=np.uint8).all():
+            return True
+    return False
+
+
+def _is_text(values: Union[pa.Array, pa.ChunkedArray]) -> bool:
+    present = values.drop_null()
+    if not len(present):
+        return False
+    return (
+        not pc.all(pc.match_substring_regex(present.slice(0, _SAMPLE_CELLS), _NUMBER_LIKE)).as_py()
+        or not pc.all(pc.match_substring_regex(present, _NUMBER_LIKE)).as_py()
+    )
+
+
+def to_series(values: Union[pa.Array, pa.ChunkedArray], name: str, dtype: Any = None) -> Optional[pd.Series]:
+    """
+    The column pandas would parse from these cells (with dtype, if given),
+    or None if that cannot be worked out here. With dtype str the cells are
+    taken as they are: they must have passed a to_series call without a
+    dtype before.
+    """
+    if dtype is str:
+        return pd.Series(values, dtype="str", name=name)
+    if _has_nul(values):
+        # pandas' C parser ends a cell at a NUL byte
+        return None
+    if dtype is None and _is_text(values):
+        return pd.Series(values, dtype="str", name=name)
+    text = io.BytesIO()
+    try:
+        # Fails on cells that would need quoting, e.g. ones spanning lines
+        pa_csv.write_csv(pa.table({name: pc.fill_null(values, "")}), text,
+                         pa_csv.WriteOptions(include_header=False, quoting_style="none"))
+    except pa.ArrowException:
+        return None
+    text.seek(0)
+    column = pd.read_csv(text, header=None, names=[name], dtype=dtype, skip_blank_lines=False, low_memory=False)[name]
+    return column if len(column) == len(values) else None
+
+
+def read_frame(source: Union[bytes, str]) -> Optional[pd.DataFrame]:
+    """
+    The DataFrame pd.read_csv(source, low_memory=False) would return, or
+    None if pyarrow cannot give the same one (including files pandas would
+    fail to parse).
+    """
+    if not pd.get_option("future.infer_string"):
+        # pandas before 3 reads text into object columns
+        return None
+    header = _header(source)
+    if header is None:
+        return None
+    try:
+        table = pa_csv.read_csv(_input(source), parse_options=_PARSE_OPTIONS, convert_options=_convert_options(header))
+    except (pa.ArrowException, UnicodeDecodeError):
+        return None
+    if table.column_names != header or table.num_rows == 0:
+        return None
+    columns = {}
+    for name in header:
+        column = to_series(table.column(name), name)
+        if column is None:
+            return None
+        columns[name] = column
+    return pd.DataFrame(columns)
+
+
+def _block_bytes(source: Union[bytes, str], rows: int) -> int:
+    """Bytes of about this many rows of the file."""
+    if isinstance(source, bytes):
+        sample = source[:_ROW_SAMPLE_BYTES]
+    else:
+        with open(source, "rb") as f:
+            sample = f.read(_ROW_SAMPLE_BYTES)
+    row_bytes = len(sample) / max(sample.count(b"\n"), 1)
+    return max(int(rows * row_bytes), 4096)
+
+
+class BatchReader:
+    """
+    Reads a file in record batches of about `rows` rows, holding the given
+    columns as text. open() returns None if pyarrow cannot name the columns
+    the way pandas does.
+    """
+
+    def __init__(self, source: Union[bytes, str], header: List[str], columns: List[str], rows: int):
+        self.source = source
+        self.header = header
+        self.columns = columns
+        self._read_options = pa_csv.ReadOptions(block_size=_block_bytes(source, rows))
+
+    @classmethod
+    def open(cls, source: Union[bytes, str], columns: List[str], rows: int) -> Optional["BatchReader"]:
+        if not pd.get_option("future.infer_string"):
+            return None
+        header = _header(source)
+        if header is None:
+            return None
+        self = cls(source, header, [c for c in columns if c in header], rows)
+        try:
+            names = self._open(header, pa_csv.ReadOptions(block_size=_HEADER_BLOCK_BYTES)).schema.names
+        except (pa.ArrowException, UnicodeDecodeError):
+            return None
+        return self if names == header else None
+
+    def _open(self, columns: Optional[List[str]], read_options: Optional[pa_csv.ReadOptions] = None):
+        return pa_csv.open_csv(
+            _input(self.source), read_options=read_options or self._read_options, parse_options=_PARSE_OPTIONS,
+            convert_options=_convert_options(self.header, columns),
+        )
+
+    def batches(self) -> Iterator[pa.RecordBatch]:
+        """Record batches of the columns; raises pa.ArrowException where pyarrow cannot parse the file."""
+        for batch in self._open(self.columns):
+            if batch.num_rows:
+                yield batch
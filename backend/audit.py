@@ -0,0 +1,117 @@
+"""
+Write-behind audit log.
+
+Request handlers hand audit events to audit_log.emit(), which only appends to
+a bounded in-memory queue. A background task writes the queue to the
+`audit_logs` collection with unordered insert_many, whenever AUDIT_BATCH_SIZE
+events are waiting or AUDIT_FLUSH_SECONDS have passed, and drains it on
+shutdown. If Mongo falls behind and the queue fills up, new events are dropped
+and counted instead of slowing requests down.
+"""
+import asyncio
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+# Events held in memory waiting to be written
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+# Events per insert_many
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+# Longest an event waits before its batch is written (seconds)
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "1"))
+# Attempts at writing a batch before its events are counted as failed
+AUDIT_WRITE_ATTEMPTS = 3
+# How long shutdown waits for the queue to drain (seconds)
+AUDIT_DRAIN_SECONDS = 10
+
+
+class AuditSink:
+    """Bounded queue of audit events written to Mongo in the background."""
+
+    def __init__(self, max_queue: int = AUDIT_QUEUE_SIZE, batch_size: int = AUDIT_BATCH_SIZE,
+                 flush_seconds: float = AUDIT_FLUSH_SECONDS):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._collection = None
+        self._writer: Optional[asyncio.Task] = None
+        self._current_write: Optional[asyncio.Future] = None
+        # Events taken off the queue for the next write
+        self._batch: List[Dict[str, Any]] = []
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self, collection) -> None:
+        self._collection = collection
+        self._writer = asyncio.create_task(self._run())
+
+    def emit(self, event: Dict[str, Any]) -> None:
+        """Queue an event without waiting; drops it (and counts the drop) if the queue is full."""
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                print(f"[AUDIT] Queue full, {self.dropped} event(s) dropped so far")
+
+    async def stop(self, timeout: float = AUDIT_DRAIN_SECONDS) -> None:
+        """Write everything still queued (up to timeout seconds), then stop the writer."""
+        if self._writer is None:
+            return
+        self._writer.cancel()
+        await asyncio.gather(self._writer, return_exceptions=True)
+        self._writer = None
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            print(f"[AUDIT] Shutdown drain timed out with {self._queue.qsize()} event(s) unwritten")
+
+    def stats(self) -> Dict[str, int]:
+        return {"queued": self._queue.qsize(), "written": self.written, "dropped": self.dropped, "failed": self.failed}
+
+    async def _run(self) -> None:
+        while True:
+            await self._collect()
+            batch, self._batch = self._batch, []
+            # Shielded so shutdown never interrupts a write half-way
+            self._current_write = asyncio.ensure_future(self._write(batch))
+            await asyncio.shield(self._current_write)
+
+    async def _collect(self) -> None:
+        """Move events from the queue into self._batch until it is full or the oldest is due."""
+        self._batch.append(await self._queue.get())
+        deadline = time.monotonic() + self.flush_seconds
+        while len(self._batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                self._batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                return
+
+    async def _drain(self) -> None:
+        if self._current_write is not None:
+            await self._current_write
+        while self._batch or not self._queue.empty():
+            while len(self._batch) < self.batch_size and not self._queue.empty():
+                self._batch.append(self._queue.get_nowait())
+            batch, self._batch = self._batch, []
+            await self._write(batch)
+
+    async def _write(self, batch: List[Dict[str, Any]]) -> None:
+        for attempt in range(1, AUDIT_WRITE_ATTEMPTS + 1):
+            try:
+                await self._collection.insert_many(batch, ordered=False)
+                self.written += len(batch)
+                return
+            except Exception as e:
+                print(f"[AUDIT] Writing {len(batch)} event(s) failed (attempt {attempt}): {e}")
+                if attempt < AUDIT_WRITE_ATTEMPTS:
+                    await asyncio.sleep(0.5 * attempt)
+        self.failed += len(batch)
+
+
+# Process-wide sink; started by the API and by `python -m worker`
+audit_log = AuditSink()
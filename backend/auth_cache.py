@@ -0,0 +1,82 @@
+"""
+In-process caches for authenticated requests.
+
+Every authenticated request decodes its JWT and loads the user it names.
+The UI polls, so the same token and user come back every few seconds:
+
+- token_cache holds decoded token payloads keyed by the SHA-256 of the
+  token, until the token expires;
+- user_cache holds user documents keyed by the token subject (email) for
+  USER_CACHE_TTL_SECONDS, and must be invalidated whenever a user record
+  is written.
+
+Both are bounded LRUs and count hits and misses.
+"""
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+# Users kept in memory and for how long (seconds)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+# Decoded tokens kept in memory (each until its own expiry)
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+
+
+class TTLCache:
+    """
+    Bounded LRU whose entries also expire. Only used from the event loop,
+    so it needs no lock.
+    """
+
+    def __init__(self, maxsize: int, ttl_seconds: Optional[float] = None):
+        self._maxsize = maxsize
+        self._ttl = ttl_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def set(self, key: Hashable, value: Any, expires_at: Optional[float] = None) -> None:
+        """Store a value until expires_at (a UNIX time), or for the cache's TTL."""
+        if expires_at is None:
+            expires_at = time.time() + (self._ttl or 0)
+        if self._ttl is not None:
+            expires_at = min(expires_at, time.time() + self._ttl)
+        if self._maxsize <= 0:
+            return
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._entries), "maxsize": self._maxsize, "hits": self.hits, "misses": self.misses}
+
+
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+token_cache = TTLCache(TOKEN_CACHE_SIZE)
+
+
+def token_key(token: str) -> str:
+    """Cache key for a token; the raw token is never kept."""
+    return hashlib.sha256(token.encode()).hexdigest()
@@ -0,0 +1,89 @@
+"""
+Backfill run summaries.
+
+Brings runs stored by older versions up to the current layout:
+
+- finished runs whose issues are not grouped yet, whether embedded in a
+  `validation_issues` array or one document per issue in the
+  `validation_issues` collection, get them grouped into `issue_groups`
+  (issue_groups.py) and the per-issue copies removed;
+- each of those also gets a current `validation_summary` (severity and
+  per-file counts plus the readiness flag).
+
+Safe to re-run and to interrupt:
+
+    python -m backfill_run_summaries [--dry-run]
+"""
+import argparse
+import asyncio
+import os
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import create_client
+from db_indexes import ensure_indexes
+from issue_groups import group_issues
+from issues import GROUPED, summarize_groups, write_issue_groups
+
+
+def _group_by_file(issues):
+    """(fileName, groups) per file, in the order the files first appear."""
+    files = {}
+    for issue in issues:
+        files.setdefault(issue["fileName"], []).append(issue)
+    return [(file_name, group_issues(file_issues)) for file_name, file_issues in files.items()]
+
+
+async def backfill(db, dry_run: bool = False) -> int:
+    """Returns the number of runs updated (or that would be, with dry_run)."""
+    runs = db.harmonization_runs
+    if not dry_run:
+        await ensure_indexes(db)
+    # Runs completed before issues were grouped (or summaries carried the readiness flag)
+    query = {"status": "complete", "issue_format": {"$ne": GROUPED}}
+    updated = 0
+    # Only ids are held in memory; each run's issues are loaded one run at a time
+    ids = [run["_id"] async for run in runs.find(query, {"_id": 1})]
+    for run_id in ids:
+        run = await runs.find_one({"_id": run_id}, {"validation_issues": 1})
+        embedded = run.get("validation_issues") if run else None
+        if not dry_run:
+            if embedded is None:
+                embedded = await db.validation_issues.find(
+                    {"run_id": run_id}, {"_id": 0, "run_id": 0}
+                ).sort("seq", 1).to_list(length=None)
+            files = _group_by_file(embedded)
+            await write_issue_groups(db.issue_groups, run_id, files, replace=True)
+            await runs.update_one(
+                {"_id": run_id},
+                {"$set": {"validation_summary": summarize_groups(files), "issue_format": GROUPED,
+                          "updated_at": datetime.utcnow()},
+                 "$unset": {"validation_issues": ""}, "$inc": {"state_version": 1}}
+            )
+            # Only once the groups are in place, so an interrupted backfill loses nothing
+            await db.validation_issues.delete_many({"run_id": run_id})
+        updated += 1
+        if updated % 100 == 0:
+            print(f"[BACKFILL] {updated}/{len(ids)} runs")
+    return updated
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="only count the runs that need a backfill")
+    args = parser.parse_args()
+
+    mongodb_uri = os.getenv("MONGODB_URI")
+    if not mongodb_uri:
+        raise ValueError("MONGODB_URI environment variable is required")
+    db = create_client(mongodb_uri).get_database(os.getenv("DATABASE_NAME", "mdo"))
+
+    updated = await backfill(db, dry_run=args.dry_run)
+    print(f"[BACKFILL] {'Would update' if args.dry_run else 'Updated'} {updated} run(s)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
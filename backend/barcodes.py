@@ -0,0 +1,199 @@
+"""
+Index barcode collisions.
+
+Two samples in the same lane whose index pairs differ in only a mismatch or
+two cannot be told apart when reads are demultiplexed. A template marks its
+index field with "barcode": {"lane", "paired_with", "max_mismatches"}; each
+row's index pair (the field followed by paired_with, if any) is compared with
+those of the other rows in its lane, and a pair within max_mismatches
+(default BARCODE_MAX_MISMATCHES) of an earlier row is a Blocker naming that
+row.
+
+Comparing all pairs in a lane is quadratic, so candidates come from a
+pigeonhole index instead: a pair of barcodes within k mismatches agrees
+exactly on at least one of any k + 1 disjoint segments, so barcodes are
+only compared with those sharing a segment. Only index pairs of the same
+lengths are compared, and N is an ordinary base.
+"""
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from validation import ROW_NUMBER_OFFSET, CsvSource, make_issue, read_csv_source
+
+# Hamming distance at or below which two index pairs collide, unless the template says otherwise
+BARCODE_MAX_MISMATCHES = int(os.getenv("BARCODE_MAX_MISMATCHES", "2"))
+# Candidate pairs compared per step, which bounds memory on lanes with many samples
+BARCODE_PAIR_BATCH = 1000000
+
+
+@dataclass(frozen=True)
+class BarcodeRule:
+    """An index field and how its collisions are found, resolved for a column mapping."""
+    field: str
+    column: str
+    lane_column: str
+    paired_column: Optional[str]
+    max_mismatches: int
+
+
+def barcode_rules(template: Dict[str, Any], column_mapping: Dict[str, str]) -> List[BarcodeRule]:
+    """The template's barcode checks whose index and lane are mapped (an unmapped pair is left out)."""
+    rules = []
+    for field in template.get("fields", []):
+        barcode = field.get("barcode")
+        if not barcode:
+            continue
+        column = (column_mapping or {}).get(field["name"])
+        lane_column = (column_mapping or {}).get(barcode["lane"])
+        paired = barcode.get("paired_with")
+        paired_column = (column_mapping or {}).get(paired) if paired else None
+        if not column or not lane_column:
+            continue
+        rules.append(BarcodeRule(
+            field["name"], column, lane_column, paired_column,
+            barcode.get("max_mismatches", BARCODE_MAX_MISMATCHES),
+        ))
+    return rules
+
+
+def _segments(length: int, count: int) -> List[Tuple[int, int]]:
+    bounds = np.linspace(0, length, count + 1).astype(int)
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def _candidate_batches(codes: np.ndarray, max_mismatches: int) -> Iterator[np.ndarray]:
+    """
+    (i, j) pairs, i < j, of distinct barcodes sharing at least one pigeonhole
+    segment, in batches of about BARCODE_PAIR_BATCH. A pair sharing several
+    segments comes up once per segment.
+    """
+    n, length = codes.shape
+    for start, stop in _segments(length, max_mismatches + 1):
+        buckets, _ = pd.factorize(pd.Series([segment.tobytes() for segment in codes[:, start:stop]]))
+        order = np.argsort(buckets, kind="stable")
+        sorted_buckets = buckets[order]
+        starts = np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]])
+        sizes = np.diff(np.r_[starts, n])
+        # Pairs within every bucket, many buckets of one size at a time
+        for size in np.unique(sizes[sizes > 1]).tolist():
+            i, j = np.triu_indices(size, 1)
+            same_size = starts[sizes == size]
+            step = max(1, BARCODE_PAIR_BATCH // len(i))
+            for first in range(0, len(same_size), step):
+                members = order[same_size[first:first + step, None] + np.arange(size)]
+                a, b = members[:, i].ravel(), members[:, j].ravel()
+                yield np.stack([np.minimum(a, b), np.maximum(a, b)], axis=1)
+
+
+def _close_pairs(codes: np.ndarray, max_mismatches: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Distinct (i, j) pairs of barcodes within max_mismatches, and their mismatches."""
+    found, found_mismatches = [], []
+    for pairs in _candidate_batches(codes, max_mismatches):
+        mismatches = (codes[pairs[:, 0]] != codes[pairs[:, 1]]).sum(axis=1)
+        close = mismatches <= max_mismatches
+        found.append(pairs[close])
+        found_mismatches.append(mismatches[close])
+    if not found:
+        return np.zeros((0, 2), dtype=np.intp), np.zeros(0, dtype=np.intp)
+    pairs, keep = np.unique(np.concatenate(found), axis=0, return_index=True)
+    return pairs, np.concatenate(found_mismatches)[keep]
+
+
+def _lane_collisions(barcodes: pd.Series, positions: np.ndarray, max_mismatches: int) -> List[Tuple[int, int, int]]:
+    """
+    (row position, earlier colliding row position, mismatches) for the rows
+    of one lane whose index pairs all have the same lengths.
+    """
+    codes_of, distinct = pd.factorize(barcodes)
+    # First occurrence of every distinct barcode; positions are ascending
+    first = np.full(len(distinct), -1, dtype=np.intp)
+    first[codes_of[::-1]] = positions[::-1]
+    codes = np.array(distinct, dtype=str).view(np.uint32).reshape(len(distinct), -1)
+
+    # Earliest neighbouring barcode of each distinct barcode, and its distance
+    nearest = np.full(len(distinct), np.iinfo(np.intp).max, dtype=np.intp)
+    distance = np.zeros(len(distinct), dtype=np.intp)
+    if max_mismatches >= codes.shape[1]:
+        # Every pair collides: the earliest barcode is everyone's neighbour, the second earliest its own
+        if len(distinct) > 1:
+            earliest = np.argsort(first, kind="stable")[:2]
+            neighbour = np.where(np.arange(len(distinct)) == earliest[0], earliest[1], earliest[0])
+            nearest = first[neighbour]
+            distance = (codes != codes[neighbour]).sum(axis=1)
+    else:
+        close, close_mismatches = _close_pairs(codes, max_mismatches)
+        neighbours = pd.DataFrame({
+            "code": np.r_[close[:, 0], close[:, 1]],
+            "other": first[np.r_[close[:, 1], close[:, 0]]],
+            "mismatches": np.r_[close_mismatches, close_mismatches],
+        }).sort_values("other", kind="stable").drop_duplicates("code")
+        nearest[neighbours["code"].to_numpy()] = neighbours["other"].to_numpy()
+        distance[neighbours["code"].to_numpy()] = neighbours["mismatches"].to_numpy()
+
+    collisions = []
+    for position, code in zip(positions.tolist(), codes_of.tolist()):
+        if first[code] < position:
+            collisions.append((position, int(first[code]), 0))
+        elif nearest[code] < position:
+            collisions.append((position, int(nearest[code]), int(distance[code])))
+    return collisions
+
+
+# ============== Worker Function ==============
+
+def barcode_collisions(source: CsvSource, rules: List[BarcodeRule]) -> Optional[List[Tuple[int, int, str]]]:
+    """
+    (rule number, row position, description) of every colliding row, rule by
+    rule and then in row order, or None if the file cannot be read.
+    """
+    wanted = {c for rule in rules for c in (rule.column, rule.lane_column, rule.paired_column) if c}
+    try:
+        df = read_csv_source(source, usecols=lambda c: c in wanted, dtype=str, na_filter=False)
+    except Exception:
+        return None
+
+    found = []
+    for n, rule in enumerate(rules):
+        if any(c and c not in df.columns for c in (rule.column, rule.lane_column, rule.paired_column)):
+            continue
+        lane = df[rule.lane_column].str.strip()
+        first = df[rule.column].str.strip().str.upper()
+        second = df[rule.paired_column].str.strip().str.upper() if rule.paired_column else pd.Series("", index=df.index)
+        present = (lane != "") & (first != "")
+        groups = pd.DataFrame({
+            "lane": lane, "barcode": first + second, "first": first, "second": second,
+            "lengths": first.str.len().astype(str) + "+" + second.str.len().astype(str),
+        })[present.to_numpy()]
+        rows = []
+        for (lane_value, _), group in groups.groupby(["lane", "lengths"], sort=False):
+            if len(group) < 2:
+                continue
+            positions = group.index.to_numpy()
+            for position, other, mismatches in _lane_collisions(group["barcode"], positions, rule.max_mismatches):
+                label = _pair_label(group, position)
+                other_label = _pair_label(group, other)
+                rows.append((position, (
+                    f"Index {label} is {mismatches} mismatch{'es' if mismatches != 1 else ''} from "
+                    f"{other_label} in row {other + ROW_NUMBER_OFFSET} (lane {lane_value})"
+                )))
+        rows.sort(key=lambda row: row[0])
+        found.extend((n, position, description) for position, description in rows)
+    return found
+
+
+def _pair_label(group: pd.DataFrame, position: int) -> str:
+    row = group.loc[position]
+    return f"'{row['first']}+{row['second']}'" if row["second"] else f"'{row['first']}'"
+
+
+def collision_issues(file_name: str, rules: List[BarcodeRule],
+                     found: List[Tuple[int, int, str]]) -> List[Dict[str, Any]]:
+    """Blockers for a file's colliding rows (ids are assigned later)."""
+    return [
+        make_issue(None, "Blocker", file_name, position + ROW_NUMBER_OFFSET, rules[n].field, description)
+        for n, position, description in found
+    ]
@@ -0,0 +1,23 @@
+"""
+Benchmarks of the validation engine and the API.
+
+Run from the backend directory:
+
+    # A synthetic sheet (1k to 10M rows) with a share of injected errors
+    python -m bench generate --template illumina-ngs-run-v1.2 --rows 1000000 \\
+        --empty-required 0.01 --out /tmp/illumina.csv
+
+    # validate_csv_data and the barcode check on every template and size
+    python -m bench engine [--sizes 1000,100000,1000000] [--output bench/baselines/engine.json]
+
+    # POST /api/v1/runs end to end against an in-memory Mongo stand-in
+    python -m bench load [--rows 10000] [--runs 20] [--concurrency 4]
+
+    # Exit status 1 if throughput or peak RSS regressed by more than 10%
+    python -m bench compare bench/baselines/engine.json bench/results/engine-<timestamp>.json
+
+Sheets are generated once per (template, rows, seed, error rates) into
+BENCH_DATA_DIR (default: <system temp>/mdo-bench) and reused. Results are
+JSON documents (results.py); keep one as a baseline and compare later runs
+of the same command on the same machine against it.
+"""
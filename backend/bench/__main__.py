@@ -0,0 +1,105 @@
+import argparse
+import os
+import sys
+import tempfile
+from dataclasses import asdict
+
+from templates import SCHEMA_TEMPLATES
+
+from . import __doc__ as usage
+from .compare import compare_results
+from .generate import ErrorRates, generate_sheet
+from .results import load_results, write_results
+
+# Generated sheets are kept here between benchmark runs
+BENCH_DATA_DIR = os.getenv("BENCH_DATA_DIR") or os.path.join(tempfile.gettempdir(), "mdo-bench")
+
+
+def _sizes(value: str):
+    return [int(size) for size in value.split(",") if size]
+
+
+def _templates(value: str):
+    templates = [t for t in value.split(",") if t]
+    unknown = [t for t in templates if t not in SCHEMA_TEMPLATES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown template(s): {', '.join(unknown)}")
+    return templates
+
+
+def _add_sheet_options(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--empty-required", type=float, default=0.0, help="share of required cells left empty")
+    parser.add_argument("--out-of-range", type=float, default=0.0, help="share of bounded integers out of range")
+    parser.add_argument("--bad-pattern", type=float, default=0.0, help="share of pattern cells that do not match")
+    parser.add_argument("--duplicate-ids", type=float, default=0.0, help="share of *_ID cells repeating a value")
+
+
+def _rates(args: argparse.Namespace) -> ErrorRates:
+    return ErrorRates(args.empty_required, args.out_of_range, args.bad_pattern, args.duplicate_ids)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m bench", description=usage,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="write a synthetic sheet")
+    generate.add_argument("--template", required=True, choices=sorted(SCHEMA_TEMPLATES))
+    generate.add_argument("--rows", type=int, required=True)
+    generate.add_argument("--out", required=True)
+    _add_sheet_options(generate)
+
+    engine = commands.add_parser("engine", help="micro-benchmark the validation engine")
+    engine.add_argument("--templates", type=_templates, default=list(SCHEMA_TEMPLATES))
+    engine.add_argument("--sizes", type=_sizes, default=[1000, 100000, 1000000])
+    engine.add_argument("--repeats", type=int, default=3)
+    engine.add_argument("--output")
+    _add_sheet_options(engine)
+
+    load = commands.add_parser("load", help="load-test POST /api/v1/runs end to end")
+    load.add_argument("--templates", type=_templates, default=list(SCHEMA_TEMPLATES))
+    load.add_argument("--rows", type=int, default=10000, help="rows of each uploaded sheet")
+    load.add_argument("--runs", type=int, default=20)
+    load.add_argument("--concurrency", type=int, default=4)
+    load.add_argument("--port", type=int, default=0, help="default: any free port")
+    load.add_argument("--output")
+    _add_sheet_options(load)
+
+    compare = commands.add_parser("compare", help="flag regressions against a baseline")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=10.0, help="allowed change in percent")
+
+    args = parser.parse_args()
+    if args.command == "generate":
+        generate_sheet(args.out, args.template, args.rows, args.seed, _rates(args))
+        print(f"[BENCH] Wrote {args.rows} rows of {args.template} to {args.out}")
+    elif args.command == "engine":
+        from .engine import run_engine
+        cases = run_engine(args.templates, args.sizes, _rates(args), args.seed, args.repeats, BENCH_DATA_DIR)
+        settings = {"templates": args.templates, "sizes": args.sizes, "repeats": args.repeats,
+                    "seed": args.seed, "error_rates": asdict(_rates(args))}
+        print(f"[BENCH] Results written to {write_results('engine', settings, cases, args.output)}")
+    elif args.command == "load":
+        from .load import run_load
+        cases = run_load(args.templates, args.rows, args.runs, args.concurrency, _rates(args), args.seed,
+                         BENCH_DATA_DIR, args.port)
+        settings = {"templates": args.templates, "rows": args.rows, "runs": args.runs,
+                    "concurrency": args.concurrency, "seed": args.seed, "error_rates": asdict(_rates(args))}
+        print(f"[BENCH] Results written to {write_results('load', settings, cases, args.output)}")
+    else:
+        baseline, current = load_results(args.baseline), load_results(args.current)
+        if baseline.get("settings") != current.get("settings"):
+            print("[BENCH] Warning: the results were produced with different settings")
+        lines, regressions = compare_results(baseline, current, args.threshold)
+        print("\n".join(lines))
+        if regressions:
+            print(f"\n[BENCH] {len(regressions)} regression(s) beyond {args.threshold:g}%:")
+            print("\n".join(regressions))
+            sys.exit(1)
+        print(f"\n[BENCH] No regressions beyond {args.threshold:g}%")
+
+
+if __name__ == "__main__":
+    main()
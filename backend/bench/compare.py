@@ -0,0 +1,36 @@
+"""
+Regression check between two benchmark results.
+
+A case regresses when its throughput (rows_per_second) drops, or its peak
+RSS (peak_rss_mb, and worker_peak_rss_mb of load tests) grows, by more than
+the threshold percentage relative to the baseline. Cases present in only one of the results are listed but never
+fail the comparison.
+"""
+from typing import Any, Dict, List, Tuple
+
+# Metrics compared, and whether higher values are better
+COMPARED_METRICS = (("rows_per_second", True), ("peak_rss_mb", False), ("worker_peak_rss_mb", False))
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any],
+                    threshold_percent: float) -> Tuple[List[str], List[str]]:
+    """(report lines, regression lines) of current against baseline."""
+    if baseline.get("kind") != current.get("kind"):
+        raise ValueError(f"Cannot compare a {baseline.get('kind')} result with a {current.get('kind')} result")
+    lines, regressions = [], []
+    base_cases, cases = baseline["cases"], current["cases"]
+    for name in sorted(set(base_cases) | set(cases)):
+        if name not in cases or name not in base_cases:
+            lines.append(f"{name}: only in the {'baseline' if name in base_cases else 'current'} result")
+            continue
+        for metric, higher_is_better in COMPARED_METRICS:
+            before, after = base_cases[name].get(metric), cases[name].get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            worse = -change if higher_is_better else change
+            line = f"{name} {metric}: {before:g} -> {after:g} ({change:+.1f}%)"
+            lines.append(line)
+            if worse > threshold_percent:
+                regressions.append(line)
+    return lines, regressions
@@ -0,0 +1,74 @@
+"""
+Validation engine micro-benchmarks.
+
+Times validate_csv_data on a generated sheet of every template at every size,
+and the barcode collision check (barcodes.py) on the Illumina sheets. Each
+repeat runs in a fresh process, so its peak RSS is the case's own and no
+plan or file cache carries over between repeats.
+"""
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Callable, Dict, List, Tuple
+
+from .generate import ErrorRates, cached_sheet, identity_mapping
+from .results import peak_rss_mb
+
+BARCODE_TEMPLATE = "illumina-ngs-run-v1.2"
+
+
+def _validate(path: str, template_id: str) -> int:
+    from validation import validate_csv_data
+    return len(validate_csv_data(path, os.path.basename(path), template_id, identity_mapping(template_id)))
+
+
+def _barcodes(path: str, template_id: str) -> int:
+    from barcodes import barcode_collisions, barcode_rules
+    from templates import SCHEMA_TEMPLATES
+    rules = barcode_rules(SCHEMA_TEMPLATES[template_id], identity_mapping(template_id))
+    return len(barcode_collisions(path, rules) or [])
+
+
+def _measure(target: Callable[[str, str], int], path: str, template_id: str) -> Tuple[float, int, float]:
+    """(seconds, issues found, peak RSS in MB) of one call, in a worker process."""
+    started = time.perf_counter()
+    found = target(path, template_id)
+    return time.perf_counter() - started, found, peak_rss_mb()
+
+
+def run_case(target: Callable[[str, str], int], path: str, template_id: str, rows: int,
+             repeats: int) -> Dict[str, Any]:
+    samples: List[Tuple[float, int, float]] = []
+    for _ in range(repeats):
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+            samples.append(pool.submit(_measure, target, path, template_id).result())
+    seconds = [s for s, _, _ in samples]
+    median = statistics.median(seconds)
+    return {
+        "rows": rows,
+        "bytes": os.path.getsize(path),
+        "repeats": repeats,
+        "seconds_median": round(median, 4),
+        "seconds_min": round(min(seconds), 4),
+        "rows_per_second": round(rows / median, 1),
+        "mb_per_second": round(os.path.getsize(path) / median / (1024 * 1024), 2),
+        "issues": samples[0][1],
+        "peak_rss_mb": max(rss for _, _, rss in samples),
+    }
+
+
+def run_engine(templates: List[str], sizes: List[int], rates: ErrorRates, seed: int, repeats: int,
+               data_dir: str) -> Dict[str, Dict[str, Any]]:
+    cases = {}
+    for template_id in templates:
+        for rows in sizes:
+            path = cached_sheet(data_dir, template_id, rows, seed, rates)
+            targets = [("validate", _validate)] + ([("barcodes", _barcodes)] if template_id == BARCODE_TEMPLATE else [])
+            for kind, target in targets:
+                name = f"{kind}/{template_id}/{rows}"
+                cases[name] = run_case(target, path, template_id, rows, repeats)
+                print(f"[BENCH] {name}: {cases[name]['rows_per_second']} rows/s, "
+                      f"peak RSS {cases[name]['peak_rss_mb']} MB")
+    return cases
@@ -0,0 +1,142 @@
+"""
+Synthetic sample sheets.
+
+generate_sheet() writes a CSV for any template with a column per field,
+named after the field. Output depends only on (template, rows, seed, error
+rates): every chunk of rows draws from its own generator seeded with
+(seed, chunk number).
+
+Values follow the field rules unless an error is injected:
+- *_ID fields hold "<FIELD><row number>", so IDs are unique and a field that
+  references another template's field (Library_ID, Sample_ID) matches the
+  rows of a sheet of that template with at least as many rows;
+- integer fields are drawn between their min and max;
+- pattern fields are drawn from PATTERN_VALUES.
+
+Each error rate is the fraction of cells (of the fields it applies to) that
+get that error: empty required cells, integers outside min/max (an
+out-of-range Lane), values failing the field pattern (a bad Capture_Area or
+index), and *_ID values repeating an earlier row.
+"""
+import os
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from templates import SCHEMA_TEMPLATES
+
+# Rows generated and written per step
+GENERATE_CHUNK_ROWS = 100000
+# Bases per index read, long enough that random index pairs of a large sheet rarely collide
+INDEX_LENGTH = 12
+
+CAPTURE_AREAS = np.array([f"{row}{column}" for row in "ABCD" for column in "1234"])
+BASES = np.array(list("ACGT"))
+
+
+def _ids(field_name: str, numbers: np.ndarray) -> pd.Series:
+    digits = pc.utf8_lpad(pc.cast(pa.array(numbers), pa.string()), 9, "0")
+    return pd.Series(pc.binary_join_element_wise(field_name[:-3].upper(), digits, "").to_numpy(zero_copy_only=False))
+
+
+def _barcodes(rng: np.random.Generator, count: int) -> np.ndarray:
+    bases = BASES[rng.integers(0, len(BASES), (count, INDEX_LENGTH))]
+    return bases.view(f"<U{INDEX_LENGTH}").ravel()
+
+
+# Valid values of each pattern used by the built-in templates
+PATTERN_VALUES = {
+    r"^[ATGCN]+$": _barcodes,
+    r"^[ATGCN]*$": _barcodes,
+    r"^[A-D][1-4]$": lambda rng, count: CAPTURE_AREAS[rng.integers(0, len(CAPTURE_AREAS), count)],
+}
+
+
+@dataclass(frozen=True)
+class ErrorRates:
+    empty_required: float = 0.0
+    out_of_range: float = 0.0
+    bad_pattern: float = 0.0
+    duplicate_ids: float = 0.0
+
+    def label(self) -> str:
+        return "-".join(f"{rate:g}" for rate in asdict(self).values())
+
+
+def _field_values(field: Dict[str, Any], rows: np.ndarray, rng: np.random.Generator) -> pd.Series:
+    name = field["name"]
+    if name.endswith("_ID"):
+        return _ids(name, rows)
+    if field["type"] == "integer":
+        low = field.get("min", 0)
+        high = field.get("max", low + 100000)
+        return pd.Series(rng.integers(low, high + 1, len(rows))).astype(str)
+    if "pattern" in field:
+        make = PATTERN_VALUES.get(field["pattern"])
+        if make is None:
+            raise ValueError(f"No generator for the pattern of field '{name}': {field['pattern']}")
+        return pd.Series(make(rng, len(rows)))
+    return name.upper() + "-" + pd.Series(rng.integers(0, 1000, len(rows))).astype(str)
+
+
+def _inject_errors(field: Dict[str, Any], values: pd.Series, rows: np.ndarray, rng: np.random.Generator,
+                   rates: ErrorRates) -> pd.Series:
+    def pick(rate: float) -> np.ndarray:
+        return rng.random(len(values)) < rate if rate > 0 else np.zeros(len(values), dtype=bool)
+
+    if field["name"].endswith("_ID"):
+        repeat = pick(rates.duplicate_ids) & (rows > 0)
+        earlier = (rng.random(int(repeat.sum())) * rows[repeat]).astype(np.int64)
+        values[repeat] = _ids(field["name"], earlier).to_numpy()
+    if field["type"] == "integer" and ("min" in field or "max" in field):
+        outside = pick(rates.out_of_range)
+        values[outside] = str(field["max"] + 1) if "max" in field else str(field["min"] - 1)
+    if "pattern" in field:
+        bad = pick(rates.bad_pattern)
+        values[bad] = "?" + values[bad]
+    if field["required"]:
+        values[pick(rates.empty_required)] = ""
+    return values
+
+
+def generate_sheet(path: str, template_id: str, rows: int, seed: int = 0,
+                   rates: Optional[ErrorRates] = None) -> str:
+    """Write a sheet of `rows` data rows for a built-in template to path."""
+    template = SCHEMA_TEMPLATES[template_id]
+    rates = rates or ErrorRates()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    part = f"{path}.{os.getpid()}.part"
+    try:
+        with open(part, "w", newline="") as f:
+            for chunk, start in enumerate(range(0, max(rows, 1), GENERATE_CHUNK_ROWS)):
+                numbers = np.arange(start, min(start + GENERATE_CHUNK_ROWS, rows))
+                rng = np.random.default_rng([seed, chunk])
+                frame = pd.DataFrame({
+                    field["name"]: _inject_errors(field, _field_values(field, numbers, rng), numbers, rng, rates)
+                    for field in template["fields"]
+                })
+                frame.to_csv(f, header=chunk == 0, index=False)
+        os.replace(part, path)
+    finally:
+        if os.path.exists(part):
+            os.remove(part)
+    return path
+
+
+def cached_sheet(data_dir: str, template_id: str, rows: int, seed: int = 0,
+                 rates: Optional[ErrorRates] = None) -> str:
+    """Path of a generated sheet in data_dir, generating it the first time."""
+    rates = rates or ErrorRates()
+    path = os.path.join(data_dir, f"{template_id}-{rows}-{seed}-{rates.label()}.csv")
+    if not os.path.exists(path):
+        generate_sheet(path, template_id, rows, seed, rates)
+    return path
+
+
+def identity_mapping(template_id: str) -> Dict[str, str]:
+    """Column mapping of a generated sheet: every field to its own column."""
+    return {field["name"]: field["name"] for field in SCHEMA_TEMPLATES[template_id]["fields"]}
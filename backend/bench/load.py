@@ -0,0 +1,143 @@
+"""
+End-to-end load test of the API.
+
+Starts the FastAPI app in this process under uvicorn, with Mongo replaced by
+an in-memory stand-in (mongomock-motor) and runs processed by the in-API
+workers, signs up a user and submits RUNS runs, CONCURRENCY at a time. Each
+run uploads one generated sheet per template, with its own seed and file
+names, so neither the result cache nor incremental revalidation short-cut
+it; runs are polled through GET /api/v1/runs/{run_id} until they finish.
+
+Peak RSS is reported for the API process (which also holds the client and
+the request bodies) and for the largest validation worker process.
+"""
+import json
+import os
+import resource
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from bench_login import latency_report
+
+from .generate import ErrorRates, cached_sheet, identity_mapping
+from .results import peak_rss_mb
+
+# Seconds between polls of a submitted run
+LOAD_POLL_SECONDS = 0.1
+# Seconds a run may take before the load test gives up on it
+LOAD_RUN_TIMEOUT_SECONDS = 3600
+
+BENCH_USER = {"email": "bench@example.com", "name": "Bench", "password": "bench-password-1"}
+
+
+def _start_api(port: int):
+    """Import the app against the Mongo stand-in and serve it on a background thread."""
+    try:
+        import motor.motor_asyncio
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        raise SystemExit("[BENCH] The load test needs mongomock-motor (pip install mongomock-motor)")
+    import uvicorn
+
+    os.environ["MONGODB_URI"] = "mongodb://bench.invalid"
+    os.environ.setdefault("JWT_SECRET", "bench-secret")
+    os.environ["RUN_WORKERS_IN_API"] = "true"
+    os.environ["RUN_EVENTS_BACKEND"] = "local"
+    motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+    import main
+
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise SystemExit("[BENCH] The API failed to start")
+        time.sleep(0.05)
+    bound = server.servers[0].sockets[0].getsockname()[1]
+    return server, thread, f"http://127.0.0.1:{bound}"
+
+
+def _multipart(files: List[Tuple[str, str]], mapping: List[Dict[str, Any]]) -> Tuple[bytes, str]:
+    """Body and content type of a POST /api/v1/runs form: (upload name, path) files and the mapping."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, path in files:
+        with open(path, "rb") as f:
+            content = f.read()
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="files"; filename="{name}"\r\n'
+            f"Content-Type: text/csv\r\n\r\n".encode() + content + b"\r\n"
+        )
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="mapping"\r\n\r\n{json.dumps(mapping)}\r\n'.encode()
+    )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def _request(url: str, token: Optional[str] = None, data: Optional[bytes] = None,
+             content_type: str = "application/json") -> Any:
+    headers = {"Content-Type": content_type}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data, headers=headers), timeout=600) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        raise SystemExit(f"[BENCH] {url} failed with HTTP {e.code}: {e.read().decode(errors='replace')}")
+
+
+def run_load(templates: List[str], rows: int, runs: int, concurrency: int, rates: ErrorRates, seed: int,
+             data_dir: str, port: int = 0) -> Dict[str, Dict[str, Any]]:
+    # Every run gets its own sheets, generated before the clock starts
+    bodies = []
+    for n in range(runs):
+        files = [(f"{template_id}-{n}.csv", cached_sheet(data_dir, template_id, rows, seed + n, rates))
+                 for template_id in templates]
+        mapping = [{"fileName": name, "templateId": template_id, "mapping": identity_mapping(template_id)}
+                   for (name, _), template_id in zip(files, templates)]
+        bodies.append(_multipart(files, mapping))
+
+    server, thread, url = _start_api(port)
+    try:
+        token = _request(f"{url}/api/v1/auth/signup", data=json.dumps(BENCH_USER).encode())["access_token"]
+
+        def submit_and_wait(n: int) -> Tuple[float, float, str]:
+            started = time.perf_counter()
+            run_id = _request(f"{url}/api/v1/runs", token, *bodies[n])["run_id"]
+            submitted = time.perf_counter() - started
+            while time.perf_counter() - started < LOAD_RUN_TIMEOUT_SECONDS:
+                run = _request(f"{url}/api/v1/runs/{run_id}", token)
+                if run["status"] in ("complete", "failed"):
+                    return submitted, time.perf_counter() - started, run["status"]
+                time.sleep(LOAD_POLL_SECONDS)
+            raise SystemExit(f"[BENCH] Run {run_id} did not finish within {LOAD_RUN_TIMEOUT_SECONDS}s")
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(submit_and_wait, range(runs)))
+        elapsed = time.perf_counter() - started
+    finally:
+        server.should_exit = True
+        thread.join()
+
+    total_rows = rows * len(templates) * runs
+    return {f"runs/{len(templates)}x{rows}": {
+        "rows": total_rows,
+        "runs": runs,
+        "concurrency": concurrency,
+        "failed": sum(1 for _, _, status in outcomes if status != "complete"),
+        "seconds": round(elapsed, 3),
+        "runs_per_second": round(runs / elapsed, 3),
+        "rows_per_second": round(total_rows / elapsed, 1),
+        "submit": latency_report([submitted for submitted, _, _ in outcomes]),
+        "complete": latency_report([done for _, done, _ in outcomes]),
+        "peak_rss_mb": peak_rss_mb(),
+        # Worker processes are reaped when the API shuts down its pool
+        "worker_peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }}
@@ -0,0 +1,63 @@
+"""
+Benchmark result files.
+
+Every benchmark writes one JSON document:
+
+    {"kind": "engine" | "load", "created_at": ..., "machine": {...},
+     "settings": {...}, "cases": {name: {"rows_per_second": ..., "peak_rss_mb": ..., ...}}}
+
+A result kept as a baseline is compared with a later one case by case
+(compare.py); only results of the same kind and settings are comparable.
+"""
+import json
+import os
+import platform
+import resource
+import sys
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+# Results are written here unless --output says otherwise
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    """Peak resident set size of this process (or of its largest finished child) in MB."""
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def machine_info() -> Dict[str, Any]:
+    import numpy
+    import pandas
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "pandas": pandas.__version__,
+        "numpy": numpy.__version__,
+    }
+
+
+def write_results(kind: str, settings: Dict[str, Any], cases: Dict[str, Dict[str, Any]],
+                  output: Optional[str] = None) -> str:
+    """Write a result document and return its path (default: results/<kind>-<timestamp>.json)."""
+    created_at = datetime.now()
+    path = output or os.path.join(RESULTS_DIR, f"{kind}-{created_at:%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({
+            "kind": kind,
+            "created_at": created_at.isoformat(timespec="seconds"),
+            "machine": machine_info(),
+            "settings": settings,
+            "cases": cases,
+        }, f, indent=2)
+        f.write("\n")
+    return path
+
+
+def load_results(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        return json.load(f)
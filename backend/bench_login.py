@@ -0,0 +1,89 @@
+"""
+Login latency benchmark.
+
+Sends REQUESTS logins to a running API, CONCURRENCY at a time, while polling
+/healthz, and reports p50/p99 latency of both. /healthz staying fast during
+the burst shows password hashing is not blocking the event loop.
+
+    python -m bench_login --email user@example.com --password '...' \\
+        [--url http://localhost:8000] [--concurrency 16] [--requests 200]
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def timed_request(request: urllib.request.Request) -> float:
+    """Seconds taken by the request; raises on a non-2xx response."""
+    started = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=60) as response:
+        response.read()
+    return time.perf_counter() - started
+
+
+def latency_report(samples: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 1),
+        "p99_ms": round(percentile(samples, 99) * 1000, 1),
+        "max_ms": round(max(samples) * 1000, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    body = json.dumps({"email": args.email, "password": args.password}).encode()
+
+    def login(_: int) -> float:
+        return timed_request(urllib.request.Request(
+            f"{args.url}/api/v1/auth/login", data=body, headers={"Content-Type": "application/json"}
+        ))
+
+    health: List[float] = []
+    done = threading.Event()
+
+    def poll_health() -> None:
+        while not done.is_set():
+            health.append(timed_request(urllib.request.Request(f"{args.url}/healthz")))
+            time.sleep(0.05)
+
+    poller = threading.Thread(target=poll_health, daemon=True)
+    started = time.perf_counter()
+    poller.start()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            logins = list(pool.map(login, range(args.requests)))
+    except urllib.error.HTTPError as e:
+        raise SystemExit(f"[BENCH] Login failed with HTTP {e.code}: {e.read().decode(errors='replace')}")
+    finally:
+        done.set()
+        poller.join()
+    elapsed = time.perf_counter() - started
+
+    print(json.dumps({
+        "concurrency": args.concurrency,
+        "logins_per_second": round(len(logins) / elapsed, 1),
+        "login": latency_report(logins),
+        "healthz": latency_report(health) if health else None,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Cross-file referential integrity.
+
+Template fields can reference a field of another template (templates.py),
+e.g. the Library_ID of a 10x sheet must be a Library_ID of the run's
+Illumina run sheet. After every file of a run has been validated on its
+own, each file is read once more for just its key columns (the fields it
+references or that others reference) and each key value is reduced to a
+64-bit hash. The hashes of a referenced field, over all of the run's files
+of its template, form one hash index per key; every referencing value is
+looked up in it. Work is linear in the run's total rows, and only the rows
+that fail are read again, to quote their values in the issues.
+
+A reference is only checked when the run has a file of the referenced
+template and every such file could be read and has the referenced column;
+otherwise the per-file issues already say what is missing.
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from templates import template_registry
+from validation import ROW_NUMBER_OFFSET, CsvSource, hash_values, make_issue, read_csv_source
+
+# Rows read per chunk when collecting key columns
+CROSSFILE_CHUNK_ROWS = 200000
+
+# A run's mapped file: (file name, template id, column mapping)
+RunFile = Tuple[str, str, Dict[str, str]]
+# Positions (data rows) of a column's non-empty cells and the hashes of their values
+KeyHashes = Tuple[np.ndarray, np.ndarray]
+
+
+@dataclass(frozen=True)
+class Reference:
+    """Values of template_id.field must appear in target_template.target_field."""
+    template_id: str
+    field: str
+    target_template: str
+    target_field: str
+
+
+def run_references(files: List[RunFile]) -> List[Reference]:
+    """References between the templates of a run's files, in file and field order."""
+    present = {template_id for _, template_id, _ in files}
+    references = []
+    for template_id in dict.fromkeys(template_id for _, template_id, _ in files):
+        template = template_registry.get(template_id)
+        for field in (template or {}).get("fields", []):
+            target = field.get("references")
+            if target and target["template"] in present:
+                references.append(Reference(template_id, field["name"], target["template"], target["field"]))
+    return references
+
+
+def key_columns(references: List[Reference], template_id: str, column_mapping: Dict[str, str]) -> Dict[str, str]:
+    """CSV column of each key field a file of template_id takes part in, by field name."""
+    fields = [r.field for r in references if r.template_id == template_id]
+    fields += [r.target_field for r in references if r.target_template == template_id]
+    return {field: column_mapping[field] for field in dict.fromkeys(fields) if (column_mapping or {}).get(field)}
+
+
+# ============== Worker Functions ==============
+
+def key_hashes(source: CsvSource, columns: Dict[str, str]) -> Optional[Dict[str, KeyHashes]]:
+    """
+    One pass over a file's key columns, as text. Returns each field's
+    present positions and value hashes (fields whose column is missing from
+    the file are left out), or None if the file cannot be read.
+    """
+    wanted = set(columns.values())
+    parts: Dict[str, List[KeyHashes]] = {field: [] for field in columns}
+    try:
+        with read_csv_source(source, usecols=lambda c: c in wanted, dtype=str, na_filter=False,
+                             chunksize=CROSSFILE_CHUNK_ROWS) as reader:
+            offset = 0
+            found = None
+            for chunk in reader:
+                found = set(chunk.columns)
+                for field, column in columns.items():
+                    if column not in found:
+                        continue
+                    values = chunk[column].str.strip()
+                    present = np.flatnonzero(values.ne("").to_numpy(dtype=bool))
+                    parts[field].append((present + offset, hash_values(values.iloc[present])))
+                offset += len(chunk)
+    except Exception:
+        return None
+    if found is None:
+        found = set(read_csv_source(source, nrows=0, dtype=str).columns)
+    return {
+        field: (
+            np.concatenate([p for p, _ in chunks]) if chunks else np.zeros(0, dtype=np.intp),
+            np.concatenate([h for _, h in chunks]) if chunks else np.zeros(0, dtype=np.uint64),
+        )
+        for field, chunks in parts.items() if columns[field] in found
+    }
+
+
+def key_values(source: CsvSource, column: str, positions: np.ndarray) -> List[str]:
+    """The stripped text of one column at the given (sorted) positions."""
+    wanted = np.asarray(positions)
+    values: List[str] = []
+    with read_csv_source(source, usecols=[column], dtype=str, na_filter=False,
+                         chunksize=CROSSFILE_CHUNK_ROWS) as reader:
+        offset = 0
+        for chunk in reader:
+            lo, hi = np.searchsorted(wanted, [offset, offset + len(chunk)])
+            if hi > lo:
+                values.extend(chunk[column].iloc[wanted[lo:hi] - offset].str.strip().tolist())
+            offset += len(chunk)
+    return values
+
+
+# ============== Checks ==============
+
+def build_indexes(references: List[Reference], files: List[RunFile],
+                  hashes: List[Optional[Dict[str, KeyHashes]]]) -> Dict[Tuple[str, str], np.ndarray]:
+    """
+    Distinct hashes of every referenced field over the run's files of
+    its template. Targets with an unreadable file or a missing column are
+    left out.
+    """
+    indexes = {}
+    for target in dict.fromkeys((r.target_template, r.target_field) for r in references):
+        template_id, field = target
+        found = [file_hashes.get(field) if file_hashes is not None else None
+                 for (_, file_template, _), file_hashes in zip(files, hashes) if file_template == template_id]
+        if found and all(f is not None for f in found):
+            indexes[target] = pd.unique(np.concatenate([h for _, h in found]))
+    return indexes
+
+
+def find_orphans(references: List[Reference], files: List[RunFile], hashes: List[Optional[Dict[str, KeyHashes]]],
+                 indexes: Dict[Tuple[str, str], np.ndarray]) -> Dict[int, List[Tuple[Reference, np.ndarray]]]:
+    """Positions of referencing values missing from their index, by file number."""
+    orphans: Dict[int, List[Tuple[Reference, np.ndarray]]] = {}
+    for reference in references:
+        index = indexes.get((reference.target_template, reference.target_field))
+        if index is None:
+            continue
+        for n, ((_, template_id, _), file_hashes) in enumerate(zip(files, hashes)):
+            if template_id != reference.template_id or not file_hashes or reference.field not in file_hashes:
+                continue
+            positions, values = file_hashes[reference.field]
+            missing = ~pd.Series(values).isin(index).to_numpy()
+            if missing.any():
+                orphans.setdefault(n, []).append((reference, positions[missing]))
+    return orphans
+
+
+def orphan_issues(file_name: str, failures: List[Tuple[Reference, np.ndarray, List[str]]]) -> List[Dict[str, Any]]:
+    """Blockers for a file's unmatched references, field by field, then row by row (ids are assigned later)."""
+    issues = []
+    for reference, positions, values in failures:
+        target = template_registry.get(reference.target_template) or {}
+        target_name = target.get("name", reference.target_template)
+        for position, value in zip(positions.tolist(), values):
+            issues.append(make_issue(
+                None, "Blocker", file_name, position + ROW_NUMBER_OFFSET, reference.field,
+                f"{reference.field} '{value}' not found in {reference.target_field} of any {target_name} file"
+            ))
+    return issues
@@ -0,0 +1,46 @@
+"""
+Mongo client settings.
+
+Every process (each API worker, `python -m worker`, the maintenance
+scripts) opens its own Motor client through create_client(), so pool sizes
+and timeouts come from one place. Pool sizes are per process: with
+WEB_CONCURRENCY API workers, the API alone may hold up to
+WEB_CONCURRENCY x MONGO_MAX_POOL_SIZE connections, which must fit the
+cluster's connection limit along with any standalone workers.
+"""
+import os
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from metrics import mongo_metrics
+
+# Connections per process: at most, and at least kept open even when idle (defaults: pymongo's 100 and 0)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+# Idle connections are closed after this long; 0 keeps them (default: 0)
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "0"))
+# Time to wait for a pooled connection when all are in use before failing (default: 0, wait indefinitely)
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "0"))
+# Timeouts for finding a usable server, opening a connection and a socket read (defaults: 30000, 20000, none)
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "30000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "20000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0"))
+
+
+def client_options() -> dict:
+    """Keyword arguments for AsyncIOMotorClient from the settings above; limits set to 0 are left out."""
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+    }
+    for name, value in (("maxIdleTimeMS", MONGO_MAX_IDLE_TIME_MS), ("waitQueueTimeoutMS", MONGO_WAIT_QUEUE_TIMEOUT_MS),
+                        ("socketTimeoutMS", MONGO_SOCKET_TIMEOUT_MS)):
+        if value:
+            options[name] = value
+    return options
+
+
+def create_client(uri: str) -> AsyncIOMotorClient:
+    return AsyncIOMotorClient(uri, event_listeners=[mongo_metrics], **client_options())
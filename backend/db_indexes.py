@@ -0,0 +1,204 @@
+"""
+MongoDB index specification.
+
+Every index the app relies on is declared in INDEXES and created
+idempotently on startup (by the API and by `python -m worker`). hot_queries()
+lists the shapes of the app's frequent queries; index_report() runs explain()
+on each so a query that falls back to a collection scan or an in-memory sort
+shows up. Both are available from the command line:
+
+    python -m db_indexes            # create missing indexes
+    python -m db_indexes --report   # explain the hot queries
+"""
+import argparse
+import asyncio
+import json
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from issues import ISSUE_SORT, PART_SORT
+
+INDEX_OPTIONS_CONFLICT = 85
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    collection: str
+    keys: List[Tuple[str, int]]
+    options: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def name(self) -> str:
+        """Mongo's default index name, so indexes created before this spec are recognised."""
+        return "_".join(f"{key}_{direction}" for key, direction in self.keys)
+
+
+INDEXES = [
+    IndexSpec("users", [("email", ASCENDING)], {"unique": True}),
+    IndexSpec("mapping_configurations", [("user_id", ASCENDING), ("created_at", DESCENDING)]),
+    # list_runs: a user's runs, newest first, paged on (created_at, _id)
+    IndexSpec("harmonization_runs", [("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+    # Run queue: oldest pending run first, and expired leases
+    IndexSpec("harmonization_runs", [("status", ASCENDING), ("created_at", ASCENDING)]),
+    IndexSpec("harmonization_runs", [("status", ASCENDING), ("lease_expires_at", ASCENDING)]),
+    IndexSpec("validation_issues", [("run_id", ASCENDING)] + ISSUE_SORT),
+    # Grouped issues: parts merged into issue pages, and groups in the order found
+    IndexSpec("issue_groups", [("run_id", ASCENDING)] + PART_SORT),
+    IndexSpec("issue_groups", [("run_id", ASCENDING), ("part", ASCENDING), ("group", ASCENDING)]),
+    IndexSpec("schema_templates", [("template_id", ASCENDING)], {"unique": True}),
+    # Result cache eviction: least recently used first
+    IndexSpec("validation_cache", [("last_used_at", ASCENDING)]),
+]
+
+
+def index_specs() -> List[IndexSpec]:
+    """INDEXES plus the audit log index, a TTL index when AUDIT_RETENTION_DAYS is set."""
+    retention_days = int(os.getenv("AUDIT_RETENTION_DAYS", "0"))
+    options = {"expireAfterSeconds": retention_days * 24 * 3600} if retention_days > 0 else {}
+    return INDEXES + [IndexSpec("audit_logs", [("timestamp", ASCENDING)], options)]
+
+
+async def _replace_index(collection, spec: IndexSpec) -> None:
+    await collection.drop_index(spec.name)
+    await collection.create_index(spec.keys, **spec.options)
+
+
+async def ensure_indexes(db, specs: Optional[List[IndexSpec]] = None) -> None:
+    """
+    Create every declared index that does not exist yet. An index whose TTL
+    retention changed is updated in place, or rebuilt when retention was
+    turned off (or cannot be added in place); any other conflict (or a
+    unique index that existing data violates) is logged rather than
+    stopping startup.
+    """
+    for spec in specs or index_specs():
+        collection = db[spec.collection]
+        try:
+            await collection.create_index(spec.keys, **spec.options)
+        except OperationFailure as e:
+            existing = (await collection.index_information()).get(spec.name, {})
+            try:
+                if e.code == INDEX_OPTIONS_CONFLICT and "expireAfterSeconds" in spec.options:
+                    try:
+                        await db.command("collMod", spec.collection, index={
+                            "name": spec.name, "expireAfterSeconds": spec.options["expireAfterSeconds"]
+                        })
+                    except OperationFailure:
+                        # Servers before 5.1 cannot make an existing index a TTL index
+                        await _replace_index(collection, spec)
+                    print(f"[INDEXES] Updated retention of {spec.collection}.{spec.name}")
+                elif "expireAfterSeconds" in existing:
+                    await _replace_index(collection, spec)
+                    print(f"[INDEXES] Removed retention of {spec.collection}.{spec.name}")
+                else:
+                    print(f"[INDEXES] Could not create {spec.collection}.{spec.name}: {e}")
+            except OperationFailure as error:
+                print(f"[INDEXES] Could not update {spec.collection}.{spec.name}: {error}")
+
+
+# ============== Hot Query Report ==============
+
+@dataclass(frozen=True)
+class HotQuery:
+    name: str
+    collection: str
+    filter: Dict[str, Any]
+    sort: Optional[List[Tuple[str, int]]] = None
+
+
+def hot_queries() -> List[HotQuery]:
+    """The app's frequent queries, with placeholder values."""
+    some_id = ObjectId()
+    now = datetime.utcnow()
+    return [
+        HotQuery("auth: user by email", "users", {"email": "user@example.com"}),
+        HotQuery("mappings: by user", "mapping_configurations", {"user_id": some_id}),
+        HotQuery("runs: list page", "harmonization_runs", {"user_id": some_id},
+                 [("created_at", DESCENDING), ("_id", DESCENDING)]),
+        HotQuery("runs: next list page", "harmonization_runs", {"user_id": some_id, "$or": [
+            {"created_at": {"$lt": now}}, {"created_at": now, "_id": {"$lt": some_id}}
+        ]}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+        HotQuery("runs: by id and owner", "harmonization_runs", {"_id": some_id, "user_id": some_id}),
+        HotQuery("queue: claim", "harmonization_runs", {"$or": [
+            {"status": "pending"}, {"status": "running", "lease_expires_at": {"$lt": now}}
+        ]}, [("created_at", ASCENDING)]),
+        HotQuery("queue: exhausted leases", "harmonization_runs",
+                 {"status": "running", "lease_expires_at": {"$lt": now}}),
+        HotQuery("issues: page", "validation_issues", {"run_id": some_id}, ISSUE_SORT),
+        HotQuery("issues: by severity", "validation_issues", {"run_id": some_id, "severity": "Blocker"}, ISSUE_SORT),
+        HotQuery("issues: grouped page", "issue_groups", {"run_id": some_id}, PART_SORT),
+        HotQuery("issues: groups page", "issue_groups", {"run_id": some_id, "part": 0}, [("group", ASCENDING)]),
+        HotQuery("templates: by id", "schema_templates", {"template_id": "illumina-ngs-run-v1.2"}),
+        HotQuery("result cache: lookup", "validation_cache", {"_id": "0" * 64}),
+        HotQuery("result cache: eviction order", "validation_cache", {"last_used_at": {"$gt": datetime.min}},
+                 [("last_used_at", ASCENDING)]),
+    ]
+
+
+def _plan_stages(plan: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Flatten a query plan tree into its stages."""
+    stages = [plan]
+    for key in ("inputStage", "queryPlan"):
+        if isinstance(plan.get(key), dict):
+            stages += _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += _plan_stages(child)
+    return stages
+
+
+async def explain_query(db, query: HotQuery) -> Dict[str, Any]:
+    cursor = db[query.collection].find(query.filter)
+    if query.sort:
+        cursor = cursor.sort(query.sort)
+    explained = await cursor.limit(100).explain()
+    stages = _plan_stages(explained["queryPlanner"]["winningPlan"])
+    names = [stage.get("stage") for stage in stages]
+    return {
+        "query": query.name,
+        "collection": query.collection,
+        "stages": names,
+        "indexes": sorted({stage["indexName"] for stage in stages if "indexName" in stage}),
+        "collscan": "COLLSCAN" in names,
+        "in_memory_sort": "SORT" in names,
+    }
+
+
+async def index_report(db) -> List[Dict[str, Any]]:
+    """explain() every hot query; entries with collscan or in_memory_sort need an index."""
+    return [await explain_query(db, query) for query in hot_queries()]
+
+
+async def main() -> None:
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Create MDO indexes or report how hot queries use them.")
+    parser.add_argument("--report", action="store_true", help="explain the hot queries instead of creating indexes")
+    args = parser.parse_args()
+
+    load_dotenv()
+    # Reads its settings on import, so only after .env is loaded
+    from database import create_client
+
+    mongodb_uri = os.getenv("MONGODB_URI")
+    if not mongodb_uri:
+        raise ValueError("MONGODB_URI environment variable is required")
+    db = create_client(mongodb_uri).get_database(os.getenv("DATABASE_NAME", "mdo"))
+
+    if args.report:
+        report = await index_report(db)
+        print(json.dumps(report, indent=2))
+        if any(entry["collscan"] or entry["in_memory_sort"] for entry in report):
+            raise SystemExit(1)
+    else:
+        await ensure_indexes(db)
+        print(f"[INDEXES] Ensured {len(index_specs())} index(es)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,206 @@
+"""
+Run event fan-out.
+
+Workers publish run events (status changes, per-file results, progress) to
+run_events; GET /api/v1/runs/{run_id}/events streams them to the browser as
+Server-Sent Events. Each process keeps one in-memory hub of listeners per
+run, and every event reaches the hub through a broadcast backend:
+
+- "local": events only reach listeners in the publishing process (enough
+  when runs are processed inside a single API process, without API
+  workers);
+- "mongo": events are appended to the capped `run_events` collection, which
+  every process tails with one cursor, so listeners on any API process see
+  events published by any worker.
+
+Listeners never query the run; a connected client costs no Mongo reads.
+"""
+import asyncio
+import os
+from datetime import datetime
+from typing import Any, Dict, Optional, Set
+
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+# "local" or "mongo" (default: local when runs are processed in a single
+# API process, else mongo; with WEB_CONCURRENCY > 1 a run's events may be
+# published by a different API worker than the one streaming them)
+RUN_EVENTS_BACKEND = os.getenv("RUN_EVENTS_BACKEND") or (
+    "local" if os.getenv("RUN_WORKERS_IN_API", "true").lower() == "true"
+    and int(os.getenv("WEB_CONCURRENCY", "1")) <= 1 else "mongo"
+)
+# Size of the capped run_events collection used by the mongo backend (default: 16 MB)
+RUN_EVENTS_CAPPED_BYTES = int(os.getenv("RUN_EVENTS_CAPPED_BYTES", str(16 * 1024 * 1024)))
+# Events buffered per listener; a slow client loses the oldest ones first
+RUN_EVENTS_LISTENER_QUEUE = 100
+# Events waiting to be written by the mongo backend before new ones are dropped
+RUN_EVENTS_WRITE_QUEUE = 10000
+# Most events the mongo backend writes per insert_many
+RUN_EVENTS_WRITE_BATCH = 500
+
+TERMINAL_STATUSES = ("complete", "failed")
+
+
+class Subscription:
+    """Events of one run for one listener, in publish order."""
+
+    def __init__(self, hub: "RunEvents", run_id: str):
+        self._hub = hub
+        self.run_id = run_id
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=RUN_EVENTS_LISTENER_QUEUE)
+
+    def put(self, event: Dict[str, Any]) -> None:
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(event)
+
+    async def get(self) -> Dict[str, Any]:
+        return await self._queue.get()
+
+    def close(self) -> None:
+        self._hub._unsubscribe(self)
+
+
+class LocalBroadcast:
+    """Delivers events straight to the listeners of this process."""
+
+    async def start(self, hub: "RunEvents", db) -> None:
+        self._hub = hub
+
+    def publish(self, run_id: str, event: Dict[str, Any]) -> None:
+        self._hub.deliver(run_id, event)
+
+    async def stop(self) -> None:
+        pass
+
+
+class MongoBroadcast:
+    """
+    Shares events between processes through a capped collection: published
+    events are written in the background, in order and in batches, and one
+    tailable cursor per process feeds them to the local hub. The collection
+    is seeded with a sentinel document (never delivered), since a tailable
+    cursor on an empty collection closes straight away.
+    """
+
+    def __init__(self, capped_bytes: int = RUN_EVENTS_CAPPED_BYTES):
+        self._capped_bytes = capped_bytes
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=RUN_EVENTS_WRITE_QUEUE)
+        self._tasks = []
+        self.dropped = 0
+
+    async def start(self, hub: "RunEvents", db) -> None:
+        self._hub = hub
+        try:
+            await db.create_collection("run_events", capped=True, size=self._capped_bytes)
+        except CollectionInvalid:
+            pass
+        self._collection = db.run_events
+        if await self._collection.find_one({}, {"_id": 1}) is None:
+            await self._collection.insert_one({"sentinel": True, "at": datetime.utcnow()})
+        self._tasks = [asyncio.create_task(self._write()), asyncio.create_task(self._tail())]
+
+    def publish(self, run_id: str, event: Dict[str, Any]) -> None:
+        try:
+            self._outbox.put_nowait({"run_id": run_id, "event": event, "at": datetime.utcnow()})
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _write(self) -> None:
+        while True:
+            # Whatever queued up during the last write goes out in one insert
+            batch = [await self._outbox.get()]
+            while len(batch) < RUN_EVENTS_WRITE_BATCH and not self._outbox.empty():
+                batch.append(self._outbox.get_nowait())
+            try:
+                await self._collection.insert_many(batch)
+            except Exception as e:
+                print(f"[EVENTS] Failed to publish {len(batch)} event(s): {e}")
+
+    async def _tail(self) -> None:
+        last_id = None
+        while True:
+            try:
+                if last_id is None:
+                    # Events written before this process started are not replayed
+                    newest = await self._collection.find_one({}, {"_id": 1}, sort=[("$natural", -1)])
+                    last_id = newest["_id"] if newest else None
+                # Starting at the last document seen keeps the cursor from matching nothing, which closes it
+                query = {"_id": {"$gte": last_id}} if last_id else {}
+                cursor = self._collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    async for doc in cursor:
+                        if doc["_id"] == last_id:
+                            continue
+                        last_id = doc["_id"]
+                        if "run_id" in doc:
+                            self._hub.deliver(doc["run_id"], doc["event"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[EVENTS] Tailing run_events failed: {e}")
+            # The cursor dies when the collection rolls over past it; reopen it
+            await asyncio.sleep(1)
+
+
+class RunEvents:
+    """In-process pub/sub hub of run events."""
+
+    def __init__(self):
+        self._listeners: Dict[str, Set[Subscription]] = {}
+        self._backend = None
+
+    async def start(self, db, backend: str = RUN_EVENTS_BACKEND) -> None:
+        if backend not in ("local", "mongo"):
+            raise ValueError(f"Unknown RUN_EVENTS_BACKEND: {backend}")
+        self._backend = MongoBroadcast() if backend == "mongo" else LocalBroadcast()
+        await self._backend.start(self, db)
+        print(f"[EVENTS] Broadcasting run events through the {backend} backend")
+
+    async def stop(self) -> None:
+        if self._backend is not None:
+            await self._backend.stop()
+            self._backend = None
+
+    def publish(self, run_id, event: Dict[str, Any]) -> None:
+        """Send an event to every listener of a run, in any process. Never blocks."""
+        event = {"run_id": str(run_id), **event}
+        if self._backend is None:
+            self.deliver(str(run_id), event)
+        else:
+            self._backend.publish(str(run_id), event)
+
+    def subscribe(self, run_id: str) -> Subscription:
+        subscription = Subscription(self, run_id)
+        self._listeners.setdefault(run_id, set()).add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription: Subscription) -> None:
+        listeners = self._listeners.get(subscription.run_id)
+        if listeners is not None:
+            listeners.discard(subscription)
+            if not listeners:
+                del self._listeners[subscription.run_id]
+
+    def deliver(self, run_id: str, event: Dict[str, Any]) -> None:
+        """Hand an event to this process's listeners of a run."""
+        for subscription in self._listeners.get(run_id, ()):
+            subscription.put(event)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "runs": len(self._listeners),
+            "listeners": sum(len(listeners) for listeners in self._listeners.values()),
+            "dropped": getattr(self._backend, "dropped", 0),
+        }
+
+
+# Process-wide hub; started by the API and by `python -m worker`
+run_events = RunEvents()
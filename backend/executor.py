@@ -0,0 +1,353 @@
+"""
+Process-pool execution of CPU-bound validation.
+
+Validation runs in a ProcessPoolExecutor so large files never block the API's
+event loop. Each file of a run is its own job; files larger than
+VALIDATION_SPLIT_BYTES are cut into row ranges that validate on separate
+workers and are merged back, with _ID uniqueness resolved across the pieces.
+Workers send a file's issues back grouped (issue_groups.py), so a rule that
+fails on every row crosses the process boundary as one group.
+Spooled uploads are passed to workers by path and read there through mmap, so
+file contents never cross the process boundary.
+"""
+import asyncio
+import io
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from validation import (
+    CHECK_DUPLICATE, ROW_NUMBER_OFFSET, CsvSource, SeenValues, ValidationPlan, column_kind,
+    dtype_overrides, field_failures, hash_values, make_issue, merge_kinds, ordered_failures,
+    STREAM_THRESHOLD_BYTES, plan_cache, present_strings, rule_status, source_size, validate_content_grouped,
+)
+from barcodes import BarcodeRule, barcode_collisions
+from issue_groups import GroupBuilder, IssueGroup, group_issues
+from columnar import convert_to_columnar
+from crossfile import KeyHashes, key_hashes, key_values
+from revalidation import validate_with_state
+from metrics import count_rows, merge_stages, run_timed_job
+from uploads import mapped
+
+# Worker processes of this process's pool (default: the cores divided among
+# the API's WEB_CONCURRENCY worker processes, at least one each)
+VALIDATION_WORKERS = int(os.getenv(
+    "VALIDATION_WORKERS", str(max((os.cpu_count() or 1) // int(os.getenv("WEB_CONCURRENCY", "1")), 1))
+))
+# Jobs (files or file pieces) this instance runs at once
+VALIDATION_MAX_JOBS = int(os.getenv("VALIDATION_MAX_JOBS", str(VALIDATION_WORKERS)))
+# Files larger than this are split into pieces of about this size (0 disables splitting)
+VALIDATION_SPLIT_BYTES = int(os.getenv("VALIDATION_SPLIT_BYTES", str(64 * 1024 * 1024)))
+
+# Pieces send back the values of all their distinct _ID values when there are
+# at most this many, so duplicates across pieces rarely need a second lookup
+VALUE_SAMPLE_CAP = 4096
+
+# A piece of a file: the header ends at the first offset, rows span [start, stop)
+PieceRange = Tuple[int, int, int]
+
+_pool: Optional[ProcessPoolExecutor] = None
+_job_slots: Optional[asyncio.Semaphore] = None
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, not fork: the API process runs Motor's threads
+        _pool = ProcessPoolExecutor(
+            max_workers=VALIDATION_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+
+async def _run_job(fn, *args, stage: str = "parse"):
+    """
+    Run fn in the pool, waiting for a free job slot first. The job's time
+    goes to the current run's stage times (metrics.py), as `stage` where fn
+    does not say otherwise.
+    """
+    global _job_slots
+    if _job_slots is None:
+        _job_slots = asyncio.Semaphore(VALIDATION_MAX_JOBS)
+    async with _job_slots:
+        result, seconds, rows = await asyncio.get_running_loop().run_in_executor(
+            get_pool(), run_timed_job, fn, stage, *args
+        )
+    merge_stages(seconds, rows)
+    return result
+
+
+# ============== Worker Functions ==============
+
+def validate_grouped(source: CsvSource, file_name: str, plan: ValidationPlan) -> List[IssueGroup]:
+    return validate_content_grouped(source, file_name, plan)
+
+
+def validate_tracked(source: CsvSource, file_name: str, plan: ValidationPlan, row_state: str) -> List[IssueGroup]:
+    return group_issues(validate_with_state(source, file_name, plan, row_state))
+
+
+def read_piece(source: CsvSource, piece: PieceRange) -> bytes:
+    """The header plus one row range of a file."""
+    header_end, start, stop = piece
+    with mapped(source) as buffer:
+        return buffer[:header_end] + buffer[start:stop]
+
+
+def validate_piece(source: CsvSource, piece: PieceRange, plan: ValidationPlan,
+                   dtypes: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Validate one row range of a file (its header plus some data rows).
+    Duplicate checks are left to the parent: for every _ID field the piece
+    returns the positions and hashes of its non-empty values instead.
+    """
+    try:
+        df = pd.read_csv(io.BytesIO(read_piece(source, piece)), low_memory=False, dtype=dtypes)
+    except Exception as e:
+        return {"error": str(e)}
+    if not isinstance(df.index, pd.RangeIndex):
+        return {"error": "implicit index column"}
+
+    count_rows(len(df))
+    result = {
+        "rows": len(df),
+        "columns": list(df.columns),
+        "kinds": {c: column_kind(df[c]) for c in plan.columns if c in df.columns},
+        "batches": {},
+        "unique": {},
+    }
+    for n, rule in enumerate(plan.rules):
+        validate_rows, _ = rule_status(rule, df.columns)
+        if not validate_rows:
+            continue
+        column = df[rule.csv_column]
+        result["batches"][n] = field_failures(replace(rule, unique=False), column)
+        if rule.unique:
+            positions, values = present_strings(column)
+            hashes = hash_values(values)
+            first = ~pd.Series(hashes).duplicated(keep="first").to_numpy()
+            if first.sum() > VALUE_SAMPLE_CAP:
+                first &= pd.Series(hashes).duplicated(keep=False).to_numpy()
+            known = dict(zip(hashes[first].tolist(), values[first].tolist()))
+            result["unique"][n] = (positions, hashes, known)
+    return result
+
+
+def piece_values(source: CsvSource, piece: PieceRange, column: str, dtypes: Optional[Dict[str, Any]],
+                 positions: List[int]) -> List[str]:
+    """str(value).strip() of one column at the given row positions of a piece."""
+    df = pd.read_csv(io.BytesIO(read_piece(source, piece)), low_memory=False, dtype=dtypes, usecols=[column])
+    _, values = present_strings(df[column].iloc[positions])
+    return values.tolist()
+
+
+# ============== Splitting ==============
+
+def split_ranges(file_content, piece_bytes: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Byte ranges of the data rows, cut at line ends into pieces of about
+    piece_bytes. Returns None when the file should not be split: it is small,
+    or it contains quotes (a quoted field may span lines).
+    """
+    if piece_bytes <= 0 or len(file_content) <= piece_bytes or file_content.find(b'"') != -1:
+        return None
+    header_end = file_content.find(b"\n") + 1
+    if header_end == 0:
+        return None
+
+    pieces = math.ceil((len(file_content) - header_end) / piece_bytes)
+    bounds = [header_end]
+    for k in range(1, pieces):
+        cut = file_content.find(b"\n", header_end + k * piece_bytes)
+        if cut == -1 or cut + 1 <= bounds[-1]:
+            continue
+        bounds.append(cut + 1)
+    bounds.append(len(file_content))
+    ranges = [(start, stop) for start, stop in zip(bounds, bounds[1:]) if stop > start]
+    return ranges if len(ranges) > 1 else None
+
+
+async def _validate_split(source: CsvSource, file_name: str, plan: ValidationPlan, ranges: List[Tuple[int, int]],
+                          on_progress: Optional[Callable[[int], None]] = None) -> Optional[List[IssueGroup]]:
+    """
+    Validate row ranges on separate workers and merge them into exactly what
+    validating the whole file would return, grouped a field at a time so the
+    merged issues are never all held at once. Returns None if the pieces
+    could not be parsed on their own, in which case the caller validates the
+    file in one piece (which also yields the right parse error).
+    on_progress(bytes) is called as each piece finishes.
+    """
+    header_end = ranges[0][0]
+    pieces = [(header_end, start, stop) for start, stop in ranges]
+
+    async def validate(piece: PieceRange) -> Dict[str, Any]:
+        result = await _run_job(validate_piece, source, piece, plan)
+        if on_progress:
+            on_progress(piece[2] - piece[1])
+        return result
+
+    results = await asyncio.gather(*(validate(piece) for piece in pieces))
+    if any("error" in r for r in results):
+        return None
+
+    # A piece whose values parsed differently from the column as a whole
+    # (e.g. all ints where another piece has text) is validated again
+    kinds: Dict[str, str] = {}
+    for r in results:
+        for column, kind in r["kinds"].items():
+            kinds[column] = merge_kinds(kinds.get(column), kind)
+    dtypes = dtype_overrides(kinds)
+    redo = [
+        k for k, r in enumerate(results)
+        if any(kind not in (kinds[c], "empty") and c in dtypes for c, kind in r["kinds"].items())
+    ]
+    if redo:
+        redone = await asyncio.gather(*(_run_job(validate_piece, source, pieces[k], plan, dtypes) for k in redo))
+        for k, r in zip(redo, redone):
+            if "error" in r:
+                return None
+            results[k] = r
+
+    offsets = np.cumsum([0] + [r["rows"] for r in results])
+    duplicates = await asyncio.to_thread(_merge_duplicates, plan, results, offsets)
+
+    # Values for duplicates no piece sampled are read back from their pieces
+    for n, (rows, values, missing) in duplicates.items():
+        for k, local in missing.items():
+            found = await _run_job(piece_values, source, pieces[k], plan.rules[n].csv_column,
+                                   dtypes or None, [p for p, _ in local])
+            for (_, i), value in zip(local, found):
+                values[i] = value
+
+    builder = GroupBuilder()
+    columns = results[0]["columns"]
+    for n, rule in enumerate(plan.rules):
+        validate_rows, description = rule_status(rule, columns)
+        if description:
+            builder.add([(rule.name, "Blocker", None, description)])
+        if not validate_rows:
+            continue
+
+        batches = [
+            (positions + offsets[k], order, severity, descriptions)
+            for k, r in enumerate(results)
+            for positions, order, severity, descriptions in r["batches"].get(n, [])
+        ]
+        if n in duplicates:
+            rows, values, _ = duplicates[n]
+            batches.append((
+                np.asarray([row for row, _ in rows], dtype=np.int64), CHECK_DUPLICATE, "Warning",
+                [f"Duplicate value '{v}' (first seen in row {first})" for v, (_, first) in zip(values, rows)]
+            ))
+        builder.add(
+            (rule.name, severity, position + ROW_NUMBER_OFFSET, description)
+            for position, severity, description in ordered_failures(batches)
+        )
+
+    # If no issues found, add an info message
+    if builder.count == 0:
+        return group_issues([make_issue(1, "Info", file_name, None, None, "All validations passed successfully!")])
+
+    return builder.groups()
+
+
+def _merge_duplicates(plan: ValidationPlan, results: List[Dict[str, Any]], offsets: np.ndarray) -> Dict[int, Any]:
+    """
+    Resolve _ID duplicates across pieces in row order.
+    Returns, per rule index: [(position, first-seen row)] of each duplicate,
+    their values (None where no piece sampled them) and, per piece, the
+    (local position, index) of the values still to look up.
+    """
+    merged = {}
+    for n, rule in enumerate(plan.rules):
+        if not rule.unique or not any(n in r["unique"] for r in results):
+            continue
+        seen = SeenValues()
+        known: Dict[int, str] = {}
+        rows: List[Tuple[int, int]] = []
+        values: List[Optional[str]] = []
+        missing: Dict[int, List[Tuple[int, int]]] = {}
+        for k, r in enumerate(results):
+            positions, hashes, sample = r["unique"][n]
+            known.update(sample)
+            global_positions = positions + offsets[k]
+            duplicated, first_rows = seen.check_hashes(hashes, global_positions + ROW_NUMBER_OFFSET)
+            for local, position, h, first in zip(positions[duplicated].tolist(), global_positions[duplicated].tolist(),
+                                                 hashes[duplicated].tolist(), first_rows):
+                value = known.get(h)
+                if value is None:
+                    missing.setdefault(k, []).append((local, len(values)))
+                rows.append((position, first))
+                values.append(value)
+        if rows:
+            merged[n] = (rows, values, missing)
+    return merged
+
+
+# ============== Entry Point ==============
+
+async def validate_file(source: CsvSource, file_name: str, plan: ValidationPlan, row_state: Optional[str] = None,
+                        on_progress: Optional[Callable[[int], None]] = None) -> List[IssueGroup]:
+    """
+    Validate one file off the event loop, split across workers if it is large,
+    and return its issues grouped. source is raw bytes or the path of a
+    spooled upload. With row_state (see revalidation.py), a file small enough
+    to validate whole only has its new and edited rows validated. A split
+    file reports the bytes of each piece to on_progress as it is validated.
+    """
+    if row_state and source_size(source) <= STREAM_THRESHOLD_BYTES:
+        return await _run_job(validate_tracked, source, file_name, plan, row_state)
+    with mapped(source) as buffer:
+        ranges = split_ranges(buffer, VALIDATION_SPLIT_BYTES)
+    if ranges:
+        groups = await _validate_split(source, file_name, plan, ranges, on_progress)
+        if groups is not None:
+            return groups
+    return await _run_job(validate_grouped, source, file_name, plan)
+
+
+async def validate_csv_file(source: CsvSource, file_name: str, template_id: str, column_mapping: Dict[str, str],
+                            row_state: Optional[str] = None,
+                            on_progress: Optional[Callable[[int], None]] = None) -> List[IssueGroup]:
+    """
+    Process-pool counterpart of validation.validate_csv_data, returning the
+    issues grouped (issue_groups.expand_groups gives back the same list).
+    """
+    plan = plan_cache.get(template_id, column_mapping)
+    if plan is None:
+        return group_issues([make_issue(1, "Blocker", file_name, None, None, f"Unknown template: {template_id}")])
+
+    return await validate_file(source, file_name, plan, row_state, on_progress)
+
+
+async def read_key_hashes(source: str, columns: Dict[str, str]) -> Optional[Dict[str, KeyHashes]]:
+    """Hashes of a file's key columns (crossfile.py), read in the pool."""
+    return await _run_job(key_hashes, source, columns, stage="validate")
+
+
+async def read_key_values(source: str, column: str, positions: np.ndarray) -> List[str]:
+    return await _run_job(key_values, source, column, positions, stage="validate")
+
+
+async def find_barcode_collisions(source: str, rules: List[BarcodeRule]) -> Optional[List[Tuple[int, int, str]]]:
+    """Colliding index barcodes of a file (barcodes.py), found in the pool."""
+    return await _run_job(barcode_collisions, source, rules, stage="validate")
+
+
+async def build_columnar(source: str, file_sha256: str, columns: List[str]) -> str:
+    """Write the columnar copy of a spooled upload's columns (columnar.py) in the pool."""
+    return await _run_job(convert_to_columnar, source, file_sha256, columns, stage="export")
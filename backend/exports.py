@@ -0,0 +1,402 @@
+"""
+Export bundles.
+
+A run that passed the readiness gate (zero Blockers) can be exported as one
+zip holding:
+
+- tables/<template>/<file>: each uploaded file with its columns renamed to
+  the template's canonical field names, in field order (on request also as
+  Parquet, tables/<template>/<file stem>.parquet);
+- join_index.csv: every value of the key fields that link tables (fields
+  referencing another table's field, see crossfile.py, and _ID fields
+  shared by more than one table), with the table and row it appears in;
+- mapping.json: the run's saved mapping;
+- validation_report.csv: the run's issues;
+- manifest.json: run details and the size and SHA-256 of every other entry.
+
+The zip is built while it is sent: tables are read a record batch at a time
+from the columnar copies made when the run passed the gate (columnar.py), or
+EXPORT_CHUNK_ROWS rows at a time from the run's spooled uploads for runs that
+have none, issues are expanded from their groups a page at a time, and
+each compressed piece is handed to the client as soon as it is written, so
+memory stays flat however large the bundle. The bytes sent are also written
+to EXPORT_DIR; once a bundle is complete, repeat exports of the run are
+served from that file.
+"""
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+import zipfile
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from columnar import open_columnar
+from crossfile import run_references
+from validation import ROW_NUMBER_OFFSET, ValidationPlan, read_csv_source
+
+# Directory of completed bundles, one per exported run and format
+EXPORT_DIR = os.getenv("EXPORT_DIR") or os.path.join(tempfile.gettempdir(), "mdo-exports")
+# Bundles not downloaded for this many seconds are deleted (default: 7 days)
+EXPORT_RETENTION_SECONDS = int(os.getenv("EXPORT_RETENTION_SECONDS", str(7 * 24 * 3600)))
+# Rows read from a spooled upload per step
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "50000"))
+# Deflate level of bundle entries (1 fastest, 9 smallest)
+EXPORT_COMPRESSION_LEVEL = int(os.getenv("EXPORT_COMPRESSION_LEVEL", "6"))
+# Issues read from Mongo per batch for the validation report
+EXPORT_ISSUE_BATCH = 5000
+
+REPORT_COLUMNS = ["severity", "fileName", "row", "column", "description"]
+JOIN_INDEX_COLUMNS = ["key", "value", "table", "row"]
+
+
+def export_path(run_id: str, parquet: bool = False) -> str:
+    return os.path.join(EXPORT_DIR, f"{run_id}.parquet.zip" if parquet else f"{run_id}.zip")
+
+
+def cached_export(run_id: str, parquet: bool = False) -> Optional[str]:
+    """Path of the run's completed bundle, if one was built before (its age is reset)."""
+    path = export_path(run_id, parquet)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def prune_exports(retention_seconds: int = EXPORT_RETENTION_SECONDS) -> int:
+    """Delete bundles not used for retention_seconds; returns how many were removed."""
+    if not os.path.isdir(EXPORT_DIR):
+        return 0
+    cutoff = time.time() - retention_seconds
+    removed = 0
+    for entry in os.scandir(EXPORT_DIR):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+class BundleTable:
+    """One uploaded file as it goes into the bundle."""
+
+    def __init__(self, file_name: str, path: str, plan: ValidationPlan, entry: str, columnar: Optional[str] = None):
+        self.file_name = file_name
+        self.path = path
+        self.plan = plan
+        self.entry = entry
+        self.columnar = columnar
+
+    @property
+    def parquet_entry(self) -> str:
+        return f"{os.path.splitext(self.entry)[0]}.parquet"
+
+    @property
+    def fields(self) -> List[str]:
+        return [rule.name for rule in self.plan.rules]
+
+    def read_chunks(self, columns: Optional[Dict[str, str]] = None):
+        """
+        Chunks of the mapped columns as raw text, renamed to field names and
+        in field order (unmapped fields empty). columns restricts the fields.
+        """
+        columns = columns or {rule.name: rule.csv_column for rule in self.plan.rules}
+        first_row = 0
+        for chunk in self._read_columns([column for column in dict.fromkeys(columns.values()) if column]):
+            table = pd.DataFrame(
+                {field: chunk[column] if column else "" for field, column in columns.items()},
+                index=chunk.index
+            )
+            yield first_row, table
+            first_row += len(chunk)
+
+    def _read_columns(self, used: List[str]):
+        if self.columnar:
+            with open_columnar(self.columnar) as reader:
+                for i in range(reader.num_record_batches):
+                    yield reader.get_batch(i).select(used).to_pandas()
+            return
+        with read_csv_source(self.path, usecols=used, dtype=str, na_filter=False,
+                             chunksize=EXPORT_CHUNK_ROWS) as reader:
+            yield from reader
+
+
+def bundle_tables(files: List[Tuple[str, str, ValidationPlan, Optional[str]]]) -> List[BundleTable]:
+    """(file name, spooled path, plan, columnar copy) tuples as tables with distinct entry names."""
+    tables = []
+    used = set()
+    for file_name, path, plan, columnar in files:
+        base = f"tables/{plan.template_id}/{os.path.basename(file_name) or 'file.csv'}"
+        entry, n = base, 1
+        while entry in used:
+            n += 1
+            stem, ext = os.path.splitext(base)
+            entry = f"{stem}-{n}{ext}"
+        used.add(entry)
+        tables.append(BundleTable(file_name, path, plan, entry, columnar))
+    return tables
+
+
+def join_keys(tables: List[BundleTable]) -> List[Dict[str, str]]:
+    """
+    The key fields of each table, mapped to the key they are listed under:
+    a referencing field under the field it references, and the fields
+    referenced or shared (_ID fields in more than one table) as themselves.
+    """
+    references = run_references([(table.file_name, table.plan.template_id, {}) for table in tables])
+    linked = {(r.template_id, r.field): r.target_field for r in references}
+    linked.update({(r.target_template, r.target_field): r.target_field for r in references})
+    counts: Dict[str, int] = {}
+    for table in tables:
+        for field in table.fields:
+            if field.endswith("_ID"):
+                counts[field] = counts.get(field, 0) + 1
+    keys = []
+    for table in tables:
+        template_id = table.plan.template_id
+        keys.append({
+            field: linked.get((template_id, field), field) for field in table.fields
+            if (template_id, field) in linked or counts.get(field, 0) > 1
+        })
+    return keys
+
+
+class _Sink:
+    """Write-only, unseekable target of the zip; collects bytes until drained."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+class _Entry:
+    """
+    An open zip entry that records the size and SHA-256 of what is written
+    to it. File-like enough for pyarrow's Parquet writer.
+    """
+
+    def __init__(self, archive: zipfile.ZipFile, name: str):
+        self.name = name
+        self._file = archive.open(name, "w", force_zip64=True)
+        self._digest = hashlib.sha256()
+        self.size = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._file.write(data)
+        self._digest.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.size
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> Dict[str, Any]:
+        if not self.closed:
+            self._file.close()
+            self.closed = True
+        return {"path": self.name, "size": self.size, "sha256": self._digest.hexdigest()}
+
+
+class BundleWriter:
+    """
+    Zip archive written to an unseekable stream (entries use data
+    descriptors), handed out piece by piece with drain().
+    """
+
+    def __init__(self, compression_level: int = EXPORT_COMPRESSION_LEVEL):
+        self._sink = _Sink()
+        self._archive = zipfile.ZipFile(self._sink, "w", compression=zipfile.ZIP_DEFLATED,
+                                        compresslevel=compression_level)
+        self.entries: List[Dict[str, Any]] = []
+
+    def open(self, name: str) -> _Entry:
+        return _Entry(self._archive, name)
+
+    def close_entry(self, entry: _Entry) -> None:
+        self.entries.append(entry.close())
+
+    def write_entry(self, name: str, data: bytes) -> None:
+        entry = self.open(name)
+        entry.write(data)
+        self.close_entry(entry)
+
+    def close(self) -> None:
+        self._archive.close()
+
+    def drain(self) -> bytes:
+        return self._sink.drain()
+
+
+def _csv_bytes(rows: List[List[Any]]) -> bytes:
+    text = io.StringIO()
+    csv.writer(text, lineterminator="\n").writerows(rows)
+    return text.getvalue().encode()
+
+
+def _write_table_chunk(chunks, entry: _Entry, header: bool) -> bool:
+    """Write the next chunk of a table to its entry; False once the table is done."""
+    chunk = next(chunks, None)
+    if chunk is None:
+        return False
+    _, table = chunk
+    entry.write(table.to_csv(index=False, header=header, lineterminator="\n").encode())
+    return True
+
+
+def _write_parquet_chunk(chunks, parquet: pq.ParquetWriter) -> bool:
+    """Write the next chunk of a table as a Parquet row group; False once the table is done."""
+    chunk = next(chunks, None)
+    if chunk is None:
+        return False
+    _, table = chunk
+    parquet.write_table(pa.Table.from_pandas(table, schema=parquet.schema, preserve_index=False))
+    return True
+
+
+def _csv_field(value: str) -> str:
+    if any(c in value for c in ',"\r\n'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def _write_join_chunk(chunks, entry: _Entry, table: BundleTable, keys: Dict[str, str]) -> bool:
+    """
+    Write the join index rows of the next chunk of a table; False once the
+    table is done. Values are stripped, as crossfile.py compares them.
+    """
+    chunk = next(chunks, None)
+    if chunk is None:
+        return False
+    first_row, values = chunk
+    rows = pd.Series(np.arange(len(values)) + first_row + ROW_NUMBER_OFFSET, index=values.index).astype(str)
+    suffix = f",{_csv_field(table.entry)},"
+    for field, key in keys.items():
+        column = values[field].str.strip()
+        present = column != ""
+        column, row = column[present], rows[present]
+        quoted = column.str.contains(r'[,"\r\n]')
+        if quoted.any():
+            column = column.where(~quoted, '"' + column.str.replace('"', '""') + '"')
+        lines = f"{_csv_field(key)}," + column + suffix + row + "\n"
+        entry.write("".join(lines.tolist()).encode())
+    return True
+
+
+async def stream_bundle(issues: AsyncIterator[Dict[str, Any]], run: Dict[str, Any], tables: List[BundleTable],
+                        manifest: Dict[str, Any], parquet: bool = False) -> AsyncIterator[bytes]:
+    """
+    Build a run's bundle, yielding the zip a piece at a time. issues are the
+    run's issues in report order (issues.iter_issues). Reading and
+    compression run in a worker thread so the event loop stays free. The
+    bytes are also written to EXPORT_DIR and kept there once complete.
+    With parquet, the tables are also included as Parquet files.
+    """
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    run_id = str(run["_id"])
+    final = export_path(run_id, parquet)
+    part = f"{final}.{os.getpid()}.{id(tables):x}.part"
+    out = open(part, "wb")
+    writer = BundleWriter()
+    complete = False
+
+    async def emit() -> AsyncIterator[bytes]:
+        data = writer.drain()
+        if data:
+            await asyncio.to_thread(out.write, data)
+            yield data
+
+    try:
+        # Canonical tables
+        for table in tables:
+            entry = writer.open(table.entry)
+            chunks = table.read_chunks()
+            header = True
+            while await asyncio.to_thread(_write_table_chunk, chunks, entry, header):
+                header = False
+                async for data in emit():
+                    yield data
+            if header:
+                entry.write(_csv_bytes([table.fields]))
+            writer.close_entry(entry)
+
+        if parquet:
+            for table in tables:
+                entry = writer.open(table.parquet_entry)
+                schema = pa.schema([(field, pa.string()) for field in table.fields])
+                parquet_writer = pq.ParquetWriter(entry, schema)
+                chunks = table.read_chunks()
+                while await asyncio.to_thread(_write_parquet_chunk, chunks, parquet_writer):
+                    async for data in emit():
+                        yield data
+                await asyncio.to_thread(parquet_writer.close)
+                writer.close_entry(entry)
+
+        # Cross-modal join index
+        entry = writer.open("join_index.csv")
+        entry.write(_csv_bytes([JOIN_INDEX_COLUMNS]))
+        for table, keys in zip(tables, join_keys(tables)):
+            columns = {rule.name: rule.csv_column for rule in table.plan.rules if rule.name in keys}
+            if not any(columns.values()):
+                continue
+            chunks = table.read_chunks(columns)
+            while await asyncio.to_thread(_write_join_chunk, chunks, entry, table, keys):
+                async for data in emit():
+                    yield data
+        writer.close_entry(entry)
+
+        writer.write_entry("mapping.json", json.dumps(run.get("mapping", []), indent=2).encode())
+
+        # Validation report, in the order GET /runs/{run_id}/issues pages it
+        entry = writer.open("validation_report.csv")
+        entry.write(_csv_bytes([REPORT_COLUMNS]))
+        batch = []
+        async for issue in issues:
+            batch.append([issue.get("severity"), issue.get("fileName"), issue.get("rowIndex"),
+                          issue.get("columnName"), issue.get("description")])
+            if len(batch) >= EXPORT_ISSUE_BATCH:
+                await asyncio.to_thread(entry.write, _csv_bytes(batch))
+                batch = []
+                async for data in emit():
+                    yield data
+        entry.write(_csv_bytes(batch))
+        writer.close_entry(entry)
+
+        manifest = {**manifest, "exported_at": datetime.utcnow().isoformat(), "files": writer.entries}
+        writer.write_entry("manifest.json", json.dumps(manifest, indent=2, default=str).encode())
+        writer.close()
+        async for data in emit():
+            yield data
+        complete = True
+    finally:
+        out.close()
+        if complete:
+            os.replace(part, final)
+        else:
+            os.remove(part)
@@ -0,0 +1,219 @@
+"""
+Grouped issues.
+
+A mis-mapped or empty column fails the same rule on every row, so one
+mistake can produce hundreds of thousands of near-identical issues. Once a
+file has been validated, its issues are kept as groups instead, one group
+per (column, severity, rule, whether the issue has a row):
+
+- the rule is the issue's description with its values taken out: quoted
+  text and numbers become placeholders, and the rest is the template, e.g.
+  "Expected integer, got {}";
+- a placeholder with the same value on every row of the group is stored
+  once; only placeholders that vary keep one value per row;
+- row numbers, and issue positions in the file (a file's issue ids are its
+  positions plus one), are run-length encoded as [first, length] runs.
+
+Rows come back in (row, position) order. A group expands back to exactly
+the issues it was built from, ids included (expand_groups). Files
+validated in one piece are grouped in the pool worker that validated them;
+streamed and split files are grouped a chunk or a field at a time as they
+are validated (GroupBuilder), so their per-row issues never exist all at
+once. Everything after that (the result cache, the run, storage in
+issues.py, the API) handles groups.
+"""
+import re
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# Values taken out of descriptions: quoted text, then numbers
+_VALUE = re.compile(r"('[^']*'|-?\b\d+(?:\.\d+)?\b)")
+
+# Shown in a group's message in place of a value that varies from row to row
+VARYING = "…"
+
+# A group: severity, columnName, template (literal parts), args (one per
+# placeholder: the value, or a list of per-row values), rows (runs of row
+# numbers, None for issues without a row), positions (runs) and count
+IssueGroup = Dict[str, Any]
+Runs = List[List[int]]
+
+
+@lru_cache(maxsize=4096)
+def split_description(description: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """(template literals, values) of a description; the literals are one longer than the values."""
+    parts = _VALUE.split(description)
+    return tuple(parts[0::2]), tuple(parts[1::2])
+
+
+def join_description(template: List[str], values: List[str]) -> str:
+    parts = [template[0]]
+    for value, literal in zip(values, template[1:]):
+        parts.append(value)
+        parts.append(literal)
+    return "".join(parts)
+
+
+def encode_runs(values: np.ndarray) -> Runs:
+    """Run-length encode integers as [first, length] runs of consecutive values."""
+    if not len(values):
+        return []
+    breaks = np.flatnonzero(np.diff(values) != 1) + 1
+    starts = np.concatenate(([0], breaks))
+    lengths = np.diff(np.concatenate((starts, [len(values)])))
+    return np.column_stack((values[starts], lengths)).tolist()
+
+
+def decode_runs(runs: Runs) -> np.ndarray:
+    if not runs:
+        return np.zeros(0, dtype=np.int64)
+    firsts, lengths = np.asarray(runs, dtype=np.int64).T
+    ends = np.cumsum(lengths)
+    return np.repeat(firsts - (ends - lengths), lengths) + np.arange(ends[-1])
+
+
+def _extend_runs(runs: Runs, more: Runs) -> None:
+    """Append runs to runs, joining the boundary runs when they are consecutive."""
+    if runs and more and runs[-1][0] + runs[-1][1] == more[0][0]:
+        runs[-1][1] += more[0][1]
+        more = more[1:]
+    runs.extend(more)
+
+
+class GroupBuilder:
+    """
+    Groups issues that arrive a batch at a time (e.g. one streamed chunk
+    after another) without keeping the issues: only each group's runs, and
+    the values that vary, are held. Issues are numbered in the order they
+    are added.
+    """
+
+    def __init__(self):
+        self._groups: Dict[Tuple, Dict[str, Any]] = {}
+        self.count = 0
+
+    def add(self, failures: Iterable[Tuple[Optional[str], str, Optional[int], str]]) -> None:
+        """Add a batch of (columnName, severity, rowIndex, description)."""
+        batch: Dict[Tuple, Tuple[List, List, List]] = {}
+        position = self.count
+        for column, severity, row, description in failures:
+            template, values = split_description(description)
+            key = (column, severity, template, row is None)
+            entry = batch.get(key)
+            if entry is None:
+                entry = batch[key] = ([], [], [])
+            entry[0].append(row)
+            entry[1].append(position)
+            entry[2].append(values)
+            position += 1
+        self.count = position
+
+        for key, (rows, positions, values) in batch.items():
+            group = self._groups.get(key)
+            if group is None:
+                group = self._groups[key] = {"rows": None if key[3] else [], "positions": [], "args": None,
+                                             "count": 0, "ordered": True}
+            if group["rows"] is not None:
+                rows = np.asarray(rows, dtype=np.int64)
+                if np.any(np.diff(rows) < 0) or (group["rows"] and rows[0] < sum(group["rows"][-1]) - 1):
+                    group["ordered"] = False
+                _extend_runs(group["rows"], encode_runs(rows))
+            _extend_runs(group["positions"], encode_runs(np.asarray(positions, dtype=np.int64)))
+            self._extend_args(group, values)
+            group["count"] += len(positions)
+
+    @staticmethod
+    def _extend_args(group: Dict[str, Any], values: List[Tuple[str, ...]]) -> None:
+        """Add a batch's placeholder values: a value shared by every row so far stays a single value."""
+        args = []
+        for i, per_row in enumerate(zip(*values)):
+            first = per_row[0]
+            current = first if group["args"] is None else group["args"][i]
+            if isinstance(current, str) and per_row.count(current) == len(per_row):
+                args.append(current)
+                continue
+            if isinstance(current, str):
+                current = [current] * group["count"]
+            current.extend(per_row)
+            args.append(current)
+        group["args"] = args
+
+    def groups(self, first_position: int = 0) -> List[IssueGroup]:
+        """The groups, in the order they first appeared, with positions counted from first_position."""
+        groups = []
+        for (column, severity, template, _), group in self._groups.items():
+            rows, positions, args = group["rows"], group["positions"], group["args"]
+            if not group["ordered"]:
+                row_numbers, position_numbers = decode_runs(rows), decode_runs(positions)
+                order = np.lexsort((position_numbers, row_numbers))
+                rows, positions = encode_runs(row_numbers[order]), encode_runs(position_numbers[order])
+                keep = order.tolist()
+                args = [arg if isinstance(arg, str) else [arg[i] for i in keep] for arg in args]
+            groups.append({
+                "severity": severity,
+                "columnName": column,
+                "template": list(template),
+                "args": args,
+                "rows": rows,
+                "positions": [[first + first_position, length] for first, length in positions],
+                "count": group["count"],
+            })
+        return groups
+
+
+def group_issues(issues: List[Dict[str, Any]], first_position: int = 0) -> List[IssueGroup]:
+    """
+    Group a file's issues, in the order the groups first appear. The
+    issue at index i is taken to be at position first_position + i.
+    """
+    builder = GroupBuilder()
+    builder.add((issue["columnName"], issue["severity"], issue["rowIndex"], issue["description"]) for issue in issues)
+    return builder.groups(first_position)
+
+
+def group_values(group: IssueGroup, start: int = 0, stop: Optional[int] = None) -> Iterator[List[str]]:
+    """Placeholder values of the group's rows start to stop."""
+    stop = group["count"] if stop is None else stop
+    args = group["args"]
+    for i in range(start, stop):
+        yield [arg if isinstance(arg, str) else arg[i] for arg in args]
+
+
+def group_message(group: IssueGroup) -> str:
+    """The group's description, with values that vary from row to row shown as VARYING."""
+    return join_description(group["template"], [arg if isinstance(arg, str) else VARYING for arg in group["args"]])
+
+
+def expand_groups(groups: List[IssueGroup], file_name: str) -> List[Dict[str, Any]]:
+    """A file's issues from its groups, in position order."""
+    # Imported here so the API can read grouped issues without loading the engine (pandas)
+    from validation import make_issue
+
+    placed = []
+    for group in groups:
+        positions = decode_runs(group["positions"]).tolist()
+        rows = decode_runs(group["rows"]).tolist() if group["rows"] is not None else [None] * group["count"]
+        for position, row, values in zip(positions, rows, group_values(group)):
+            placed.append((position, make_issue(
+                position + 1, group["severity"], file_name, row, group["columnName"],
+                join_description(group["template"], values)
+            )))
+    placed.sort(key=lambda item: item[0])
+    return [issue for _, issue in placed]
+
+
+def issue_count(groups: List[IssueGroup]) -> int:
+    return sum(group["count"] for group in groups)
+
+
+def merge_groups(groups: List[IssueGroup], extra: List[Dict[str, Any]]) -> List[IssueGroup]:
+    """A file's groups followed by its run-level issues (cross-file, barcodes), which come after them."""
+    if not extra:
+        return groups
+    if len(groups) == 1 and groups[0]["count"] == 1 and groups[0]["severity"] == "Info" \
+            and groups[0]["columnName"] is None:
+        # The file's own checks passed; drop its "All validations passed" note
+        groups = []
+    return groups + group_issues(extra, issue_count(groups))
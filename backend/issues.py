@@ -0,0 +1,351 @@
+"""
+Validation issue storage.
+
+Issues live in their own `validation_issues` collection, one document per
+issue, instead of an array embedded in the run (which hits Mongo's 16 MB
+document limit on large files). The run document keeps only a summary.
+
+Runs completed since issues were grouped (issue_format "grouped") store
+them in `issue_groups` instead: one document per part of a group
+(issue_groups.py) of at most ISSUE_GROUP_PART_ROWS rows. Older runs keep one
+document per issue in `validation_issues` until backfill_run_summaries
+groups them. Both are read back the same way.
+
+Issues are read back a page at a time with keyset pagination in index
+order: severity, fileName, rowIndex, then the order the engine emitted them
+in (seq). Page cursors are opaque strings encoding the last issue's key.
+Grouped issues are only expanded for the page asked for: the parts that
+can hold issues after the cursor are read in order of their first issue
+and merged.
+"""
+import base64
+import heapq
+import itertools
+import json
+import os
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError
+
+from issue_groups import IssueGroup, decode_runs, encode_runs, group_message, group_values, join_description
+
+# Issues sent to Mongo per insert_many call
+ISSUE_BATCH_SIZE = int(os.getenv("ISSUE_BATCH_SIZE", "1000"))
+# Largest page GET /runs/{run_id}/issues returns
+ISSUE_PAGE_LIMIT = 1000
+# Rows per stored part of an issue group
+ISSUE_GROUP_PART_ROWS = int(os.getenv("ISSUE_GROUP_PART_ROWS", "10000"))
+# Largest page GET /runs/{run_id}/issue-groups returns
+ISSUE_GROUP_PAGE_LIMIT = 500
+# Example issues and row ranges kept with each group for display
+ISSUE_GROUP_EXAMPLES = 3
+ISSUE_GROUP_RANGES = 50
+
+# run["issue_format"] of runs whose issues are in issue_groups
+GROUPED = "grouped"
+
+DUPLICATE_KEY = 11000
+
+# Sort order of issue pages; db_indexes indexes (run_id, *ISSUE_SORT)
+ISSUE_SORT = [("severity", ASCENDING), ("fileName", ASCENDING), ("rowIndex", ASCENDING), ("seq", ASCENDING)]
+
+IssueKey = Tuple[str, str, Optional[int], int]
+
+# Order parts of groups are merged in; db_indexes indexes (run_id, *PART_SORT)
+PART_SORT = [("severity", ASCENDING), ("fileName", ASCENDING), ("firstRow", ASCENDING), ("firstSeq", ASCENDING)]
+
+
+class InvalidCursor(ValueError):
+    """Raised when a page cursor cannot be decoded."""
+
+
+SEVERITY_KEYS = {"Blocker": "blockers", "Warning": "warnings", "Info": "infos"}
+
+
+def _empty_counts() -> Dict[str, int]:
+    return {"blockers": 0, "warnings": 0, "infos": 0, "total": 0}
+
+
+def build_summary(counts: List[Tuple[str, str, int]]) -> Dict[str, Any]:
+    """
+    Run summary from (fileName, severity, count) triples: severity counts
+    for the run and per file (in first-seen order), and the readiness gate,
+    which is open when no file has a Blocker.
+    """
+    summary: Dict[str, Any] = _empty_counts()
+    files: Dict[str, Dict[str, int]] = {}
+    for file_name, severity, count in counts:
+        file_counts = files.setdefault(file_name, _empty_counts())
+        for target in (summary, file_counts):
+            if severity in SEVERITY_KEYS:
+                target[SEVERITY_KEYS[severity]] += count
+            target["total"] += count
+    summary["files"] = [{"fileName": file_name, **file_counts} for file_name, file_counts in files.items()]
+    summary["ready"] = summary["blockers"] == 0
+    return summary
+
+
+def summarize_groups(files: List[Tuple[str, List[IssueGroup]]]) -> Dict[str, Any]:
+    """Summary stored on the run in place of its issues, from each file's issue groups."""
+    counts: Dict[Tuple[str, str], int] = {}
+    for file_name, groups in files:
+        for group in groups:
+            key = (file_name, group["severity"])
+            counts[key] = counts.get(key, 0) + group["count"]
+    return build_summary([(file_name, severity, count) for (file_name, severity), count in counts.items()])
+
+
+async def _insert_all(collection, docs: List[Dict[str, Any]]) -> None:
+    """Insert documents in unordered batches; documents already there are skipped."""
+    for start in range(0, len(docs), ISSUE_BATCH_SIZE):
+        try:
+            await collection.insert_many(docs[start:start + ISSUE_BATCH_SIZE], ordered=False)
+        except BulkWriteError as e:
+            if any(error["code"] != DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+                raise
+
+
+def _group_parts(run_id, n: int, file_name: str, first_seq: int, group: IssueGroup) -> List[Dict[str, Any]]:
+    """Documents of group n of a run, whose file's issues start at first_seq."""
+    count = group["count"]
+    seqs = decode_runs(group["positions"]) + first_seq
+    rows = decode_runs(group["rows"]) if group["rows"] is not None else None
+    parts = []
+    for k, start in enumerate(range(0, count, ISSUE_GROUP_PART_ROWS)):
+        stop = min(start + ISSUE_GROUP_PART_ROWS, count)
+        part_rows = rows[start:stop].tolist() if rows is not None else None
+        parts.append({
+            "_id": f"{run_id}:{n}:{k}", "run_id": run_id, "group": n, "part": k,
+            "severity": group["severity"], "fileName": file_name, "columnName": group["columnName"],
+            "template": group["template"],
+            "args": [arg if isinstance(arg, str) else arg[start:stop] for arg in group["args"]],
+            "rows": encode_runs(rows[start:stop]) if rows is not None else None,
+            "seqs": encode_runs(seqs[start:stop]),
+            "firstRow": part_rows[0] if part_rows else None, "firstSeq": int(seqs[start]),
+            "lastRow": part_rows[-1] if part_rows else None, "lastSeq": int(seqs[stop - 1]),
+            "count": stop - start,
+            "idBase": first_seq,
+        })
+    # What GET /runs/{run_id}/issue-groups shows lives on the first part
+    ranges = encode_runs(rows) if rows is not None else []
+    parts[0].update({
+        "message": group_message(group),
+        "total": count,
+        "rowRanges": [[first, first + length - 1] for first, length in ranges[:ISSUE_GROUP_RANGES]],
+        "rowRangesTruncated": len(ranges) > ISSUE_GROUP_RANGES,
+        "examples": [
+            {"rowIndex": int(rows[i]) if rows is not None else None,
+             "description": join_description(group["template"], values)}
+            for i, values in enumerate(group_values(group, 0, min(count, ISSUE_GROUP_EXAMPLES)))
+        ],
+    })
+    return parts
+
+
+async def write_issue_groups(collection, run_id, files: List[Tuple[str, List[IssueGroup]]],
+                             replace: bool = False) -> None:
+    """
+    Insert a run's issue groups, file by file; seqs continue from one file
+    to the next as if the files' issues were one list. With replace, parts
+    left by an earlier attempt at the run are deleted first. Part _ids are
+    derived from the run id and the group's position, so writing the same
+    run twice cannot duplicate issues either way.
+    """
+    if replace:
+        await collection.delete_many({"run_id": run_id})
+    docs = []
+    first_seq = 0
+    n = 0
+    for file_name, groups in files:
+        for group in groups:
+            docs.extend(_group_parts(run_id, n, file_name, first_seq, group))
+            n += 1
+        first_seq += sum(group["count"] for group in groups)
+    await _insert_all(collection, docs)
+
+
+def encode_cursor(issue: Dict[str, Any]) -> str:
+    key = [issue["severity"], issue["fileName"], issue.get("rowIndex"), issue["seq"]]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> IssueKey:
+    try:
+        severity, file_name, row_index, seq = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise InvalidCursor("Invalid cursor")
+    # A key of other types would not sort against stored issues the way ISSUE_SORT does
+    if not (isinstance(severity, str) and isinstance(file_name, str) and _is_int(seq)
+            and (row_index is None or _is_int(row_index))):
+        raise InvalidCursor("Invalid cursor")
+    return severity, file_name, row_index, seq
+
+
+def _is_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _after(key: IssueKey, row_field: str = "rowIndex", seq_field: str = "seq") -> Dict[str, Any]:
+    """Filter for issues that sort after key in ISSUE_SORT order (null rowIndex first)."""
+    severity, file_name, row_index, seq = key
+    same_file = {"severity": severity, "fileName": file_name}
+    if row_index is None:
+        later_rows = [
+            {**same_file, row_field: {"$ne": None}},
+            {**same_file, row_field: None, seq_field: {"$gt": seq}},
+        ]
+    else:
+        later_rows = [
+            {**same_file, row_field: {"$gt": row_index}},
+            {**same_file, row_field: row_index, seq_field: {"$gt": seq}},
+        ]
+    return {"$or": [
+        {"severity": {"$gt": severity}},
+        {"severity": severity, "fileName": {"$gt": file_name}},
+        *later_rows,
+    ]}
+
+
+def _sort_key(key: IssueKey) -> Tuple:
+    """An IssueKey that compares in ISSUE_SORT order."""
+    severity, file_name, row_index, seq = key
+    return severity, file_name, row_index is not None, row_index or 0, seq
+
+
+def _expand_part(part: Dict[str, Any], after: Optional[Tuple]) -> Iterator[Tuple[Tuple, Dict[str, Any]]]:
+    """(sort key, issue) of a part's issues that sort after `after`, in order."""
+    seqs = decode_runs(part["seqs"]).tolist()
+    rows = decode_runs(part["rows"]).tolist() if part["rows"] is not None else [None] * part["count"]
+    for seq, row, values in zip(seqs, rows, group_values(part)):
+        key = _sort_key((part["severity"], part["fileName"], row, seq))
+        if after is not None and key <= after:
+            continue
+        yield key, {
+            "seq": seq, "id": str(seq - part["idBase"] + 1), "severity": part["severity"],
+            "fileName": part["fileName"], "rowIndex": row, "columnName": part["columnName"],
+            "description": join_description(part["template"], values),
+        }
+
+
+async def _grouped_issues(collection, query: Dict[str, Any], after: Optional[IssueKey],
+                          limit: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Expanded issues of the parts matching query, in ISSUE_SORT order. A
+    part's issues are only merged in once no issue left to emit can sort
+    before its first one, and parts are only read until limit issues are out.
+    """
+    if after is not None:
+        query = {**query, **_after(after, "lastRow", "lastSeq")}
+    after_key = _sort_key(after) if after is not None else None
+    pending: List[Tuple[Tuple, int, Dict[str, Any], Iterator]] = []
+    counter = itertools.count()
+
+    def push(issues: Iterator) -> None:
+        for key, issue in issues:
+            heapq.heappush(pending, (key, next(counter), issue, issues))
+            return
+
+    remaining = limit if limit else -1
+    parts = collection.find(query, {"message": 0, "rowRanges": 0, "examples": 0}).sort(PART_SORT)
+    async for part in parts:
+        first = _sort_key((part["severity"], part["fileName"], part["firstRow"], part["firstSeq"]))
+        while pending and pending[0][0] < first and remaining:
+            _, _, issue, issues = heapq.heappop(pending)
+            yield issue
+            remaining -= 1
+            push(issues)
+        if not remaining:
+            await parts.close()
+            return
+        push(_expand_part(part, after_key))
+    while pending and remaining:
+        _, _, issue, issues = heapq.heappop(pending)
+        yield issue
+        remaining -= 1
+        push(issues)
+
+
+def iter_issues(db, run: Dict[str, Any], severity: Optional[str] = None, file_name: Optional[str] = None,
+                column: Optional[str] = None, after: Optional[IssueKey] = None,
+                limit: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    A run's issues in ISSUE_SORT order, optionally filtered, starting after
+    a key and at most limit of them, from wherever the run stores them.
+    Issues keep their seq.
+    """
+    query: Dict[str, Any] = {"run_id": run["_id"]}
+    if severity:
+        query["severity"] = severity
+    if file_name:
+        query["fileName"] = file_name
+    if column:
+        query["columnName"] = column
+    if run.get("issue_format") == GROUPED:
+        return _grouped_issues(db.issue_groups, query, after, limit)
+    if after is not None:
+        query.update(_after(after))
+    cursor = db.validation_issues.find(query, {"_id": 0, "run_id": 0}).sort(ISSUE_SORT)
+    return cursor.limit(limit) if limit else cursor
+
+
+async def find_issues(db, run: Dict[str, Any], severity: Optional[str] = None, file_name: Optional[str] = None,
+                      column: Optional[str] = None, cursor: Optional[str] = None,
+                      limit: int = 100) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    One page of a run's issues, optionally filtered.
+    Returns the issues and the cursor of the next page (None on the last page).
+    """
+    limit = max(1, min(limit, ISSUE_PAGE_LIMIT))
+    after = decode_cursor(cursor) if cursor else None
+    page = [issue async for issue in iter_issues(db, run, severity, file_name, column, after, limit + 1)]
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    page = page[:limit]
+    for issue in page:
+        del issue["seq"]
+    return page, next_cursor
+
+
+def encode_group_cursor(part: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(part["group"]).encode()).decode()
+
+
+def decode_group_cursor(cursor: str) -> int:
+    try:
+        group = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise InvalidCursor("Invalid cursor")
+    if not isinstance(group, int):
+        raise InvalidCursor("Invalid cursor")
+    return group
+
+
+async def find_issue_groups(collection, run_id, severity: Optional[str] = None, file_name: Optional[str] = None,
+                            column: Optional[str] = None, cursor: Optional[str] = None,
+                            limit: int = 100) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    One page of a grouped run's issue groups, in the order they were found
+    (file by file), optionally filtered. Only the first part of each group
+    is read. Returns the groups and the cursor of the next page.
+    """
+    limit = max(1, min(limit, ISSUE_GROUP_PAGE_LIMIT))
+    query: Dict[str, Any] = {"run_id": run_id, "part": 0}
+    if severity:
+        query["severity"] = severity
+    if file_name:
+        query["fileName"] = file_name
+    if column:
+        query["columnName"] = column
+    if cursor:
+        query["group"] = {"$gt": decode_group_cursor(cursor)}
+    projection = {"_id": 0, "group": 1, "severity": 1, "fileName": 1, "columnName": 1, "message": 1, "total": 1,
+                  "rowRanges": 1, "rowRangesTruncated": 1, "examples": 1}
+    page = await collection.find(query, projection).sort("group", ASCENDING).limit(limit + 1).to_list(length=limit + 1)
+    next_cursor = encode_group_cursor(page[limit - 1]) if len(page) > limit else None
+    return [
+        {"id": str(part["group"]), "severity": part["severity"], "fileName": part["fileName"],
+         "columnName": part["columnName"], "message": part["message"], "count": part["total"],
+         "rowRanges": part["rowRanges"], "rowRangesTruncated": part["rowRangesTruncated"],
+         "examples": part["examples"]}
+        for part in page[:limit]
+    ], next_cursor
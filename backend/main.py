@@ -1,23 +1,91 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Body, File, UploadFile, Header
+import time
+
+# Timed as the "imports" phase of the startup report
+_imports_started = time.perf_counter()
+
+from fastapi import FastAPI, Depends, HTTPException, status, Body, File, UploadFile, Header, Request, Response
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from typing import List, Optional, Dict, Any, Tuple
+import base64
+import hmac
 import json
-import io
-import re
 from bson import ObjectId
 import asyncio
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr
-from passlib.context import CryptContext
-from jose import jwt, JWTError
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
+from contextlib import asynccontextmanager
+from jose import JWTError
 from datetime import datetime, timedelta
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
 import os
+import sys
 from dotenv import load_dotenv
-import pandas as pd
 
+# Loaded before the local modules below, which read their settings on import
 load_dotenv()
 
-app = FastAPI(title="Multiomic Data Orchestrator API", version="1.0.0")
+# The validation engine (runs, executor, validation, pandas), exports,
+# columnar copies, passlib and jose's JWT code are imported where they are
+# used, and warmed up in the background (startup.py), so they stay off the
+# cold start path
+from templates import TemplateError, refresh_templates as sync_templates, save_template, template_registry
+from uploads import (
+    UploadTooLarge, check_upload_size, prune_spool, release_finished_runs, release_run, run_spool_dir, spool_uploads,
+    spooled_path
+)
+from run_queue import RUN_POLL_SECONDS, RunQueue, RunWorkerPool
+from audit import audit_log
+from auth_cache import token_cache, token_key, user_cache
+from issues import (
+    GROUPED, ISSUE_GROUP_PAGE_LIMIT, ISSUE_PAGE_LIMIT, InvalidCursor, find_issue_groups, find_issues, iter_issues
+)
+from db_indexes import ensure_indexes, index_report
+from passwords import hash_password, shutdown_hashing, verify_and_update
+from events import TERMINAL_STATUSES, run_events
+from metrics import QUEUE_DEPTH, REQUEST_SECONDS, process_exited, render as render_metrics
+from payloads import (
+    CompressionMiddleware, FastJSONResponse, cache_headers, etag_matches, last_modified, list_etag, not_modified,
+    run_etag
+)
+from startup import WARM_UP_IMPORTS, startup_report, warm_up
+
+startup_report.imports_done(_imports_started)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Startup and shutdown (see the Startup section below)"""
+    await startup_event()
+    yield
+    await shutdown_event()
+
+app = FastAPI(title="Multiomic Data Orchestrator API", version="1.0.0", lifespan=lifespan)
+
+# Compresses large JSON responses (run payloads, issue pages). Registered
+# first so it is innermost: the http middlewares below re-send response
+# bodies in chunks, which it passes through uncompressed
+app.add_middleware(CompressionMiddleware)
+
+# Registered before CORSMiddleware so rejections still carry CORS headers
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Reject oversized run uploads from their Content-Length before the body is read"""
+    if request.method == "POST" and request.url.path == "/api/v1/runs":
+        try:
+            check_upload_size(request.headers.get("content-length"))
+        except UploadTooLarge as e:
+            return JSONResponse(status_code=413, content={"detail": str(e)})
+    return await call_next(request)
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """Observe request latency by route template (not raw path, which holds ids)"""
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    REQUEST_SECONDS.labels(
+        request.method, getattr(route, "path", "unmatched"), str(response.status_code)
+    ).observe(time.perf_counter() - started)
+    return response
 
 # CORS Configuration
 # Get CORS origins from environment variable
@@ -58,213 +126,46 @@ if not SECRET_KEY:
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("JWT_EXPIRES_IN", "60"))
 
-# Database
+# Run event streams accept ?access_token= only with a token scoped to the
+# run (POST /api/v1/runs/{run_id}/events/token), valid for this many seconds
+STREAM_TOKEN_SECONDS = int(os.getenv("STREAM_TOKEN_SECONDS", "60"))
+STREAM_TOKEN_SCOPE = "run-events"
+
+# Seconds between sweeps for spooled uploads, row states, columnar copies
+# and export bundles past their retention (watch_spools)
+PRUNE_INTERVAL_SECONDS = int(os.getenv("PRUNE_INTERVAL_SECONDS", "300"))
+
+# Bearer token Prometheus scrapes GET /metrics with; unset, the route is disabled
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Users allowed to change schema templates
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
+
+# Database - the client, and the run queue that uses it, are created on
+# startup (connect_database)
 DATABASE_NAME = os.getenv("DATABASE_NAME", "mdo")
-client = AsyncIOMotorClient(MONGODB_URI)
-db = client.get_database(DATABASE_NAME)
-
-# Password hashing - Using Argon2 (no password length limit, more secure than bcrypt)
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
-
-# ============== Schema Templates with Validation Rules ==============
-
-SCHEMA_TEMPLATES = {
-    "illumina-ngs-run-v1.2": {
-        "name": "Illumina NGS Run",
-        "fields": [
-            {"name": "Run_ID", "type": "string", "required": True},
-            {"name": "Sample_ID", "type": "string", "required": True},
-            {"name": "Library_ID", "type": "string", "required": True},
-            {"name": "Lane", "type": "integer", "required": True, "min": 1, "max": 8},
-            {"name": "Index_I1", "type": "string", "required": True, "pattern": r"^[ATGCN]+$"},
-            {"name": "Index_I2", "type": "string", "required": False, "pattern": r"^[ATGCN]*$"},
-        ]
-    },
-    "10x-single-cell-v2.0": {
-        "name": "10x Single-Cell",
-        "fields": [
-            {"name": "Library_ID", "type": "string", "required": True},
-            {"name": "Sample_ID", "type": "string", "required": True},
-            {"name": "Chemistry", "type": "string", "required": True},
-            {"name": "Expected_Cells", "type": "integer", "required": False, "min": 1},
-        ]
-    },
-    "spatial-visium-v1.0": {
-        "name": "Spatial - Visium",
-        "fields": [
-            {"name": "Slide_ID", "type": "string", "required": True},
-            {"name": "Capture_Area", "type": "string", "required": True, "pattern": r"^[A-D][1-4]$"},
-            {"name": "Library_ID", "type": "string", "required": True},
-            {"name": "Block_ID", "type": "string", "required": True},
-        ]
-    },
-}
+client = None
+db = None
 
-# ============== Validation Engine ==============
+# Run queue - workers run inside the API process unless disabled here, in
+# which case runs are processed by `python -m worker`
+RUN_WORKERS_IN_API = os.getenv("RUN_WORKERS_IN_API", "true").lower() == "true"
+run_queue: Optional[RunQueue] = None
+run_workers: Optional[RunWorkerPool] = None
 
-def validate_csv_data(file_content: bytes, file_name: str, template_id: str, column_mapping: Dict[str, str]) -> List[Dict[str, Any]]:
-    """
-    Validate CSV data against schema template rules.
-    Returns a list of validation issues.
-    """
-    issues = []
-    issue_id = 0
-    
-    template = SCHEMA_TEMPLATES.get(template_id)
-    if not template:
-        issues.append({
-            "id": str(issue_id := issue_id + 1),
-            "severity": "Blocker",
-            "fileName": file_name,
-            "rowIndex": None,
-            "columnName": None,
-            "description": f"Unknown template: {template_id}"
-        })
-        return issues
-    
-    # Parse CSV
-    try:
-        df = pd.read_csv(io.BytesIO(file_content))
-    except Exception as e:
-        issues.append({
-            "id": str(issue_id := issue_id + 1),
-            "severity": "Blocker",
-            "fileName": file_name,
-            "rowIndex": None,
-            "columnName": None,
-            "description": f"Failed to parse CSV: {str(e)}"
-        })
-        return issues
-    
-    # Track values for uniqueness checks
-    seen_values = {}
-    
-    for field in template["fields"]:
-        canonical_name = field["name"]
-        csv_column = column_mapping.get(canonical_name)
-        
-        # Check if required field is mapped
-        if not csv_column:
-            if field["required"]:
-                issues.append({
-                    "id": str(issue_id := issue_id + 1),
-                    "severity": "Blocker",
-                    "fileName": file_name,
-                    "rowIndex": None,
-                    "columnName": canonical_name,
-                    "description": f"Required field '{canonical_name}' is not mapped to any CSV column"
-                })
-            continue
-        
-        # Check if mapped column exists in CSV
-        if csv_column not in df.columns:
-            issues.append({
-                "id": str(issue_id := issue_id + 1),
-                "severity": "Blocker",
-                "fileName": file_name,
-                "rowIndex": None,
-                "columnName": canonical_name,
-                "description": f"Mapped column '{csv_column}' not found in CSV file"
-            })
-            continue
-        
-        # Initialize uniqueness tracking for this field
-        seen_values[canonical_name] = {}
-        
-        # Validate each row
-        for idx, value in df[csv_column].items():
-            row_num = idx + 2  # +2 for header row and 0-indexing
-            
-            # Required field check
-            if field["required"] and (pd.isna(value) or str(value).strip() == ""):
-                issues.append({
-                    "id": str(issue_id := issue_id + 1),
-                    "severity": "Blocker",
-                    "fileName": file_name,
-                    "rowIndex": row_num,
-                    "columnName": canonical_name,
-                    "description": f"Required field '{canonical_name}' is empty"
-                })
-                continue
-            
-            # Skip further validation if value is empty (for non-required fields)
-            if pd.isna(value) or str(value).strip() == "":
-                continue
-            
-            str_value = str(value).strip()
-            
-            # Type validation
-            if field["type"] == "integer":
-                try:
-                    int_val = int(float(value))
-                    # Range validation
-                    if "min" in field and int_val < field["min"]:
-                        issues.append({
-                            "id": str(issue_id := issue_id + 1),
-                            "severity": "Blocker",
-                            "fileName": file_name,
-                            "rowIndex": row_num,
-                            "columnName": canonical_name,
-                            "description": f"Value {int_val} is below minimum {field['min']}"
-                        })
-                    if "max" in field and int_val > field["max"]:
-                        issues.append({
-                            "id": str(issue_id := issue_id + 1),
-                            "severity": "Blocker",
-                            "fileName": file_name,
-                            "rowIndex": row_num,
-                            "columnName": canonical_name,
-                            "description": f"Value {int_val} exceeds maximum {field['max']}"
-                        })
-                except (ValueError, TypeError):
-                    issues.append({
-                        "id": str(issue_id := issue_id + 1),
-                        "severity": "Blocker",
-                        "fileName": file_name,
-                        "rowIndex": row_num,
-                        "columnName": canonical_name,
-                        "description": f"Expected integer, got '{value}'"
-                    })
-            
-            # Pattern validation (e.g., DNA sequences, capture area format)
-            if "pattern" in field:
-                if not re.match(field["pattern"], str_value):
-                    issues.append({
-                        "id": str(issue_id := issue_id + 1),
-                        "severity": "Warning",
-                        "fileName": file_name,
-                        "rowIndex": row_num,
-                        "columnName": canonical_name,
-                        "description": f"Value '{str_value}' doesn't match expected format"
-                    })
-            
-            # Uniqueness check for ID fields
-            if canonical_name.endswith("_ID"):
-                if str_value in seen_values[canonical_name]:
-                    first_row = seen_values[canonical_name][str_value]
-                    issues.append({
-                        "id": str(issue_id := issue_id + 1),
-                        "severity": "Warning",
-                        "fileName": file_name,
-                        "rowIndex": row_num,
-                        "columnName": canonical_name,
-                        "description": f"Duplicate value '{str_value}' (first seen in row {first_row})"
-                    })
-                else:
-                    seen_values[canonical_name][str_value] = row_num
-    
-    # If no issues found, add an info message
-    if len(issues) == 0:
-        issues.append({
-            "id": str(issue_id := issue_id + 1),
-            "severity": "Info",
-            "fileName": file_name,
-            "rowIndex": None,
-            "columnName": None,
-            "description": "All validations passed successfully!"
-        })
-    
-    return issues
+def connect_database() -> None:
+    global client, db, run_queue, run_workers
+    from database import create_client
+
+    client = create_client(MONGODB_URI)
+    db = client.get_database(DATABASE_NAME)
+    run_queue = RunQueue(db.harmonization_runs)
+    run_workers = RunWorkerPool(run_queue, process_run)
+
+async def process_run(queue: RunQueue, run: dict) -> None:
+    from runs import process_run as process
+
+    await process(db, queue, run)
 
 # ============== Pydantic Models ==============
 
@@ -300,17 +201,48 @@ class MappingResponse(BaseModel):
     mappings: list
     createdAt: str
 
-# ============== Helper Functions ==============
+class TemplateUpsert(BaseModel):
+    name: str
+    fields: list
+
+class RunListItem(BaseModel):
+    id: str
+    status: str = "pending"
+    files: List[str] = []
+    created_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    validation_summary: Optional[Dict[str, Any]] = None
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+class RunDetail(BaseModel):
+    """A run as GET /runs/{run_id} returns it; lease bookkeeping is left out."""
+    model_config = ConfigDict(populate_by_name=True)
 
-def hash_password(password: str) -> str:
-    """
-    Hash a password using Argon2.
-    Argon2 has no password length limit and is more secure than bcrypt.
-    """
-    return pwd_context.hash(password)
+    id: str = Field(alias="_id")
+    user_id: str
+    user_email: Optional[str] = None
+    status: str = "pending"
+    mapping: Any = None
+    files: List[str] = []
+    uploads: List[Dict[str, Any]] = []
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    attempts: int = 0
+    state_version: int = 0
+    error: Optional[str] = None
+    validation_summary: Optional[Dict[str, Any]] = None
+    cache_hits: List[str] = []
+    stage_seconds: Optional[Dict[str, float]] = None
+    rows_validated: Optional[int] = None
+    duration_seconds: Optional[float] = None
+    validation_issues: List[Dict[str, Any]] = []
+    issues_truncated: bool = False
+    issue_format: Optional[str] = None
+    issue_groups: List[Dict[str, Any]] = []
+    issue_groups_truncated: bool = False
+
+# ============== Helper Functions ==============
 
 def validate_password(password: str) -> Tuple[bool, Optional[str]]:
     """
@@ -339,6 +271,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
+    from jose import jwt
+
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -346,6 +280,35 @@ async def get_user_by_email(email: str) -> Optional[dict]:
     user = await db.users.find_one({"email": email})
     return user
 
+async def get_cached_user(email: str) -> Optional[dict]:
+    """
+    get_user_by_email through user_cache, for authenticating requests.
+    Anything that writes a user must call user_cache.invalidate(email).
+    """
+    user = user_cache.get(email)
+    if user is None:
+        user = await get_user_by_email(email)
+        if user is None:
+            return None
+        user_cache.set(email, user)
+    return dict(user)
+
+def decode_token(token: str) -> dict:
+    """Decode and verify a JWT, reusing the payload of tokens seen before they expire."""
+    key = token_key(token)
+    payload = token_cache.get(key)
+    if payload is None:
+        from jose import jwt
+
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        if "exp" in payload:
+            token_cache.set(key, payload, expires_at=payload["exp"])
+    return payload
+
+async def refresh_templates(force: bool = False) -> None:
+    """Re-sync the template registry from Mongo if it is older than TEMPLATE_REFRESH_SECONDS."""
+    await sync_templates(db, force=force)
+
 # ============== JWT Authentication Dependency ==============
 
 async def get_current_user(authorization: Optional[str] = Header(None)) -> dict:
@@ -370,23 +333,72 @@ async def get_current_user(authorization: Optional[str] = Header(None)) -> dict:
     token = parts[1]
     
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         email: str = payload.get("sub")
-        if email is None:
+        # Scoped tokens (stream tokens) are not login tokens
+        if email is None or payload.get("scope"):
             raise credentials_exception
     except JWTError:
         raise credentials_exception
     
-    user = await get_user_by_email(email)
+    user = await get_cached_user(email)
     if user is None:
         raise credentials_exception
     
     return user
 
-# ============== Startup Event - Seed User ==============
+async def get_admin_user(current_user: dict = Depends(get_current_user)) -> dict:
+    """get_current_user, restricted to the users listed in ADMIN_EMAILS."""
+    if current_user["email"].lower() not in ADMIN_EMAILS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    return current_user
+
+async def require_metrics_token(authorization: Optional[str] = Header(None)) -> None:
+    """Let only scrapes sending METRICS_TOKEN through; 404 while it is unset."""
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    parts = (authorization or "").split()
+    if len(parts) != 2 or parts[0].lower() != "bearer" or not hmac.compare_digest(parts[1], METRICS_TOKEN):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+async def get_stream_user(
+    run_id: str,
+    authorization: Optional[str] = Header(None),
+    access_token: Optional[str] = None
+) -> dict:
+    """
+    get_current_user for a run's event stream. Browsers' EventSource cannot
+    send an Authorization header, so a stream token for this run may come as
+    ?access_token= instead. Login tokens are never accepted there, as query
+    strings end up in access logs and browser history.
+    """
+    if authorization is not None or not access_token:
+        return await get_current_user(authorization)
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+    )
+    try:
+        payload = decode_token(access_token)
+    except JWTError:
+        raise credentials_exception
+    if payload.get("scope") != STREAM_TOKEN_SCOPE or payload.get("run_id") != run_id or not payload.get("sub"):
+        raise credentials_exception
+    user = await get_cached_user(payload["sub"])
+    if user is None:
+        raise credentials_exception
+    return user
+
+# ============== Startup ==============
 
-@app.on_event("startup")
-async def startup_event():
+async def create_seed_user():
     """Create seed user if configured and doesn't exist"""
     seed_email = os.getenv("SEED_USER_EMAIL")
     seed_password = os.getenv("SEED_USER_PASSWORD")
@@ -399,16 +411,99 @@ async def startup_event():
             user_doc = {
                 "email": seed_email,
                 "name": seed_name,
-                "password_hash": hash_password(seed_password),
+                "password_hash": await hash_password(seed_password),
                 "created_at": datetime.utcnow()
             }
-            await db.users.insert_one(user_doc)
+            try:
+                await db.users.insert_one(user_doc)
+            except DuplicateKeyError:
+                # Another instance starting at the same time created it first
+                print(f"[STARTUP] Seed user already exists: {seed_email}")
+                return
+            user_cache.invalidate(seed_email)
             print(f"[STARTUP] Created seed user: {seed_email}")
         else:
             print(f"[STARTUP] Seed user already exists: {seed_email}")
     else:
         print(f"[STARTUP] Seed user not configured (SEED_USER_EMAIL and SEED_USER_PASSWORD not set)")
 
+async def run_in_background(name: str, work) -> None:
+    """Await a startup task that runs after the app is serving, logging its failure"""
+    try:
+        await work
+    except Exception as e:
+        print(f"[STARTUP] {name} failed: {e}")
+
+async def startup_event():
+    """
+    Connect to Mongo, load templates, create indexes and start the run
+    workers, timing each phase (startup.py). The seed user (an Argon2 hash)
+    and the warm-up of the validation engine run after the app is serving.
+    """
+    with startup_report.phase("mongo client"):
+        connect_database()
+    with startup_report.phase("templates"):
+        await refresh_templates(force=True)
+    with startup_report.phase("indexes"):
+        await ensure_indexes(db)
+    with startup_report.phase("audit and events"):
+        audit_log.start(db.audit_logs)
+        await run_events.start(db)
+    if RUN_WORKERS_IN_API:
+        run_workers.start()
+    app.state.spool_watch = asyncio.create_task(watch_spools())
+    app.state.background = [asyncio.create_task(run_in_background("Seed user", create_seed_user()))]
+    if WARM_UP_IMPORTS:
+        app.state.background.append(asyncio.create_task(run_in_background("Warm-up", warm_up())))
+    startup_report.ready()
+
+async def prune_files():
+    """Delete spooled uploads, row states, columnar copies and export bundles past their retention"""
+    from columnar import prune_columnar
+    from exports import prune_exports
+    from revalidation import prune_row_states
+
+    await prune_spool(db.harmonization_runs)
+    for prune in (prune_row_states, prune_columnar, prune_exports):
+        await asyncio.to_thread(prune)
+
+async def watch_spools():
+    """
+    Release the spool budget of this instance's runs once any worker
+    finishes them, and prune expired files every PRUNE_INTERVAL_SECONDS
+    """
+    next_prune = time.monotonic()
+    while True:
+        await asyncio.sleep(RUN_POLL_SECONDS)
+        try:
+            await release_finished_runs(db.harmonization_runs)
+        except Exception as e:
+            print(f"[SPOOL] Failed to check finished runs: {e}")
+        if time.monotonic() >= next_prune:
+            next_prune = time.monotonic() + PRUNE_INTERVAL_SECONDS
+            try:
+                await prune_files()
+            except Exception as e:
+                print(f"[SPOOL] Failed to prune expired files: {e}")
+
+async def shutdown_event():
+    """
+    Drain run workers (runs still going after RUN_DRAIN_SECONDS go back to
+    the queue) and stop validation worker processes, then flush audit events
+    """
+    app.state.spool_watch.cancel()
+    for task in app.state.background:
+        task.cancel()
+    if RUN_WORKERS_IN_API:
+        await run_workers.stop()
+    # The validation pool only exists once the engine has been imported
+    if "executor" in sys.modules:
+        sys.modules["executor"].shutdown_pool()
+    shutdown_hashing()
+    await run_events.stop()
+    await audit_log.stop()
+    process_exited()
+
 # ============== Health Check ==============
 
 @app.get("/healthz")
@@ -427,9 +522,49 @@ async def health_check():
     return {
         "status": "ok" if db_status == "connected" else "degraded",
         "db_status": db_status,
+        "audit": audit_log.stats(),
+        "events": run_events.stats(),
+        "startup": startup_report.as_dict(),
         "timestamp": datetime.utcnow().isoformat()
     }
 
+@app.get("/metrics", dependencies=[Depends(require_metrics_token)])
+async def metrics():
+    """
+    Prometheus metrics of this process (see metrics.py); the queue depth is
+    counted when scraped. Scrapes authenticate with METRICS_TOKEN.
+    """
+    try:
+        QUEUE_DEPTH.set(await run_queue.depth())
+    except Exception as e:
+        print(f"[METRICS] Failed to count queued runs: {e}")
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/api/v1/admin/cache-stats")
+async def cache_stats(current_user: dict = Depends(get_admin_user)):
+    """
+    Hit/miss counters of the in-process caches.
+    Every user_cache hit is a users read that did not go to the database.
+    """
+    from result_cache import result_cache
+    from validation import plan_cache
+
+    return {
+        "user_cache": user_cache.stats(),
+        "token_cache": token_cache.stats(),
+        "plan_cache": plan_cache.stats(),
+        "result_cache": result_cache.stats()
+    }
+
+@app.get("/api/v1/admin/index-report")
+async def get_index_report(current_user: dict = Depends(get_admin_user)):
+    """
+    explain() the app's hot queries and show the plan each one gets.
+    Entries with collscan or in_memory_sort set are missing an index.
+    """
+    return await index_report(db)
+
 # ============== Authentication Endpoints ==============
 
 @app.post("/api/v1/auth/signup", response_model=Token)
@@ -454,7 +589,7 @@ async def signup(request: SignUpRequest = Body(...)):
         )
     
     # Create new user
-    password_hash = hash_password(request.password)
+    password_hash = await hash_password(request.password)
     
     user_doc = {
         "email": request.email,
@@ -463,10 +598,18 @@ async def signup(request: SignUpRequest = Body(...)):
         "created_at": datetime.utcnow()
     }
     
-    result = await db.users.insert_one(user_doc)
+    try:
+        result = await db.users.insert_one(user_doc)
+    except DuplicateKeyError:
+        # Lost a race with a concurrent signup; the unique email index caught it
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered",
+        )
+    user_cache.invalidate(request.email)
     
     # Log the signup event
-    await db.audit_logs.insert_one({
+    audit_log.emit({
         "action": "USER_SIGNUP",
         "user_email": request.email,
         "timestamp": datetime.utcnow(),
@@ -488,11 +631,16 @@ async def login(request: LoginRequest = Body(...)):
     """
     user = await get_user_by_email(request.email)
     
-    if not user or not verify_password(request.password, user["password_hash"]):
+    verified, new_hash = await verify_and_update(request.password, user["password_hash"]) if user else (False, None)
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
         )
+    if new_hash:
+        # Stored hash predates the current Argon2 cost settings; upgrade it
+        await db.users.update_one({"_id": user["_id"]}, {"$set": {"password_hash": new_hash}})
+        user_cache.invalidate(user["email"])
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -500,7 +648,7 @@ async def login(request: LoginRequest = Body(...)):
     )
     
     # Log the login event
-    await db.audit_logs.insert_one({
+    audit_log.emit({
         "action": "USER_LOGIN",
         "user_email": user["email"],
         "timestamp": datetime.utcnow(),
@@ -529,7 +677,7 @@ async def logout(current_user: dict = Depends(get_current_user)):
     but we log the logout event for audit trails.
     """
     # Log the logout event
-    await db.audit_logs.insert_one({
+    audit_log.emit({
         "action": "USER_LOGOUT",
         "user_email": current_user["email"],
         "timestamp": datetime.utcnow(),
@@ -576,7 +724,7 @@ async def save_mapping(mapping: MappingCreate, current_user: dict = Depends(get_
     result = await db.mapping_configurations.insert_one(mapping_doc)
     
     # Log the action
-    await db.audit_logs.insert_one({
+    audit_log.emit({
         "action": "MAPPING_SAVED",
         "user_email": current_user["email"],
         "timestamp": datetime.utcnow(),
@@ -610,7 +758,7 @@ async def delete_mapping(mapping_id: str, current_user: dict = Depends(get_curre
     await db.mapping_configurations.delete_one({"_id": ObjectId(mapping_id)})
     
     # Log the action
-    await db.audit_logs.insert_one({
+    audit_log.emit({
         "action": "MAPPING_DELETED",
         "user_email": current_user["email"],
         "timestamp": datetime.utcnow(),
@@ -619,6 +767,42 @@ async def delete_mapping(mapping_id: str, current_user: dict = Depends(get_curre
     
     return {"status": "success"}
 
+# ============== Schema Template Endpoints ==============
+
+@app.get("/api/v1/templates")
+async def list_templates(current_user: dict = Depends(get_current_user)):
+    """
+    Get all schema templates with their current versions.
+    """
+    await refresh_templates()
+    return [
+        {"id": template_id, "version": t["version"], "name": t["name"], "fields": t["fields"]}
+        for template_id, t in template_registry.all().items()
+    ]
+
+@app.put("/api/v1/templates/{template_id}")
+async def upsert_template(template_id: str, template: TemplateUpsert, current_user: dict = Depends(get_admin_user)):
+    """
+    Create or replace a schema template.
+    The template's version is bumped and only its cached validation plans are dropped.
+    """
+    await refresh_templates()
+    template_doc = {"name": template.name, "fields": template.fields}
+    try:
+        version = await save_template(db, template_id, template_doc)
+    except TemplateError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    # Log the action
+    audit_log.emit({
+        "action": "TEMPLATE_UPDATED",
+        "user_email": current_user["email"],
+        "timestamp": datetime.utcnow(),
+        "details": {"template_id": template_id, "version": version}
+    })
+
+    return {"id": template_id, "version": version, **template_doc}
+
 # ============== Harmonization Run Endpoints ==============
 
 @app.post("/api/v1/runs")
@@ -634,163 +818,396 @@ async def start_run(
     """
     mapping_data = json.loads(mapping)
     user_id = current_user["_id"]
+    await refresh_templates()
     
-    # Read file contents before they're consumed
-    file_contents = {}
-    for file in files:
-        content = await file.read()
-        file_contents[file.filename] = content
-        await file.seek(0)  # Reset file pointer
+    # Stream uploads to this run's spool directory instead of holding them in memory
+    run_id = ObjectId()
+    try:
+        spooled = await spool_uploads(str(run_id), files)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     
     run_doc = {
+        "_id": run_id,
         "user_id": user_id,
+        "user_email": current_user["email"],
         "status": "pending",
         "mapping": mapping_data,
         "files": [file.filename for file in files],
+        "uploads": [f.to_doc() for f in spooled.values()],
         "created_at": datetime.utcnow(),
-        "validation_issues": []
+        "attempts": 0,
+        "state_version": 0
     }
     
-    result = await db.harmonization_runs.insert_one(run_doc)
-    run_id = result.inserted_id
+    # Inserting the run queues it; a run worker validates it in the background
+    try:
+        await db.harmonization_runs.insert_one(run_doc)
+    except Exception:
+        release_run(str(run_id))
+        raise
+    run_workers.notify()
     
     # Log the action
-    await db.audit_logs.insert_one({
+    audit_log.emit({
         "action": "RUN_STARTED",
         "user_email": current_user["email"],
         "timestamp": datetime.utcnow(),
         "details": {"run_id": str(run_id), "files": run_doc["files"]}
     })
-
-    async def complete_run():
-        """Background task to perform REAL validation"""
-        await asyncio.sleep(1)  # Small delay for UI feedback
-        
-        all_issues = []
-        
-        # Process each file with its mapping
-        for file_mapping in mapping_data:
-            file_name = file_mapping.get("fileName")
-            template_id = file_mapping.get("templateId")
-            column_mapping = file_mapping.get("mapping", {})
-            
-            if file_name and file_name in file_contents:
-                # Run real validation
-                issues = validate_csv_data(
-                    file_content=file_contents[file_name],
-                    file_name=file_name,
-                    template_id=template_id,
-                    column_mapping=column_mapping
-                )
-                all_issues.extend(issues)
-        
-        # If no files were processed, add an info message
-        if len(all_issues) == 0:
-            all_issues.append({
-                "id": "1",
-                "severity": "Info",
-                "fileName": "N/A",
-                "rowIndex": None,
-                "columnName": None,
-                "description": "No files were processed for validation"
-            })
-        
-        await db.harmonization_runs.update_one(
-            {"_id": run_id},
-            {"$set": {
-                "status": "complete",
-                "validation_issues": all_issues,
-                "completed_at": datetime.utcnow()
-            }}
-        )
-        
-        # Log completion
-        await db.audit_logs.insert_one({
-            "action": "RUN_COMPLETED",
-            "user_email": current_user["email"],
-            "timestamp": datetime.utcnow(),
-            "details": {
-                "run_id": str(run_id),
-                "blockers": len([i for i in all_issues if i["severity"] == "Blocker"]),
-                "warnings": len([i for i in all_issues if i["severity"] == "Warning"]),
-                "infos": len([i for i in all_issues if i["severity"] == "Info"])
-            }
-        })
-
-    asyncio.create_task(complete_run())
     
     return {"status": "run started", "run_id": str(run_id)}
 
-@app.get("/api/v1/runs")
+# Fields list_runs reads; never the issues
+RUN_LIST_PROJECTION = {"status": 1, "files": 1, "created_at": 1, "completed_at": 1, "validation_summary": 1,
+                       "cache_hits": 1, "state_version": 1, "updated_at": 1}
+RUN_LIST_MAX_LIMIT = 100
+# Internal fields get_run leaves out; heartbeats change them without changing the run's state_version
+RUN_DETAIL_PROJECTION = {"lease_owner": 0, "lease_expires_at": 0, "heartbeat_at": 0}
+
+def encode_run_cursor(run: dict) -> str:
+    key = [run["created_at"].isoformat(), str(run["_id"])]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_run_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    try:
+        created_at, run_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), ObjectId(run_id)
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+@app.get("/api/v1/runs", response_model=List[RunListItem])
 async def list_runs(
+    request: Request,
     current_user: dict = Depends(get_current_user),
-    limit: int = 20
+    limit: int = 20,
+    cursor: Optional[str] = None
 ):
     """
-    Get all harmonization runs for the current user.
-    Returns a list of runs sorted by most recent first.
+    Get the current user's harmonization runs, most recent first.
+    Returns one page; when there are more runs, the X-Next-Cursor response
+    header holds the cursor for the next page. The page's ETag changes when
+    any run on it does; a matching If-None-Match gets a 304.
     """
     user_id = current_user["_id"]
+    limit = max(1, min(limit, RUN_LIST_MAX_LIMIT))
     
-    # Query runs for this user, sorted by most recent first
-    cursor = db.harmonization_runs.find({"user_id": user_id}).sort("created_at", -1).limit(limit)
-    runs = await cursor.to_list(length=limit)
+    # Keyset pagination on (created_at, _id), newest first
+    query = {"user_id": user_id}
+    if cursor:
+        created_at, last_id = decode_run_cursor(cursor)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": last_id}}
+        ]
     
-    result = []
-    for run in runs:
-        # Calculate validation summary
-        validation_issues = run.get("validation_issues", [])
-        blockers = len([i for i in validation_issues if i.get("severity") == "Blocker"])
-        warnings = len([i for i in validation_issues if i.get("severity") == "Warning"])
-        infos = len([i for i in validation_issues if i.get("severity") == "Info"])
-        
-        run_data = {
-            "id": str(run["_id"]),
-            "status": run.get("status", "pending"),
-            "files": run.get("files", []),
-            "created_at": run["created_at"].isoformat() if isinstance(run.get("created_at"), datetime) else run.get("created_at"),
-            "completed_at": run["completed_at"].isoformat() if isinstance(run.get("completed_at"), datetime) else run.get("completed_at"),
-            "validation_summary": {
-                "blockers": blockers,
-                "warnings": warnings,
-                "infos": infos,
-                "total": len(validation_issues)
-            }
-        }
-        result.append(run_data)
+    runs = await db.harmonization_runs.find(query, RUN_LIST_PROJECTION) \
+        .sort([("created_at", -1), ("_id", -1)]).limit(limit + 1).to_list(length=limit + 1)
+    next_cursor = None
+    if len(runs) > limit:
+        runs = runs[:limit]
+        next_cursor = encode_run_cursor(runs[-1])
     
-    return result
+    modified = max((m for m in map(last_modified, runs) if m is not None), default=None)
+    headers = cache_headers(list_etag(runs, next_cursor), modified)
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return not_modified(headers)
+    
+    result = [
+        RunListItem(
+            id=str(run["_id"]),
+            status=run.get("status", "pending"),
+            files=run.get("files", []),
+            created_at=run.get("created_at"),
+            completed_at=run.get("completed_at"),
+            # Stored when the run completes (backfill_run_summaries for older runs)
+            validation_summary=run.get("validation_summary")
+        ).model_dump()
+        for run in runs
+    ]
+    return FastJSONResponse(result, headers=headers)
 
-@app.get("/api/v1/runs/{run_id}")
-async def get_run(run_id: str, current_user: dict = Depends(get_current_user)):
+@app.get("/api/v1/runs/{run_id}", response_model=RunDetail)
+async def get_run(run_id: str, request: Request, current_user: dict = Depends(get_current_user)):
     """
     Get the status and results of a harmonization run.
-    Only the owner can view their runs.
+    Only the owner can view their runs. The ETag follows the run's
+    state_version; a poll with a matching If-None-Match gets a 304.
     """
+    if not ObjectId.is_valid(run_id):
+        raise HTTPException(status_code=404, detail="Run not found")
     user_id = current_user["_id"]
     
-    run = await db.harmonization_runs.find_one({
-        "_id": ObjectId(run_id),
-        "user_id": user_id
-    })
+    # The version check reads only what the ETag needs; the payload is built on a change
+    query = {"_id": ObjectId(run_id), "user_id": user_id}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        version = await db.harmonization_runs.find_one(
+            query, {"state_version": 1, "updated_at": 1, "completed_at": 1, "started_at": 1, "created_at": 1}
+        )
+        if not version:
+            raise HTTPException(status_code=404, detail="Run not found")
+        headers = cache_headers(run_etag(version), last_modified(version))
+        if etag_matches(if_none_match, headers["ETag"]):
+            return not_modified(headers)
     
+    run = await db.harmonization_runs.find_one(query, RUN_DETAIL_PROJECTION)
     if not run:
         raise HTTPException(status_code=404, detail="Run not found")
+    # From the document sent, which may be newer than the one checked above
+    headers = cache_headers(run_etag(run), last_modified(run))
+    
+    # Issues are stored separately; include the first page for clients that
+    # read them from here and point to /issues for the rest. Grouped runs
+    # also get their first page of groups (/issue-groups for the rest)
+    if "validation_issues" not in run:
+        preview, next_cursor = [], None
+        if run.get("status") == "complete":
+            preview, next_cursor = await find_issues(db, run, limit=ISSUE_PAGE_LIMIT)
+        run["validation_issues"] = preview
+        run["issues_truncated"] = next_cursor is not None
+    if run.get("issue_format") == GROUPED:
+        groups, next_cursor = await find_issue_groups(db.issue_groups, run["_id"], limit=ISSUE_GROUP_PAGE_LIMIT)
+        run["issue_groups"] = groups
+        run["issue_groups_truncated"] = next_cursor is not None
     
     run["_id"] = str(run["_id"])
     run["user_id"] = str(run["user_id"])
+    return FastJSONResponse(RunDetail.model_validate(run).model_dump(by_alias=True), headers=headers)
+
+@app.get("/api/v1/runs/{run_id}/issues")
+async def list_run_issues(
+    run_id: str,
+    severity: Optional[str] = None,
+    file: Optional[str] = None,
+    column: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Get one page of a run's validation issues, optionally filtered by
+    severity, file name and column. Issues are ordered by severity, file and
+    row; pass the returned next_cursor to get the following page.
+    """
+    if not ObjectId.is_valid(run_id):
+        raise HTTPException(status_code=404, detail="Run not found")
+    run = await db.harmonization_runs.find_one(
+        {"_id": ObjectId(run_id), "user_id": current_user["_id"]},
+        {"_id": 1, "issue_format": 1}
+    )
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
     
-    # Convert datetime objects to ISO strings
-    if "created_at" in run and isinstance(run["created_at"], datetime):
-        run["created_at"] = run["created_at"].isoformat()
-    if "completed_at" in run and isinstance(run["completed_at"], datetime):
-        run["completed_at"] = run["completed_at"].isoformat()
+    try:
+        items, next_cursor = await find_issues(
+            db, run, severity=severity, file_name=file, column=column, cursor=cursor, limit=limit
+        )
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     
-    return run
+    return FastJSONResponse({"items": items, "next_cursor": next_cursor})
+
+@app.get("/api/v1/runs/{run_id}/issue-groups")
+async def list_run_issue_groups(
+    run_id: str,
+    severity: Optional[str] = None,
+    file: Optional[str] = None,
+    column: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Get one page of a run's issues grouped by file, column and rule: each
+    group's message, issue count, row ranges and a few example issues, in
+    the order they were found. /issues expands them to one issue per row.
+    """
+    if not ObjectId.is_valid(run_id):
+        raise HTTPException(status_code=404, detail="Run not found")
+    run = await db.harmonization_runs.find_one(
+        {"_id": ObjectId(run_id), "user_id": current_user["_id"]},
+        {"_id": 1, "issue_format": 1}
+    )
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    if run.get("issue_format") != GROUPED:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail="This run's issues are not grouped; run backfill_run_summaries to group them")
+    
+    try:
+        items, next_cursor = await find_issue_groups(
+            db.issue_groups, run["_id"],
+            severity=severity, file_name=file, column=column, cursor=cursor, limit=limit
+        )
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    return FastJSONResponse({"items": items, "next_cursor": next_cursor})
+
+# Seconds between keep-alive comments on an idle event stream
+RUN_EVENTS_KEEPALIVE_SECONDS = 15
+
+def sse_message(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+@app.post("/api/v1/runs/{run_id}/events/token")
+async def create_stream_token(run_id: str, current_user: dict = Depends(get_current_user)):
+    """
+    A short-lived token for this run's event stream only, to pass as
+    ?access_token= where an Authorization header cannot be sent (EventSource).
+    """
+    if not ObjectId.is_valid(run_id):
+        raise HTTPException(status_code=404, detail="Run not found")
+    run = await db.harmonization_runs.find_one(
+        {"_id": ObjectId(run_id), "user_id": current_user["_id"]},
+        {"_id": 1}
+    )
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    
+    token = create_access_token(
+        data={"sub": current_user["email"], "scope": STREAM_TOKEN_SCOPE, "run_id": run_id},
+        expires_delta=timedelta(seconds=STREAM_TOKEN_SECONDS)
+    )
+    return {"access_token": token, "token_type": "bearer", "expires_in": STREAM_TOKEN_SECONDS}
+
+@app.get("/api/v1/runs/{run_id}/events")
+async def stream_run_events(run_id: str, current_user: dict = Depends(get_stream_user)):
+    """
+    Server-Sent Events stream of a run: its current status first, then
+    status changes, per-file results ("file") and validation progress
+    ("progress") as workers publish them. The stream ends once the run is
+    complete or failed. The run is read once; waiting costs no queries.
+    """
+    if not ObjectId.is_valid(run_id):
+        raise HTTPException(status_code=404, detail="Run not found")
+    # Subscribe before reading the run so no event falls in between
+    subscription = run_events.subscribe(run_id)
+    try:
+        run = await db.harmonization_runs.find_one(
+            {"_id": ObjectId(run_id), "user_id": current_user["_id"]},
+            {"status": 1, "error": 1, "validation_summary": 1, "cache_hits": 1}
+        )
+    except Exception:
+        subscription.close()
+        raise
+    if not run:
+        subscription.close()
+        raise HTTPException(status_code=404, detail="Run not found")
+    
+    async def stream():
+        try:
+            current = {key: value for key, value in run.items() if key != "_id"}
+            yield sse_message({"type": "status", "run_id": run_id, **current})
+            if run.get("status") in TERMINAL_STATUSES:
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), RUN_EVENTS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield sse_message(event)
+                if event["type"] == "status" and event["status"] in TERMINAL_STATUSES:
+                    return
+        finally:
+            subscription.close()
+    
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/api/v1/runs/{run_id}/export")
+async def export_run(run_id: str, parquet: bool = False, current_user: dict = Depends(get_current_user)):
+    """
+    Download a run's harmonized bundle as a zip: canonical tables, a join
+    index, the mapping, the validation report and a manifest with file
+    hashes. With ?parquet=true the canonical tables are included as Parquet
+    too. Refused unless the run completed with zero Blockers. The zip is
+    streamed while it is built; repeat exports reuse the finished bundle.
+    """
+    from columnar import find_columnar
+    from exports import bundle_tables, cached_export, stream_bundle
+    from validation import plan_cache
+
+    if not ObjectId.is_valid(run_id):
+        raise HTTPException(status_code=404, detail="Run not found")
+    run = await db.harmonization_runs.find_one({"_id": ObjectId(run_id), "user_id": current_user["_id"]})
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    summary = run.get("validation_summary")
+    if run.get("status") != "complete" or not summary or summary.get("blockers", 1) != 0:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail="Only runs that completed with zero Blockers can be exported")
+    
+    audit_details = {"run_id": run_id, "parquet": parquet}
+    filename = f"MDO_Export_Bundle_{run_id}.zip"
+    cached = cached_export(run_id, parquet)
+    if cached:
+        audit_log.emit({
+            "action": "BUNDLE_EXPORTED",
+            "user_email": current_user["email"],
+            "timestamp": datetime.utcnow(),
+            "details": {**audit_details, "cached": True}
+        })
+        return FileResponse(cached, media_type="application/zip", filename=filename)
+    
+    # Tables come from the columnar copies made when the run completed, else
+    # from the spooled uploads, in mapping order
+    await refresh_templates()
+    uploads = {upload["fileName"]: upload for upload in run.get("uploads", [])}
+    files = []
+    templates = {}
+    for file_mapping in run.get("mapping", []):
+        file_name = file_mapping.get("fileName")
+        if file_name not in uploads:
+            continue
+        template_id = file_mapping.get("templateId")
+        plan = plan_cache.get(template_id, file_mapping.get("mapping", {}))
+        if plan is None:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail=f"Template '{template_id}' no longer exists")
+        path = spooled_path(run_id, uploads[file_name])
+        columnar = find_columnar(uploads[file_name].get("sha256"), plan.columns)
+        if columnar is None and not os.path.exists(path):
+            raise HTTPException(status_code=status.HTTP_410_GONE,
+                                detail="Uploaded files of this run are no longer available; start a new run")
+        files.append((file_name, path, plan, columnar))
+        templates[template_id] = plan.template_version
+    # Keep the spool from being pruned while the bundle is built
+    if os.path.isdir(run_spool_dir(run_id)):
+        os.utime(run_spool_dir(run_id))
+    
+    manifest = {
+        "run_id": run_id,
+        "user_email": run.get("user_email"),
+        "created_at": run["created_at"].isoformat() if isinstance(run.get("created_at"), datetime) else run.get("created_at"),
+        "completed_at": run["completed_at"].isoformat() if isinstance(run.get("completed_at"), datetime) else run.get("completed_at"),
+        "templates": templates,
+        "validation_summary": {key: summary.get(key) for key in ("blockers", "warnings", "infos", "total")},
+        "sources": [
+            {"fileName": file_name, "templateId": plan.template_id, "size": uploads[file_name].get("size"),
+             "sha256": uploads[file_name].get("sha256")}
+            for file_name, _, plan, _ in files
+        ],
+    }
+    audit_log.emit({
+        "action": "BUNDLE_EXPORTED",
+        "user_email": current_user["email"],
+        "timestamp": datetime.utcnow(),
+        "details": {**audit_details, "cached": False}
+    })
+    return StreamingResponse(
+        stream_bundle(iter_issues(db, run), run, bundle_tables(files), manifest, parquet),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 # ============== Run the application ==============
 
 if __name__ == "__main__":
-    import uvicorn
-    port = int(os.getenv("PORT", "8000"))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Same as start.py, WEB_CONCURRENCY workers included
+    from start import serve
+    serve()
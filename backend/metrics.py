@@ -0,0 +1,218 @@
+"""
+Prometheus metrics and run stage timings.
+
+The API serves every metric of its process at GET /metrics to scrapes
+sending METRICS_TOKEN as a bearer token; a standalone worker (worker.py)
+serves its own on WORKER_METRICS_PORT. When the API runs several worker
+processes (start.py), PROMETHEUS_MULTIPROC_DIR is set and each process
+writes its metrics there, so a scrape of any of them returns the totals of
+all. Mongo latency comes
+from a pymongo command listener on each client, so every query is covered
+without wrapping call sites.
+
+A run's time is split into stages:
+- parse: reading its CSVs;
+- validate: evaluating rules (field_failures), plus the cross-file and
+  barcode checks;
+- persist: writing its issues;
+- export: columnar copies for export.
+Most of that work runs in the validation pool. Every pool job measures
+itself (run_timed_job) and hands its stage times and rows validated back to
+the run that submitted it, which also stores them on the run document. Stage
+times are summed over a run's files, which are validated in parallel, so
+they can add up to more than the run took.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess, start_http_server
+)
+from pymongo import monitoring
+
+RUN_STAGES = ("parse", "validate", "persist", "export")
+
+# ============== Metrics ==============
+
+REQUEST_SECONDS = Histogram(
+    "mdo_http_request_duration_seconds", "HTTP request latency, to the start of the response",
+    ["method", "route", "status"],
+)
+MONGO_SECONDS = Histogram(
+    "mdo_mongo_operation_duration_seconds", "Mongo command latency", ["collection", "operation"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+MONGO_FAILURES = Counter("mdo_mongo_operation_failures_total", "Failed Mongo commands", ["collection", "operation"])
+QUEUE_DEPTH = Gauge("mdo_run_queue_depth", "Runs waiting to be claimed", multiprocess_mode="mostrecent")
+ACTIVE_RUNS = Gauge("mdo_runs_active", "Runs being processed by this process", multiprocess_mode="livesum")
+RUNS = Counter("mdo_runs_total", "Runs processed by this process", ["outcome"])
+RUN_SECONDS = Histogram(
+    "mdo_run_duration_seconds", "Time from claiming a run to completing it",
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+RUN_STAGE_SECONDS = Histogram(
+    "mdo_run_stage_seconds", "Seconds a run spent in each stage, summed over its files", ["stage"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+ROWS_VALIDATED = Counter("mdo_rows_validated_total", "Rows validated (cached results and unchanged rows excluded)")
+RUN_ROWS_PER_SECOND = Histogram(
+    "mdo_run_rows_per_second", "Rows a run validated per second of its parse and validate stages",
+    buckets=(1e3, 1e4, 5e4, 1e5, 2e5, 5e5, 1e6, 2e6, 5e6),
+)
+ISSUES = Counter("mdo_validation_issues_total", "Validation issues found", ["severity"])
+
+
+def render() -> Tuple[bytes, str]:
+    """Body and content type of a scrape."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def process_exited() -> None:
+    """Drop this process's live gauges from the shared metrics (multi-process mode only)."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def serve(port: int) -> None:
+    """Serve /metrics on its own port from a background thread (processes without the API)."""
+    start_http_server(port)
+    print(f"[METRICS] Serving metrics on port {port}")
+
+
+# ============== Mongo Command Listener ==============
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every command by collection; pass it to the client as event_listeners=[...]."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._collections: Dict[Tuple[Any, int], str] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        target = event.command.get(event.command_name)
+        with self._lock:
+            self._collections[(event.connection_id, event.request_id)] = target if isinstance(target, str) else ""
+
+    def _finished(self, event, failed: bool) -> None:
+        with self._lock:
+            collection = self._collections.pop((event.connection_id, event.request_id), "")
+        MONGO_SECONDS.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+        if failed:
+            MONGO_FAILURES.labels(collection, event.command_name).inc()
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._finished(event, False)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._finished(event, True)
+
+
+mongo_metrics = MongoCommandMetrics()
+
+
+# ============== Run Stage Timings ==============
+
+class StageTimes:
+    """Seconds per stage and rows validated, accumulated for one run or one pool job."""
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(RUN_STAGES, 0.0)
+        self.rows = 0
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.seconds[stage] += seconds
+
+    def merge(self, seconds: Dict[str, float], rows: int) -> None:
+        for stage, value in seconds.items():
+            self.seconds[stage] += value
+        self.rows += rows
+
+    def rounded(self) -> Dict[str, float]:
+        return {stage: round(value, 3) for stage, value in self.seconds.items()}
+
+
+_current: ContextVar[Optional[StageTimes]] = ContextVar("stage_times", default=None)
+
+
+@contextmanager
+def collect_stages() -> Iterator[StageTimes]:
+    """Accumulate the stage times of everything run in this context (and tasks it starts)."""
+    times = StageTimes()
+    token = _current.set(times)
+    try:
+        yield times
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a block as part of a stage of the current run or job (a no-op outside one)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        times = _current.get()
+        if times is not None:
+            times.add(name, time.perf_counter() - started)
+
+
+def timed_stage(name: str) -> Callable:
+    """Decorator form of stage()."""
+    def decorate(fn: Callable) -> Callable:
+        @wraps(fn)
+        def timed(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return timed
+    return decorate
+
+
+def count_rows(rows: int) -> None:
+    """Record rows validated by the current run or job."""
+    times = _current.get()
+    if times is not None:
+        times.rows += rows
+
+
+def merge_stages(seconds: Dict[str, float], rows: int) -> None:
+    """Add a pool job's stage times to the current run."""
+    times = _current.get()
+    if times is not None:
+        times.merge(seconds, rows)
+
+
+def run_timed_job(fn: Callable, default_stage: str, *args) -> Tuple[Any, Dict[str, float], int]:
+    """
+    Run a pool job and return its result, stage times and rows validated.
+    Time not claimed by a stage inside the job is counted as default_stage.
+    """
+    with collect_stages() as times:
+        started = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - started
+        times.add(default_stage, max(elapsed - sum(times.seconds.values()), 0.0))
+    return result, times.seconds, times.rows
+
+
+def observe_run(seconds: float, times: StageTimes, summary: Dict[str, Any]) -> None:
+    """Record a completed run."""
+    RUNS.labels("complete").inc()
+    RUN_SECONDS.observe(seconds)
+    for name, value in times.seconds.items():
+        RUN_STAGE_SECONDS.labels(name).observe(value)
+    ROWS_VALIDATED.inc(times.rows)
+    working = times.seconds["parse"] + times.seconds["validate"]
+    if times.rows and working > 0:
+        RUN_ROWS_PER_SECOND.observe(times.rows / working)
+    for severity, key in (("Blocker", "blockers"), ("Warning", "warnings"), ("Info", "infos")):
+        ISSUES.labels(severity).inc(summary.get(key, 0))
@@ -0,0 +1,93 @@
+"""
+Password hashing off the event loop.
+
+Argon2 is deliberately slow and memory-hungry (ARGON2_MEMORY_COST KiB per
+hash), so hashing and verification run on a small dedicated thread pool
+(argon2-cffi releases the GIL while hashing). A semaphore caps the hashes in
+flight at PASSWORD_HASH_CONCURRENCY, which bounds both CPU and memory during
+a burst of logins; callers beyond that wait without blocking other requests.
+
+passlib is imported, and the hashing context built, on the pool the first
+time a password is hashed or verified, so importing this module is cheap.
+
+Cost parameters come from the environment. Stored hashes made with other
+parameters still verify, and verify_and_update() returns a fresh hash for
+them so login can upgrade the stored one.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+# Argon2 cost: passes, memory per hash (KiB) and lanes (defaults: passlib's 3, 65536, 4)
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
+# Threads hashing passwords, and hashes in flight at once (queued callers wait)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY", str(PASSWORD_HASH_WORKERS)))
+
+_context = None
+_context_lock = threading.Lock()
+_pool: Optional[ThreadPoolExecutor] = None
+_slots: Optional[asyncio.Semaphore] = None
+
+
+def _get_context():
+    global _context
+    with _context_lock:
+        if _context is None:
+            from passlib.context import CryptContext
+
+            # Argon2 has no password length limit and is more secure than bcrypt
+            _context = CryptContext(
+                schemes=["argon2"],
+                deprecated="auto",
+                argon2__rounds=ARGON2_TIME_COST,
+                argon2__memory_cost=ARGON2_MEMORY_COST,
+                argon2__parallelism=ARGON2_PARALLELISM,
+            )
+        return _context
+
+
+def _call(method: str, *args):
+    return getattr(_get_context(), method)(*args)
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="argon2")
+    return _pool
+
+
+async def _run(method: str, *args):
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(PASSWORD_HASH_CONCURRENCY)
+    async with _slots:
+        return await asyncio.get_running_loop().run_in_executor(_get_pool(), _call, method, *args)
+
+
+async def hash_password(password: str) -> str:
+    return await _run("hash", password)
+
+
+async def verify_password(password: str, password_hash: str) -> bool:
+    return await _run("verify", password, password_hash)
+
+
+async def verify_and_update(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verify a password; on success also returns a new hash if the stored one
+    was made with other cost parameters (None otherwise).
+    """
+    return await _run("verify_and_update", password, password_hash)
+
+
+def shutdown_hashing() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -0,0 +1,180 @@
+"""
+Run payload responses.
+
+Run payloads (GET /runs, GET /runs/{run_id} and issue pages) are serialized
+with orjson instead of FastAPI's jsonable_encoder/json path.
+
+Conditional GET: every client-visible change to a run increments its
+state_version and sets updated_at (run_queue.py). Run payloads carry an
+ETag derived from the versions they show, plus Last-Modified. A poll whose
+If-None-Match still matches gets a 304 without the payload being built or
+serialized. Only If-None-Match is evaluated, because Last-Modified has
+one-second resolution and a run can change several times within a second.
+
+CompressionMiddleware compresses JSON responses of at least
+RESPONSE_COMPRESS_MIN_BYTES bytes. It uses zstd when the client accepts it
+and gzip otherwise. Streamed responses (event streams, export bundles) are
+passed through untouched.
+"""
+import asyncio
+import gzip
+import hashlib
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from typing import Any, Dict, Iterable, Optional
+
+import orjson
+import zstandard
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+
+# Smallest JSON response body that is compressed
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "1024"))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+RESPONSE_ZSTD_LEVEL = int(os.getenv("RESPONSE_ZSTD_LEVEL", "3"))
+
+# Part of every ETag; bump it when the shape of run payloads changes so
+# copies cached before a deploy stop validating
+PAYLOAD_VERSION = 2
+
+COMPRESSIBLE_TYPES = ("application/json",)
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson (datetimes as ISO strings, ObjectIds as strings)."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+# ============== Conditional GET ==============
+
+def run_etag(run: Dict[str, Any]) -> str:
+    return f'W/"{PAYLOAD_VERSION}-{run["_id"]}-{run.get("state_version", 0)}"'
+
+
+def list_etag(runs: Iterable[Dict[str, Any]], next_cursor: Optional[str]) -> str:
+    """ETag of a page of runs: the ids and versions on it, and whether more follow."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{PAYLOAD_VERSION}:{next_cursor or ''}".encode())
+    for run in runs:
+        digest.update(f";{run['_id']}:{run.get('state_version', 0)}".encode())
+    return f'W/"{digest.hexdigest()}"'
+
+
+def last_modified(run: Dict[str, Any]) -> Optional[datetime]:
+    """When the run last changed, for runs saved before updated_at was recorded too."""
+    for field in ("updated_at", "completed_at", "started_at", "created_at"):
+        if isinstance(run.get(field), datetime):
+            return run[field]
+    return None
+
+
+def cache_headers(etag: str, modified: Optional[datetime]) -> Dict[str, str]:
+    # Cached copies must be revalidated on every use, and only by the user's own client
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if modified is not None:
+        headers["Last-Modified"] = format_datetime(modified.replace(tzinfo=timezone.utc), usegmt=True)
+    return headers
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def not_modified(headers: Dict[str, str]) -> Response:
+    return Response(status_code=304, headers=headers)
+
+
+# ============== Compression ==============
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """zstd or gzip, whichever the Accept-Encoding header allows (zstd preferred), else None."""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip()] = quality
+    for coding in ("zstd", "gzip"):
+        if accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=RESPONSE_ZSTD_LEVEL).compress(body)
+    return gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing complete (non-streamed) JSON responses."""
+
+    def __init__(self, app, minimum_size: int = RESPONSE_COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Dict[str, Any]] = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+            elif message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "").split(";")[0].strip()
+                if "content-encoding" in headers or content_type not in COMPRESSIBLE_TYPES:
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message
+            elif message["type"] == "http.response.body" and start is not None:
+                headers = MutableHeaders(scope=start)
+                headers.add_vary_header("Accept-Encoding")
+                if message.get("more_body", False):
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                body = message.get("body", b"")
+                if len(body) >= self.minimum_size:
+                    body = await asyncio.to_thread(compress, body, encoding)
+                    headers["Content-Encoding"] = encoding
+                    headers["Content-Length"] = str(len(body))
+                await send(start)
+                await send({"type": "http.response.body", "body": body})
+            else:
+                await send(message)
+
+        await self.app(scope, receive, send_compressed)
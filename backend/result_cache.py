@@ -0,0 +1,151 @@
+"""
+Content-addressed cache of per-file validation results.
+
+A file's issues depend only on its bytes, the template version and the
+column mapping, so they are cached under the SHA-256 of those. When a run
+is resubmitted after fixing one file, the unchanged files reuse their issues
+instead of being parsed and validated again.
+
+There are two tiers: a bounded in-process LRU, and the `validation_cache`
+collection shared by every API and worker process. Both are bounded by size
+(RESULT_CACHE_MEMORY_BYTES and RESULT_CACHE_MAX_BYTES); the least recently
+used entries are evicted first. The collection keeps a running total of
+its entries' bytes in one document, so a write only has to evict when that
+total goes over the limit. Issues are stored grouped (issue_groups.py)
+and without file names, so a renamed copy of a file is a hit too. Cached
+groups are shared between runs and must not be modified.
+"""
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import bson
+from pymongo import ASCENDING, ReturnDocument
+
+from issue_groups import IssueGroup
+from validation import canonical_mapping
+
+# Bytes of cached results kept in memory per process (default: 64 MB)
+RESULT_CACHE_MEMORY_BYTES = int(os.getenv("RESULT_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+# Bytes of cached results kept in the validation_cache collection (default: 1 GB, 0 disables the tier)
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+# Results too large for one Mongo document are only cached in memory
+MAX_DOCUMENT_BYTES = 15 * 1024 * 1024
+# Bump when a change to the validation engine (or to how results are
+# stored) changes its output, so results cached by older code are not reused
+RESULT_FORMAT_VERSION = 2
+
+# _id of the document holding the running byte total of validation_cache
+TOTAL_ID = "total_size"
+# Every cached result, and not the total (which has no last_used_at)
+CACHED = {"last_used_at": {"$gt": datetime.min}}
+
+
+def result_key(file_sha256: str, template_id: str, template_version: int, column_mapping: Dict[str, str]) -> str:
+    material = json.dumps([
+        RESULT_FORMAT_VERSION, file_sha256, template_id, template_version, canonical_mapping(column_mapping)
+    ])
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Validation results by result_key(). Only used from the event loop, so
+    the memory tier needs no lock.
+    """
+
+    def __init__(self, memory_bytes: int = RESULT_CACHE_MEMORY_BYTES, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self._memory_bytes = memory_bytes
+        self._max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[int, List[IssueGroup]]]" = OrderedDict()
+        self._size = 0
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    async def get(self, collection, key: str) -> Optional[List[IssueGroup]]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.memory_hits += 1
+            return entry[1]
+        if self._max_bytes > 0:
+            doc = await collection.find_one_and_update(
+                {"_id": key}, {"$set": {"last_used_at": datetime.utcnow()}}
+            )
+            if doc is not None:
+                self._remember(key, doc["groups"], doc["size"])
+                self.db_hits += 1
+                return doc["groups"]
+        self.misses += 1
+        return None
+
+    async def put(self, collection, key: str, groups: List[IssueGroup]) -> None:
+        now = datetime.utcnow()
+        doc = {"_id": key, "groups": groups, "created_at": now, "last_used_at": now}
+        size = len(bson.encode(doc))
+        self._remember(key, groups, size)
+        if self._max_bytes <= 0 or size > min(self._max_bytes, MAX_DOCUMENT_BYTES):
+            return
+        doc["size"] = size
+        previous = await collection.find_one_and_replace({"_id": key}, doc, {"size": 1}, upsert=True)
+        total = await self._add_bytes(collection, size - (previous["size"] if previous else 0))
+        if total > self._max_bytes:
+            await self._evict(collection, total - self._max_bytes)
+
+    def _remember(self, key: str, groups: List[IssueGroup], size: int) -> None:
+        if size > self._memory_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= previous[0]
+        self._entries[key] = (size, groups)
+        self._size += size
+        while self._size > self._memory_bytes:
+            evicted_size, _ = self._entries.popitem(last=False)[1]
+            self._size -= evicted_size
+
+    async def _add_bytes(self, collection, delta: int) -> int:
+        """Add delta to the collection's byte total and return the new total."""
+        doc = await collection.find_one_and_update(
+            {"_id": TOTAL_ID}, {"$inc": {"bytes": delta}}, return_document=ReturnDocument.AFTER
+        )
+        if doc is not None:
+            return doc["bytes"]
+        # No total yet (a new collection, or one filled by older code): count once
+        totals = await collection.aggregate([
+            {"$match": CACHED}, {"$group": {"_id": None, "size": {"$sum": "$size"}}}
+        ]).to_list(1)
+        await collection.update_one(
+            {"_id": TOTAL_ID}, {"$setOnInsert": {"bytes": totals[0]["size"] if totals else 0}}, upsert=True
+        )
+        return (await collection.find_one({"_id": TOTAL_ID}))["bytes"]
+
+    async def _evict(self, collection, excess: int) -> None:
+        """Delete the least recently used documents until excess bytes are freed."""
+        evicted = freed = 0
+        while freed < excess:
+            doc = await collection.find_one_and_delete(CACHED, {"size": 1}, sort=[("last_used_at", ASCENDING)])
+            if doc is None:
+                break
+            evicted += 1
+            freed += doc["size"]
+        if freed:
+            await collection.update_one({"_id": TOTAL_ID}, {"$inc": {"bytes": -freed}})
+            print(f"[CACHE] Evicted {evicted} cached validation result(s)")
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries), "bytes": self._size, "max_bytes": self._memory_bytes,
+            "memory_hits": self.memory_hits, "db_hits": self.db_hits, "misses": self.misses,
+        }
+
+
+result_cache = ResultCache()
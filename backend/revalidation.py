@@ -0,0 +1,384 @@
+"""
+Incremental revalidation of re-uploaded files.
+
+After a file is validated, a row state is saved for it: a hash of every
+data row's bytes, the row-level issues found in each row, the hashed _ID
+values, and the dtype kind of every mapped column. When the same logical
+file (same user, file name and template) is uploaded again, rows whose bytes
+are unchanged carry their issues forward at their new row numbers, and only
+inserted or edited rows are parsed and checked. Duplicate _ID values are
+resolved over the carried-forward value hashes plus those of the new rows.
+
+The result is exactly what a full validation would return. Files the row
+state cannot describe exactly (quoted fields, bare carriage returns, rows
+that change a column's dtype) are validated in full, and a new row state is
+saved from that validation. Whether a column's dtype could have changed is
+settled by re-parsing the new rows together with a few "witness" rows that
+established the column's kind last time.
+"""
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import time
+from dataclasses import replace
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from validation import (
+    CHECK_DUPLICATE, ROW_NUMBER_OFFSET, CsvSource, FailureBatch, ValidationPlan, column_kind,
+    field_failures, hash_values, make_issue, present_strings, read_csv_frame, rule_status,
+)
+from metrics import count_rows
+from uploads import mapped
+
+# Directory row states are kept in (shared storage if workers run on other hosts)
+ROW_STATE_DIR = os.getenv("ROW_STATE_DIR") or os.path.join(tempfile.gettempdir(), "mdo-row-state")
+# Row states not used for this many seconds are deleted (default: 7 days)
+ROW_STATE_RETENTION_SECONDS = int(os.getenv("ROW_STATE_RETENTION_SECONDS", str(7 * 24 * 3600)))
+# Re-uploads changing more than this fraction of rows are validated in full
+ROW_STATE_MAX_CHANGED_FRACTION = float(os.getenv("ROW_STATE_MAX_CHANGED_FRACTION", "0.5"))
+
+# Rows kept per mapped column to re-establish its dtype kind, picked from
+# among the column's first WITNESS_SCAN_ROWS non-empty cells
+WITNESS_ROWS = 4
+WITNESS_SCAN_ROWS = 10000
+# Bump when the row state layout (or the engine's output) changes
+ROW_STATE_FORMAT = 2
+
+_BLANK_LINE = re.compile(rb"\n\s*(?:\n|$)")
+
+# Row-level issues of one field as parallel arrays: row position, check, severity, description
+RowIssues = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+def row_state_path(user_id: str, file_name: str, template_id: str) -> str:
+    key = hashlib.sha256(json.dumps([str(user_id), file_name, template_id]).encode()).hexdigest()
+    return os.path.join(ROW_STATE_DIR, f"{key}.npz")
+
+
+def prune_row_states(retention_seconds: int = ROW_STATE_RETENTION_SECONDS) -> int:
+    """Delete row states not used for retention_seconds; returns how many were removed."""
+    if not os.path.isdir(ROW_STATE_DIR):
+        return 0
+    cutoff = time.time() - retention_seconds
+    removed = 0
+    for entry in os.scandir(ROW_STATE_DIR):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+# ============== Rows ==============
+
+def split_rows(data: bytes) -> Optional[Tuple[bytes, List[bytes]]]:
+    """
+    The header line and the data rows of a CSV, one line per row, or None
+    when lines and rows might not correspond (quoted fields, bare \\r).
+    Blank lines are dropped, as pandas skips them.
+    """
+    if b'"' in data:
+        return None
+    # Newlines at the end of the file end the last row, they do not add rows
+    data = data.rstrip(b"\r\n")
+    lines = data.split(b"\n")
+    if b"\r" in data:
+        lines = [line[:-1] if line.endswith(b"\r") else line for line in lines]
+        if any(b"\r" in line for line in lines):
+            return None
+    if not lines[0].strip():
+        return None
+    if _BLANK_LINE.search(data, len(lines[0])):
+        return lines[0], [line for line in lines[1:] if line.strip()]
+    return lines[0], lines[1:]
+
+
+def hash_rows(rows: List[bytes]) -> np.ndarray:
+    return pd.util.hash_array(np.array(rows, dtype=object), categorize=False)
+
+
+def plan_key(plan: ValidationPlan) -> list:
+    return [plan.template_id, plan.template_version, [[rule.name, rule.csv_column] for rule in plan.rules]]
+
+
+def witness_rows(column: pd.Series, kind: str) -> np.ndarray:
+    """
+    A few positions whose cells, parsed on their own, give the column the
+    same kind. A wrong pick only costs a full validation later.
+    """
+    missing = column.isna().to_numpy()
+    if kind in ("empty", "int"):
+        return np.arange(min(1, len(column)))
+    if kind == "bool":
+        return np.flatnonzero(~missing)[:1]
+    if kind == "float":
+        empty = np.flatnonzero(missing)[:WITNESS_ROWS // 2]
+        if len(empty):
+            # Integers with missing values become floats
+            return np.concatenate([empty, np.flatnonzero(~missing)[:WITNESS_ROWS // 2]])
+        values = column.to_numpy(dtype=float)
+        return np.flatnonzero(np.isfinite(values) & (values != np.trunc(values)))[:WITNESS_ROWS]
+    # Text: cells that are neither numbers nor booleans
+    present = np.flatnonzero(~missing)[:WITNESS_SCAN_ROWS]
+    values = column.iloc[present]
+    numeric = pd.to_numeric(values, errors="coerce").isna().to_numpy()
+    is_str = values.map(lambda v: isinstance(v, str)).to_numpy(dtype=bool)
+    boolean = values.astype(str).str.strip().str.lower().isin(["true", "false"]).to_numpy()
+    return present[numeric & is_str & ~boolean][:WITNESS_ROWS]
+
+
+def _row_issues(batches: List[FailureBatch]) -> RowIssues:
+    if not batches:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, str), np.zeros(0, str)
+    return (
+        np.concatenate([b[0] for b in batches]).astype(np.int64),
+        np.concatenate([np.full(len(b[0]), b[1]) for b in batches]).astype(np.int64),
+        np.array([b[2] for b in batches for _ in b[0]], dtype=str),
+        np.array([d for b in batches for d in b[3]], dtype=str),
+    )
+
+
+def _concat(parts: List[RowIssues]) -> RowIssues:
+    return tuple(np.concatenate([part[i] for part in parts]) for i in range(4))
+
+
+def _in_row_order(issues: RowIssues) -> RowIssues:
+    """Sort by row, then check, like validation.ordered_failures."""
+    order = np.lexsort((issues[1], issues[0]))
+    return tuple(array[order] for array in issues)
+
+
+def _assemble(plan: ValidationPlan, columns, file_name: str, rows: Dict[int, RowIssues]) -> List[Dict[str, Any]]:
+    """Issue list in the whole-file engine's order: field by field, then row by row."""
+    issues = []
+    for n, rule in enumerate(plan.rules):
+        _, description = rule_status(rule, columns)
+        if description:
+            issues.append(make_issue(len(issues) + 1, "Blocker", file_name, None, rule.name, description))
+        if n not in rows:
+            continue
+        positions, _, severities, descriptions = rows[n]
+        for position, severity, description in zip(positions.tolist(), severities.tolist(), descriptions.tolist()):
+            issues.append(make_issue(
+                len(issues) + 1, severity, file_name, position + ROW_NUMBER_OFFSET, rule.name, description
+            ))
+
+    # If no issues found, add an info message
+    if len(issues) == 0:
+        issues.append(make_issue(1, "Info", file_name, None, None, "All validations passed successfully!"))
+    return issues
+
+
+def _duplicates(hashes: np.ndarray, names: Dict[int, str]) -> Optional[RowIssues]:
+    """
+    Duplicate _ID issues from per-row value hashes (0 for empty cells).
+    None if a duplicated value's text is not known.
+    """
+    present = np.flatnonzero(hashes != 0)
+    values = hashes[present]
+    repeated = pd.Series(values).duplicated(keep="first").to_numpy()
+    first_seen = pd.Series(present[~repeated], index=values[~repeated])
+    first_rows = first_seen.reindex(values[repeated]).to_numpy() + ROW_NUMBER_OFFSET
+    descriptions = []
+    for value, row in zip(values[repeated].tolist(), first_rows.tolist()):
+        if value not in names:
+            return None
+        descriptions.append(f"Duplicate value '{names[value]}' (first seen in row {row})")
+    count = int(repeated.sum())
+    return (
+        present[repeated].astype(np.int64), np.full(count, CHECK_DUPLICATE, dtype=np.int64),
+        np.array(["Warning"] * count, dtype=str), np.array(descriptions, dtype=str),
+    )
+
+
+def _repeated_names(hashes: np.ndarray, names: Dict[int, str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Hashes and text of the values that occur more than once, for the next revalidation."""
+    present = hashes[hashes != 0]
+    repeated = np.unique(present[pd.Series(present).duplicated(keep=False).to_numpy()])
+    return repeated, np.array([names[h] for h in repeated.tolist()], dtype=str)
+
+
+# ============== Row State ==============
+
+def _save_state(path: str, meta: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+    os.replace(temp_path, path)
+
+
+def _load_state(path: str) -> Optional[Tuple[Dict[str, Any], Dict[str, np.ndarray]]]:
+    try:
+        with np.load(path, allow_pickle=False) as state:
+            arrays = {key: state[key] for key in state.files}
+    except Exception:
+        return None
+    os.utime(path)
+    return json.loads(str(arrays.pop("meta"))), arrays
+
+
+def _state_arrays(row_hashes: np.ndarray, rows: Dict[int, RowIssues], values: Dict[int, np.ndarray],
+                  names: Dict[int, Tuple[np.ndarray, np.ndarray]], witnesses: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    arrays = {"row_hashes": row_hashes}
+    for n, issues in rows.items():
+        # Duplicate issues are recomputed every time; only per-cell issues are kept
+        kept = issues[1] != CHECK_DUPLICATE
+        for name, array in zip(("rows", "checks", "severities", "descriptions"), issues):
+            arrays[f"{name}_{n}"] = array[kept]
+    for n, hashes in values.items():
+        arrays[f"values_{n}"] = hashes
+        arrays[f"repeated_{n}"], arrays[f"names_{n}"] = names[n]
+    for i, positions in enumerate(witnesses.values()):
+        arrays[f"witness_{i}"] = positions.astype(np.int64)
+    return arrays
+
+
+def _kind_columns(plan: ValidationPlan, columns) -> List[str]:
+    return [c for c in dict.fromkeys(rule.csv_column for rule in plan.rules if rule.csv_column) if c in columns]
+
+
+def _validate_full(source: CsvSource, data: bytes, file_name: str, plan: ValidationPlan,
+                   state_path: str) -> List[Dict[str, Any]]:
+    """validation.validate_with_plan, saving a row state for the file on the way."""
+    try:
+        df = read_csv_frame(source)
+    except Exception as e:
+        return [make_issue(1, "Blocker", file_name, None, None, f"Failed to parse CSV: {str(e)}")]
+    count_rows(len(df))
+
+    rows: Dict[int, RowIssues] = {}
+    values: Dict[int, np.ndarray] = {}
+    names: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+    for n, rule in enumerate(plan.rules):
+        validate_rows, _ = rule_status(rule, df.columns)
+        if not validate_rows:
+            continue
+        column = df[rule.csv_column]
+        rows[n] = _in_row_order(_row_issues(field_failures(rule, column)))
+        if rule.unique:
+            positions, strings = present_strings(column)
+            present_hashes = hash_values(strings)
+            hashes = np.zeros(len(df), dtype=np.uint64)
+            hashes[positions] = present_hashes
+            values[n] = hashes
+            repeated = np.flatnonzero(pd.Series(present_hashes).duplicated(keep=False).to_numpy())
+            known = dict(zip(present_hashes[repeated].tolist(), strings.iloc[repeated].tolist()))
+            names[n] = _repeated_names(hashes, known)
+    issues = _assemble(plan, df.columns, file_name, rows)
+
+    split = split_rows(data)
+    if split is not None and len(split[1]) == len(df) and isinstance(df.index, pd.RangeIndex):
+        kinds = {c: column_kind(df[c]) for c in _kind_columns(plan, df.columns)}
+        witnesses = {c: witness_rows(df[c], kinds[c]) for c in kinds}
+        meta = {"format": ROW_STATE_FORMAT, "plan": plan_key(plan), "header": hashlib.sha256(split[0]).hexdigest(), "kinds": kinds}
+        _save_state(state_path, meta, _state_arrays(hash_rows(split[1]), rows, values, names, witnesses))
+    return issues
+
+
+def _revalidate(data: bytes, file_name: str, plan: ValidationPlan, state_path: str) -> Optional[List[Dict[str, Any]]]:
+    """Validate only the new and edited rows against the saved row state, or None if that is not possible."""
+    split = split_rows(data)
+    loaded = _load_state(state_path)
+    if split is None or loaded is None or not split[1]:
+        return None
+    header, lines = split
+    meta, state = loaded
+    if meta.get("format") != ROW_STATE_FORMAT or meta["plan"] != plan_key(plan) or meta["header"] != hashlib.sha256(header).hexdigest():
+        return None
+
+    # Each row either has the bytes of some row of the previous upload, or is new
+    row_hashes = hash_rows(lines)
+    previous = pd.Series(np.arange(len(state["row_hashes"])), index=state["row_hashes"])
+    previous = previous[~previous.index.duplicated()]
+    found = previous.index.get_indexer(row_hashes)
+    kept = np.flatnonzero(found >= 0)
+    source_rows = previous.to_numpy()[found[kept]]
+    added = np.flatnonzero(found < 0)
+    if len(added) > ROW_STATE_MAX_CHANGED_FRACTION * len(lines):
+        return None
+    # Extra fields make pandas fail, or treat the first column as the index
+    fields = header.count(b",")
+    if any(lines[i].count(b",") > fields for i in added.tolist()):
+        return None
+
+    # Parse the new rows behind the witness rows that still exist: if that
+    # gives every column its previous kind, so would the whole file
+    kinds = meta["kinds"]
+    current = pd.Series(np.arange(len(lines)), index=row_hashes)
+    current = current[~current.index.duplicated()]
+    old_witnesses = np.concatenate([state[f"witness_{i}"] for i in range(len(kinds))] or [np.zeros(0, np.int64)])
+    witness_positions = current.reindex(state["row_hashes"][old_witnesses]).dropna().to_numpy(dtype=np.int64)
+    witness_positions = np.unique(witness_positions)
+    parsed_rows = np.concatenate([witness_positions, added])
+    try:
+        df = pd.read_csv(io.BytesIO(b"\n".join([header] + [lines[i] for i in parsed_rows.tolist()])), low_memory=False)
+    except Exception:
+        return None
+    if len(df) != len(parsed_rows) or not isinstance(df.index, pd.RangeIndex):
+        return None
+    if any(column_kind(df[c]) != kind for c, kind in kinds.items()):
+        return None
+    new_rows = df.iloc[len(witness_positions):].reset_index(drop=True)
+
+    rows: Dict[int, RowIssues] = {}
+    values: Dict[int, np.ndarray] = {}
+    names: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+    for n, rule in enumerate(plan.rules):
+        validate_rows, _ = rule_status(rule, df.columns)
+        if not validate_rows:
+            continue
+        # Issues of unchanged rows, moved to the rows' new positions
+        previous_rows = state[f"rows_{n}"]
+        lo = np.searchsorted(previous_rows, source_rows, "left")
+        counts = np.searchsorted(previous_rows, source_rows, "right") - lo
+        picked = np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        carried = (np.repeat(kept, counts), state[f"checks_{n}"][picked],
+                   state[f"severities_{n}"][picked], state[f"descriptions_{n}"][picked])
+        fresh = _row_issues(field_failures(replace(rule, unique=False), new_rows[rule.csv_column]))
+        parts = [carried, (added[fresh[0]],) + fresh[1:]]
+
+        if rule.unique:
+            hashes = np.zeros(len(lines), dtype=np.uint64)
+            hashes[kept] = state[f"values_{n}"][source_rows]
+            positions, strings = present_strings(new_rows[rule.csv_column])
+            new_hashes = hash_values(strings)
+            hashes[added[positions]] = new_hashes
+            known = dict(zip(state[f"repeated_{n}"].tolist(), state[f"names_{n}"].tolist()))
+            known.update(zip(new_hashes.tolist(), strings.tolist()))
+            duplicates = _duplicates(hashes, known)
+            if duplicates is None:
+                return None
+            parts.append(duplicates)
+            values[n] = hashes
+            names[n] = _repeated_names(hashes, known)
+        rows[n] = _in_row_order(_concat(parts))
+
+    witnesses = {c: parsed_rows[witness_rows(df[c], kind)] for c, kind in kinds.items()}
+    _save_state(state_path, meta, _state_arrays(row_hashes, rows, values, names, witnesses))
+    count_rows(len(added))
+    print(f"[VALIDATION] {file_name}: revalidated {len(added)} of {len(lines)} rows")
+    return _assemble(plan, df.columns, file_name, rows)
+
+
+def validate_with_state(source: CsvSource, file_name: str, plan: ValidationPlan,
+                        state_path: str) -> List[Dict[str, Any]]:
+    """
+    Validate a file, reusing the row state at state_path when it describes
+    an earlier version of the file, and save the row state of this one.
+    Returns exactly what validation.validate_with_plan returns.
+    """
+    with mapped(source) as buffer:
+        data = bytes(buffer)
+    issues = _revalidate(data, file_name, plan, state_path)
+    if issues is None:
+        issues = _validate_full(source, data, file_name, plan, state_path)
+    return issues
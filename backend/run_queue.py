@@ -0,0 +1,270 @@
+"""
+Durable run queue.
+
+Runs are queued in the `harmonization_runs` collection itself: a run is
+inserted with status "pending" and workers claim it atomically with
+find_one_and_update, taking a lease that they keep alive with heartbeats.
+If a worker dies (restart, redeploy, crash) its lease expires and another
+worker reclaims the run; a run that has been claimed RUN_MAX_ATTEMPTS times
+without finishing is marked "failed".
+
+Workers are coroutines in a RunWorkerPool, either inside each API process
+or in a separate process (`python -m worker`). Any number of pools can share
+the queue: a claim is atomic, so each run is processed by one of them. On
+shutdown a pool stops claiming and gives the runs it is processing
+RUN_DRAIN_SECONDS to finish before handing them back to the queue. Every status change is published
+to run_events, and increments the run's state_version (the version its
+GET /runs payloads are cached by, see payloads.py); heartbeats only touch
+the lease, which clients never see.
+"""
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from pymongo import ASCENDING, ReturnDocument
+
+from events import run_events
+
+# Runs a worker pool processes at once
+RUN_WORKER_CONCURRENCY = int(os.getenv("RUN_WORKER_CONCURRENCY", "4"))
+# A claimed run is reclaimable once its lease is this old without a heartbeat
+RUN_LEASE_SECONDS = int(os.getenv("RUN_LEASE_SECONDS", "60"))
+# How often a worker renews the lease of the run it is processing
+RUN_HEARTBEAT_SECONDS = int(os.getenv("RUN_HEARTBEAT_SECONDS", str(max(RUN_LEASE_SECONDS // 4, 1))))
+# How often idle workers look for queued or expired runs
+RUN_POLL_SECONDS = float(os.getenv("RUN_POLL_SECONDS", "2"))
+# Claims after which an unfinished run is given up on
+RUN_MAX_ATTEMPTS = int(os.getenv("RUN_MAX_ATTEMPTS", "3"))
+# On shutdown, seconds runs in progress get to finish before they go back to the queue
+RUN_DRAIN_SECONDS = float(os.getenv("RUN_DRAIN_SECONDS", "20"))
+
+LEASE_FIELDS = {"lease_owner": "", "lease_expires_at": "", "heartbeat_at": ""}
+
+
+def new_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class RunQueue:
+    """Claim, heartbeat and finish operations on queued runs."""
+
+    def __init__(self, collection, worker_id: Optional[str] = None,
+                 lease_seconds: int = RUN_LEASE_SECONDS, max_attempts: int = RUN_MAX_ATTEMPTS):
+        self.collection = collection
+        self.worker_id = worker_id or new_worker_id()
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def _lease(self, now: datetime) -> Dict[str, Any]:
+        return {
+            "lease_owner": self.worker_id,
+            "lease_expires_at": now + timedelta(seconds=self.lease_seconds),
+            "heartbeat_at": now,
+        }
+
+    async def claim(self) -> Optional[Dict[str, Any]]:
+        """
+        Atomically take the oldest queued run, or a running one whose lease
+        has expired. Returns the claimed run document, or None.
+        """
+        now = datetime.utcnow()
+        run = await self.collection.find_one_and_update(
+            {
+                "$or": [
+                    {"status": "pending"},
+                    {"status": "running", "lease_expires_at": {"$lt": now}},
+                ],
+                # $not/$gte also matches runs queued before attempts were counted
+                "attempts": {"$not": {"$gte": self.max_attempts}},
+            },
+            {
+                "$set": {"status": "running", "started_at": now, "updated_at": now, **self._lease(now)},
+                "$inc": {"attempts": 1, "state_version": 1},
+            },
+            sort=[("created_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if run is not None:
+            run_events.publish(run["_id"], {"type": "status", "status": "running", "attempt": run["attempts"]})
+        return run
+
+    async def heartbeat(self, run_id) -> bool:
+        """Extend the lease on a run. False means the lease was lost to another worker."""
+        result = await self.collection.update_one(
+            {"_id": run_id, "lease_owner": self.worker_id},
+            {"$set": self._lease(datetime.utcnow())},
+        )
+        return result.matched_count == 1
+
+    async def complete(self, run_id, fields: Dict[str, Any]) -> bool:
+        """Mark a run complete with the given fields, if this worker still holds it."""
+        result = await self.collection.update_one(
+            {"_id": run_id, "lease_owner": self.worker_id},
+            {"$set": {"status": "complete", "updated_at": datetime.utcnow(), **fields}, "$unset": LEASE_FIELDS,
+             "$inc": {"state_version": 1}},
+        )
+        if result.matched_count != 1:
+            return False
+        run_events.publish(run_id, {"type": "status", "status": "complete", **fields})
+        return True
+
+    async def fail(self, run_id, error: str) -> bool:
+        """Mark a run failed, if this worker still holds it."""
+        now = datetime.utcnow()
+        result = await self.collection.update_one(
+            {"_id": run_id, "lease_owner": self.worker_id},
+            {"$set": {"status": "failed", "error": error, "completed_at": now, "updated_at": now},
+             "$unset": LEASE_FIELDS, "$inc": {"state_version": 1}},
+        )
+        if result.matched_count != 1:
+            return False
+        run_events.publish(run_id, {"type": "status", "status": "failed", "error": error})
+        return True
+
+    async def release(self, run_id) -> None:
+        """
+        Put a run back in the queue so another worker can pick it up right
+        away. A handed-back claim does not count as an attempt.
+        """
+        result = await self.collection.update_one(
+            {"_id": run_id, "lease_owner": self.worker_id},
+            {"$set": {"status": "pending", "updated_at": datetime.utcnow()}, "$unset": LEASE_FIELDS,
+             "$inc": {"attempts": -1, "state_version": 1}},
+        )
+        if result.matched_count == 1:
+            run_events.publish(run_id, {"type": "status", "status": "pending"})
+
+    async def depth(self) -> int:
+        """Runs waiting to be claimed."""
+        return await self.collection.count_documents({"status": "pending"})
+
+    async def fail_exhausted(self) -> int:
+        """Mark runs whose lease expired on their last allowed attempt as failed."""
+        now = datetime.utcnow()
+        exhausted = {"status": "running", "lease_expires_at": {"$lt": now}, "attempts": {"$gte": self.max_attempts}}
+        ids = [run["_id"] async for run in self.collection.find(exhausted, {"_id": 1})]
+        if not ids:
+            return 0
+        error = "Run was interrupted too many times"
+        result = await self.collection.update_many(
+            {"_id": {"$in": ids}, **exhausted},
+            {"$set": {"status": "failed", "error": error, "completed_at": now, "updated_at": now},
+             "$unset": LEASE_FIELDS, "$inc": {"state_version": 1}},
+        )
+        for run_id in ids:
+            run_events.publish(run_id, {"type": "status", "status": "failed", "error": error})
+        return result.modified_count
+
+
+RunHandler = Callable[[RunQueue, Dict[str, Any]], Awaitable[None]]
+
+
+class RunWorkerPool:
+    """
+    A fixed number of worker coroutines pulling runs from a RunQueue.
+    The handler finishes each run itself (queue.complete / queue.fail);
+    a run whose handler raises is marked failed.
+    """
+
+    def __init__(self, queue: RunQueue, handler: RunHandler, concurrency: int = RUN_WORKER_CONCURRENCY,
+                 poll_seconds: float = RUN_POLL_SECONDS, heartbeat_seconds: float = RUN_HEARTBEAT_SECONDS):
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = concurrency
+        self.poll_seconds = poll_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self._wakeup = asyncio.Event()
+        self._workers: List[asyncio.Task] = []
+        self._running: Set[Any] = set()
+        self._stopping = False
+
+    def start(self) -> None:
+        self._stopping = False
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        print(f"[QUEUE] Worker {self.queue.worker_id} started with concurrency {self.concurrency}")
+
+    def notify(self) -> None:
+        """Wake idle workers, e.g. right after a run was queued in this process."""
+        self._wakeup.set()
+
+    async def stop(self, drain_seconds: float = RUN_DRAIN_SECONDS) -> None:
+        """
+        Stop claiming runs and give runs in progress up to drain_seconds to
+        finish; those still running then go back to the queue.
+        """
+        self._stopping = True
+        self._wakeup.set()
+        if self._running and drain_seconds > 0:
+            print(f"[QUEUE] Draining {len(self._running)} run(s) for up to {drain_seconds:g}s")
+            await asyncio.wait(self._workers, timeout=drain_seconds)
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        print(f"[QUEUE] Worker {self.queue.worker_id} stopped")
+
+    async def _worker(self) -> None:
+        while not self._stopping:
+            try:
+                run = await self.queue.claim()
+                if run is not None and self._stopping:
+                    # Claimed while stop() began: leave it to another worker
+                    await self.queue.release(run["_id"])
+                    return
+                if run is None:
+                    await self.queue.fail_exhausted()
+                    await self._idle()
+                    continue
+                await self._process(run)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[QUEUE] Worker error: {e}")
+                await self._idle()
+
+    async def _idle(self) -> None:
+        if self._stopping:
+            return
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _process(self, run: Dict[str, Any]) -> None:
+        run_id = run["_id"]
+        self._running.add(run_id)
+        task = asyncio.create_task(self.handler(self.queue, run))
+        heartbeat = asyncio.create_task(self._heartbeat(run_id))
+        try:
+            done, _ = await asyncio.wait({task, heartbeat}, return_when=asyncio.FIRST_COMPLETED)
+            if task in done:
+                task.result()
+            else:
+                task.cancel()
+                print(f"[QUEUE] Lost lease on run {run_id}, abandoning it")
+        except asyncio.CancelledError:
+            # Shutting down: hand the run back rather than waiting for the lease to expire
+            task.cancel()
+            await asyncio.shield(self.queue.release(run_id))
+            raise
+        except Exception as e:
+            print(f"[QUEUE] Run {run_id} failed: {e}")
+            await self.queue.fail(run_id, str(e))
+        finally:
+            heartbeat.cancel()
+            self._running.discard(run_id)
+
+    async def _heartbeat(self, run_id) -> None:
+        """Renew the lease until it is lost, then return."""
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                if not await self.queue.heartbeat(run_id):
+                    return
+            except Exception as e:
+                # Keep trying; the lease only lapses after RUN_LEASE_SECONDS
+                print(f"[QUEUE] Heartbeat for run {run_id} failed: {e}")
@@ -0,0 +1,261 @@
+"""
+Run processing.
+
+What a queue worker does with a claimed run: validate every mapped file
+from the run's spool directory and store its issues, grouped by column and
+rule (issue_groups.py), with a summary on the run. Progress
+and per-file results are published to run_events along the way. Values that
+reference other files of the run are checked once every file is done
+(crossfile.py), as are index barcodes too close to tell apart within a lane
+(barcodes.py). A run that passes the readiness gate also gets columnar
+copies of its files for export. Time spent parsing, validating and
+persisting is stored on the run (stage_seconds) and exported as metrics
+(metrics.py).
+Shared by the in-process workers of the API and the standalone worker
+(worker.py).
+"""
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from audit import audit_log
+from barcodes import barcode_rules, collision_issues
+from events import run_events
+from crossfile import RunFile, build_indexes, find_orphans, key_columns, orphan_issues, run_references
+from executor import build_columnar, find_barcode_collisions, read_key_hashes, read_key_values, validate_csv_file
+from issue_groups import IssueGroup, group_issues, merge_groups
+from issues import GROUPED, SEVERITY_KEYS, summarize_groups, write_issue_groups
+from validation import make_issue, plan_cache
+from metrics import ACTIVE_RUNS, RUNS, StageTimes, collect_stages, observe_run, stage
+from result_cache import result_cache, result_key
+from revalidation import row_state_path
+from run_queue import RunQueue
+from templates import refresh_templates, template_registry
+from uploads import release_run, spooled_path
+
+class RunProgress:
+    """Bytes validated and issues found so far in a run, published to run_events as they change."""
+
+    def __init__(self, run_id, sizes: List[int]):
+        self.run_id = run_id
+        self.sizes = sizes
+        self.done = [0] * len(sizes)
+        self.files_done = 0
+        self.counts = {key: 0 for key in SEVERITY_KEYS.values()}
+
+    def advance(self, n: int, size: int) -> None:
+        """Part of file n (a split piece) was validated."""
+        self.done[n] = min(self.done[n] + size, self.sizes[n])
+        self._publish()
+
+    def file_done(self, n: int, file_name: str, groups: List[IssueGroup], cached: bool) -> None:
+        counts = {key: 0 for key in SEVERITY_KEYS.values()}
+        for group in groups:
+            if group["severity"] in SEVERITY_KEYS:
+                counts[SEVERITY_KEYS[group["severity"]]] += group["count"]
+        for key, count in counts.items():
+            self.counts[key] += count
+        self.done[n] = self.sizes[n]
+        self.files_done += 1
+        run_events.publish(self.run_id, {"type": "file", "fileName": file_name, "cached": cached, **counts})
+        self._publish()
+
+    def _publish(self) -> None:
+        run_events.publish(self.run_id, {
+            "type": "progress",
+            "files_done": self.files_done,
+            "files_total": len(self.sizes),
+            "bytes_done": sum(self.done),
+            "bytes_total": sum(self.sizes),
+            **self.counts
+        })
+
+
+async def process_run(db, queue: RunQueue, run: Dict[str, Any]) -> None:
+    """Validate a claimed run, store its issues and mark it complete (or failed)."""
+    run_id = run["_id"]
+    ACTIVE_RUNS.inc()
+    try:
+        with collect_stages() as times:
+            await _validate_run(db, queue, run, times)
+    except Exception:
+        RUNS.labels("failed").inc()
+        raise
+    finally:
+        ACTIVE_RUNS.dec()
+        release_run(str(run_id))
+
+
+async def _validate_run(db, queue: RunQueue, run: Dict[str, Any], times: StageTimes) -> None:
+    run_id = run["_id"]
+    started = time.perf_counter()
+    if "uploads" not in run:
+        # Queued before uploads were spooled to disk; its files are gone
+        await queue.fail(run_id, "Uploaded files are no longer available")
+        RUNS.labels("failed").inc()
+        return
+    # A repeated file name keeps the last upload, as the mapping refers to names
+    uploads = {upload["fileName"]: upload for upload in run["uploads"]}
+    paths = {upload["fileName"]: spooled_path(str(run_id), upload) for upload in run["uploads"]}
+    if not all(os.path.exists(path) for path in paths.values()):
+        await queue.fail(run_id, "Uploaded files are no longer available")
+        RUNS.labels("failed").inc()
+        return
+
+    await refresh_templates(db)
+
+    # Validate every mapped file concurrently in the process pool (unless its
+    # result is cached); results are collected in mapping order
+    files = []
+    for file_mapping in run["mapping"]:
+        file_name = file_mapping.get("fileName")
+        template_id = file_mapping.get("templateId")
+        column_mapping = file_mapping.get("mapping", {})
+
+        if file_name and file_name in paths:
+            files.append((file_name, template_id, column_mapping))
+
+    progress = RunProgress(run_id, [uploads[file_name].get("size", 0) for file_name, _, _ in files])
+
+    async def validate(n: int, file_name: str, template_id: str, column_mapping: Dict[str, str]):
+        groups, cached = await _validate_cached(
+            db, uploads[file_name], paths[file_name], template_id, column_mapping,
+            row_state_path(run.get("user_id"), file_name, template_id),
+            on_progress=lambda size: progress.advance(n, size)
+        )
+        progress.file_done(n, file_name, groups, cached)
+        return groups, cached
+
+    results = await asyncio.gather(*(validate(n, *file) for n, file in enumerate(files)))
+    cross_issues, barcode_issues = await asyncio.gather(_check_references(files, paths), _check_barcodes(files, paths))
+    file_groups = []
+    cache_hits = []
+    for n, ((file_name, _, _), (groups, cached)) in enumerate(zip(files, results)):
+        file_groups.append((file_name, merge_groups(groups, cross_issues.get(n, []) + barcode_issues.get(n, []))))
+        if cached:
+            cache_hits.append(file_name)
+
+    # If no files were processed, add an info message
+    if not any(groups for _, groups in file_groups):
+        file_groups = [("N/A", group_issues([
+            make_issue(1, "Info", "N/A", None, None, "No files were processed for validation")
+        ]))]
+
+    # Issue groups go to their own collection; the run keeps only the summary
+    with stage("persist"):
+        await write_issue_groups(db.issue_groups, run_id, file_groups, replace=run.get("attempts", 1) > 1)
+    summary = summarize_groups(file_groups)
+    if summary["blockers"] == 0:
+        await _prepare_export(files, uploads, paths)
+    duration = time.perf_counter() - started
+    completed = await queue.complete(run_id, {
+        "validation_summary": summary,
+        "issue_format": GROUPED,
+        "cache_hits": cache_hits,
+        "stage_seconds": times.rounded(),
+        "rows_validated": times.rows,
+        "duration_seconds": round(duration, 3),
+        "completed_at": datetime.utcnow()
+    })
+    if not completed:
+        # Another worker reclaimed the run; its result wins
+        return
+    observe_run(duration, times, summary)
+
+    # Log completion
+    audit_log.emit({
+        "action": "RUN_COMPLETED",
+        "user_email": run.get("user_email"),
+        "timestamp": datetime.utcnow(),
+        "details": {
+            "run_id": str(run_id),
+            "blockers": summary["blockers"],
+            "warnings": summary["warnings"],
+            "infos": summary["infos"]
+        }
+    })
+
+
+async def _check_references(files: List[RunFile], paths: Dict[str, str]) -> Dict[int, List[Dict[str, Any]]]:
+    """Issues for values that reference another file of the run but are missing there, by file number."""
+    references = run_references(files)
+    if not references:
+        return {}
+    columns = [key_columns(references, template_id, column_mapping) for _, template_id, column_mapping in files]
+    hashes = await asyncio.gather(*(
+        read_key_hashes(paths[file_name], file_columns) if file_columns else asyncio.sleep(0, {})
+        for (file_name, _, _), file_columns in zip(files, columns)
+    ))
+    orphans = find_orphans(references, files, hashes, build_indexes(references, files, hashes))
+
+    async def describe(n: int) -> List[Dict[str, Any]]:
+        file_name = files[n][0]
+        values = await asyncio.gather(*(
+            read_key_values(paths[file_name], columns[n][reference.field], positions)
+            for reference, positions in orphans[n]
+        ))
+        return orphan_issues(file_name, [(r, p, v) for (r, p), v in zip(orphans[n], values)])
+
+    described = await asyncio.gather(*(describe(n) for n in orphans))
+    return dict(zip(orphans, described))
+
+
+async def _check_barcodes(files: List[RunFile], paths: Dict[str, str]) -> Dict[int, List[Dict[str, Any]]]:
+    """Issues for index barcodes that collide within a lane, by file number."""
+    async def check(file_name: str, template_id: str, column_mapping: Dict[str, str]) -> List[Dict[str, Any]]:
+        rules = barcode_rules(template_registry.get(template_id) or {}, column_mapping)
+        if not rules:
+            return []
+        found = await find_barcode_collisions(paths[file_name], rules)
+        return collision_issues(file_name, rules, found or [])
+
+    checked = await asyncio.gather(*(check(*file) for file in files))
+    return {n: issues for n, issues in enumerate(checked) if issues}
+
+
+async def _prepare_export(files: List[Tuple[str, str, Dict[str, str]]], uploads: Dict[str, Any],
+                          paths: Dict[str, str]) -> None:
+    """Write columnar copies of the mapped columns of a run that can be exported."""
+    async def convert(file_name: str, template_id: str, column_mapping: Dict[str, str]) -> None:
+        plan = plan_cache.get(template_id, column_mapping)
+        sha256 = uploads[file_name].get("sha256")
+        if plan is None or not sha256:
+            return
+        try:
+            await build_columnar(paths[file_name], sha256, list(plan.columns))
+        except Exception as e:
+            print(f"[COLUMNAR] Failed to convert {file_name}: {e}")
+
+    await asyncio.gather(*(convert(*file) for file in files))
+
+
+async def _validate_cached(db, upload: Dict[str, Any], path: str, template_id: str, column_mapping: Dict[str, str],
+                           row_state: str, on_progress: Optional[Callable[[int], None]] = None
+                           ) -> Tuple[List[IssueGroup], bool]:
+    """
+    A file's issue groups, from the result cache if an identical file was
+    validated before, else revalidated against row_state; and whether they
+    were cached.
+    """
+    file_name = upload["fileName"]
+    version = template_registry.version(template_id)
+    if version is None or not upload.get("sha256"):
+        return await validate_csv_file(path, file_name, template_id, column_mapping, row_state, on_progress), False
+
+    key = result_key(upload["sha256"], template_id, version, column_mapping)
+    try:
+        groups = await result_cache.get(db.validation_cache, key)
+    except Exception as e:
+        print(f"[CACHE] Failed to look up cached results for {file_name}: {e}")
+        groups = None
+    if groups is not None:
+        return groups, True
+    groups = await validate_csv_file(path, file_name, template_id, column_mapping, row_state, on_progress)
+    try:
+        with stage("persist"):
+            await result_cache.put(db.validation_cache, key, groups)
+    except Exception as e:
+        print(f"[CACHE] Failed to cache results for {file_name}: {e}")
+    return groups, False
@@ -2,18 +2,70 @@
 """
 Startup script for Render deployment.
 Binds to 0.0.0.0 to allow external access and uses PORT environment variable.
+
+WEB_CONCURRENCY API worker processes serve requests (default: 1). Each one
+is a complete copy of the app with its own Mongo connection pool
+(database.py), caches and validation pool, whose default size splits the
+cores between the workers (executor.py). Nothing a request depends on
+lives only in one worker:
+- runs are queued in Mongo and claimed atomically, so every worker's run
+  workers (RUN_WORKERS_IN_API) share one queue and no run is processed
+  twice;
+- run events go through the mongo broadcast backend, so an event stream
+  on any worker sees runs processed by any other (events.py);
+- the in-memory caches only hold copies of what is in Mongo (users for
+  USER_CACHE_TTL_SECONDS, templates, validation plans and results);
+- metrics are collected from every worker in PROMETHEUS_MULTIPROC_DIR.
+To keep validation out of the API processes altogether, set
+RUN_WORKERS_IN_API=false and run `python -m worker` instead.
+
+On SIGTERM the API stops accepting connections, gives open requests
+GRACEFUL_SHUTDOWN_SECONDS to finish, and each worker then gives its runs in
+progress RUN_DRAIN_SECONDS (run_queue.py) before handing the rest back to
+the queue. Keep the sum below the platform's shutdown grace period.
 """
 import os
+import shutil
+import tempfile
+
 import uvicorn
-from main import app
+from dotenv import load_dotenv
 
-if __name__ == "__main__":
+load_dotenv()
+
+# API worker processes (default: 1)
+WEB_CONCURRENCY = max(int(os.getenv("WEB_CONCURRENCY", "1")), 1)
+# Seconds open requests (event streams included) get to finish on shutdown
+GRACEFUL_SHUTDOWN_SECONDS = int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", "5"))
+
+
+def prepare_metrics_dir() -> None:
+    """Give the workers one empty PROMETHEUS_MULTIPROC_DIR to write their metrics to (metrics.py)."""
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        # Files left by a previous start would be counted again
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+    else:
+        path = tempfile.mkdtemp(prefix="mdo-metrics-")
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+
+
+def serve() -> None:
     port = int(os.getenv("PORT", "8000"))
+    if WEB_CONCURRENCY > 1:
+        prepare_metrics_dir()
+        print(f"[STARTUP] Starting {WEB_CONCURRENCY} API workers")
     uvicorn.run(
-        app,
+        "main:app",
         host="0.0.0.0",
         port=port,
+        workers=WEB_CONCURRENCY,
+        timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_SECONDS,
         # Remove --reload in production for better performance
         reload=False
     )
 
+
+if __name__ == "__main__":
+    serve()
@@ -1,7 +1,6 @@
 #!/bin/bash
 # Startup script for Render deployment
-# Binds to 0.0.0.0 to allow external access and uses PORT environment variable
-
-PORT=${PORT:-8000}
-uvicorn main:app --host 0.0.0.0 --port ${PORT}
+# Binds to 0.0.0.0 to allow external access and uses PORT environment variable;
+# WEB_CONCURRENCY sets the number of API workers (see start.py)
 
+exec python start.py
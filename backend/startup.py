@@ -0,0 +1,81 @@
+"""
+Startup timing and warm-up.
+
+The API's startup is split into phases (imports, then each step of the
+lifespan handler in main.py), timed with startup_report.phase(). The report
+is printed once the app accepts requests and is returned by /healthz, so a
+slow cold start shows where the time went.
+
+Modules only needed to process or export runs (the validation engine,
+pandas, pyarrow) and to hash passwords (passlib) are not imported with the
+app. The request handlers that need them import them on first use, and
+warm_up() imports them on a background thread once the app is serving, so a
+scaled-from-zero instance answers its first requests without waiting for
+them. The warm-up shows in the report as it finishes.
+"""
+import asyncio
+import importlib
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Sequence
+
+# Import the modules below in the background once the app is serving;
+# with false they are imported by the first request that needs them
+WARM_UP_IMPORTS = os.getenv("WARM_UP_IMPORTS", "true").lower() == "true"
+WARM_UP_MODULES = ("runs", "exports", "passlib.context", "jose.jwt")
+
+
+class StartupReport:
+    """Seconds spent in each phase of startup, in the order they ran."""
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.ready_seconds: Optional[float] = None
+        self.warm_up_seconds: Optional[float] = None
+        self._started = time.perf_counter()
+
+    def imports_done(self, started: float) -> None:
+        """Record the app's imports, begun at perf_counter() time started, which the report counts from."""
+        self._started = started
+        self.record("imports", time.perf_counter() - started)
+
+    def record(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def ready(self) -> None:
+        """The app accepts requests: print the phases."""
+        self.ready_seconds = time.perf_counter() - self._started
+        steps = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.phases.items())
+        print(f"[STARTUP] Ready in {self.ready_seconds * 1000:.0f} ms ({steps})")
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+            "ready_ms": round(self.ready_seconds * 1000, 1) if self.ready_seconds is not None else None,
+            "warm_up_ms": round(self.warm_up_seconds * 1000, 1) if self.warm_up_seconds is not None else None,
+        }
+
+
+startup_report = StartupReport()
+
+
+async def warm_up(modules: Sequence[str] = WARM_UP_MODULES) -> None:
+    """Import modules on a worker thread, recording each as a warm-up phase."""
+    started = time.perf_counter()
+    for name in modules:
+        try:
+            with startup_report.phase(f"warm-up {name}"):
+                await asyncio.to_thread(importlib.import_module, name)
+        except Exception as e:
+            print(f"[STARTUP] Failed to import {name} during warm-up: {e}")
+    startup_report.warm_up_seconds = time.perf_counter() - started
+    print(f"[STARTUP] Warm-up imported {', '.join(modules)} in {startup_report.warm_up_seconds * 1000:.0f} ms")
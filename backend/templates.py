@@ -0,0 +1,280 @@
+"""
+Schema template registry.
+
+Templates are versioned: built-in defaults ship with the code (version 0) and
+can be overridden or extended from a JSON directory (TEMPLATES_DIR) or from the
+`schema_templates` Mongo collection. A field may reference a field of another
+template ({"template", "field"}); crossfile.py checks that every value it
+holds appears in the referenced field of the run's files of that template. An
+index field may declare a barcode check ({"lane", "paired_with",
+"max_mismatches"}); barcodes.py reports index pairs of a lane that are too
+close to tell apart. Every change to a template bumps its
+version and notifies listeners, so compiled validation plans for that template
+(and only that template) are dropped.
+"""
+import json
+import os
+import re
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+# ============== Built-in Schema Templates ==============
+
+SCHEMA_TEMPLATES = {
+    "illumina-ngs-run-v1.2": {
+        "name": "Illumina NGS Run",
+        "fields": [
+            {"name": "Run_ID", "type": "string", "required": True},
+            {"name": "Sample_ID", "type": "string", "required": True},
+            {"name": "Library_ID", "type": "string", "required": True},
+            {"name": "Lane", "type": "integer", "required": True, "min": 1, "max": 8},
+            {"name": "Index_I1", "type": "string", "required": True, "pattern": r"^[ATGCN]+$",
+             "barcode": {"lane": "Lane", "paired_with": "Index_I2"}},
+            {"name": "Index_I2", "type": "string", "required": False, "pattern": r"^[ATGCN]*$"},
+        ]
+    },
+    "10x-single-cell-v2.0": {
+        "name": "10x Single-Cell",
+        "fields": [
+            {"name": "Library_ID", "type": "string", "required": True,
+             "references": {"template": "illumina-ngs-run-v1.2", "field": "Library_ID"}},
+            {"name": "Sample_ID", "type": "string", "required": True,
+             "references": {"template": "illumina-ngs-run-v1.2", "field": "Sample_ID"}},
+            {"name": "Chemistry", "type": "string", "required": True},
+            {"name": "Expected_Cells", "type": "integer", "required": False, "min": 1},
+        ]
+    },
+    "spatial-visium-v1.0": {
+        "name": "Spatial - Visium",
+        "fields": [
+            {"name": "Slide_ID", "type": "string", "required": True},
+            {"name": "Capture_Area", "type": "string", "required": True, "pattern": r"^[A-D][1-4]$"},
+            {"name": "Library_ID", "type": "string", "required": True,
+             "references": {"template": "illumina-ngs-run-v1.2", "field": "Library_ID"}},
+            {"name": "Block_ID", "type": "string", "required": True},
+        ]
+    },
+}
+
+FIELD_TYPES = ("string", "integer")
+
+
+class TemplateError(ValueError):
+    """Raised when a template definition is malformed."""
+
+
+def check_template(template: Dict[str, Any]) -> None:
+    """
+    Validate a template definition.
+    Raises TemplateError describing the first problem found.
+    """
+    if not isinstance(template.get("name"), str) or not template["name"].strip():
+        raise TemplateError("Template 'name' must be a non-empty string")
+    fields = template.get("fields")
+    if not isinstance(fields, list) or not fields:
+        raise TemplateError("Template 'fields' must be a non-empty list")
+
+    seen = set()
+    for field in fields:
+        name = field.get("name") if isinstance(field, dict) else None
+        if not isinstance(name, str) or not name:
+            raise TemplateError("Every field needs a non-empty 'name'")
+        if name in seen:
+            raise TemplateError(f"Duplicate field '{name}'")
+        seen.add(name)
+        if field.get("type") not in FIELD_TYPES:
+            raise TemplateError(f"Field '{name}' has unsupported type '{field.get('type')}'")
+        if not isinstance(field.get("required"), bool):
+            raise TemplateError(f"Field '{name}' needs a boolean 'required'")
+        for bound in ("min", "max"):
+            if bound in field:
+                if field["type"] != "integer":
+                    raise TemplateError(f"Field '{name}' has '{bound}' but is not an integer field")
+                if isinstance(field[bound], bool) or not isinstance(field[bound], int):
+                    raise TemplateError(f"Field '{name}' has a non-integer '{bound}'")
+        if "pattern" in field:
+            try:
+                re.compile(field["pattern"])
+            except (re.error, TypeError) as e:
+                raise TemplateError(f"Field '{name}' has an invalid pattern: {e}")
+        if "references" in field:
+            target = field["references"]
+            if not isinstance(target, dict) or not all(
+                isinstance(target.get(key), str) and target[key] for key in ("template", "field")
+            ):
+                raise TemplateError(f"Field '{name}' needs 'references' of the form {{\"template\", \"field\"}}")
+        if "barcode" in field:
+            barcode = field["barcode"]
+            if not isinstance(barcode, dict) or not isinstance(barcode.get("lane"), str) or not barcode["lane"]:
+                raise TemplateError(f"Field '{name}' needs 'barcode' with a 'lane' field")
+            if "paired_with" in barcode and not isinstance(barcode["paired_with"], str):
+                raise TemplateError(f"Field '{name}' has a non-string barcode 'paired_with'")
+            mismatches = barcode.get("max_mismatches", 0)
+            if isinstance(mismatches, bool) or not isinstance(mismatches, int) or mismatches < 0:
+                raise TemplateError(f"Field '{name}' needs a non-negative integer barcode 'max_mismatches'")
+
+    names = {field["name"] for field in fields}
+    for field in fields:
+        barcode = field.get("barcode")
+        for other in (barcode["lane"], barcode.get("paired_with")) if barcode else ():
+            if other is not None and other not in names:
+                raise TemplateError(f"Field '{field['name']}' has barcode field '{other}' that is not in the template")
+
+
+class TemplateRegistry:
+    """
+    Thread-safe, versioned view of all schema templates.
+    Listeners registered with on_change() are called with the template id
+    whenever that template is added, replaced or removed.
+    """
+
+    def __init__(self, templates: Optional[Dict[str, Dict[str, Any]]] = None):
+        self._lock = threading.Lock()
+        self._templates: Dict[str, Dict[str, Any]] = {}
+        self._listeners: List[Callable[[str], None]] = []
+        self.last_refresh: Optional[datetime] = None
+        for template_id, template in (templates or {}).items():
+            self._templates[template_id] = {"version": 0, **template}
+
+    def on_change(self, listener: Callable[[str], None]) -> None:
+        self._listeners.append(listener)
+
+    def _notify(self, template_id: str) -> None:
+        for listener in self._listeners:
+            listener(template_id)
+
+    def get(self, template_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._templates.get(template_id)
+
+    def version(self, template_id: str) -> Optional[int]:
+        template = self.get(template_id)
+        return template["version"] if template else None
+
+    def all(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return dict(self._templates)
+
+    def put(self, template_id: str, template: Dict[str, Any], version: Optional[int] = None) -> int:
+        """
+        Add or replace a template and return its new version.
+        Without an explicit version the current version is bumped by one.
+        A put with a version that is not newer than the stored one is ignored.
+        """
+        check_template(template)
+        with self._lock:
+            current = self._templates.get(template_id)
+            current_version = current["version"] if current else -1
+            if version is None:
+                version = current_version + 1
+            elif version <= current_version:
+                return current_version
+            self._templates[template_id] = {
+                "version": version,
+                "name": template["name"],
+                "fields": template["fields"],
+            }
+        self._notify(template_id)
+        return version
+
+    def remove(self, template_id: str) -> None:
+        with self._lock:
+            removed = self._templates.pop(template_id, None)
+        if removed is not None:
+            self._notify(template_id)
+
+    def load_directory(self, path: str) -> int:
+        """
+        Load every *.json file in a directory.
+        Each file holds {"template_id", "version", "name", "fields"}; the
+        template id defaults to the file name without its extension.
+        Returns the number of templates loaded.
+        """
+        loaded = 0
+        for entry in sorted(os.listdir(path)):
+            if not entry.endswith(".json"):
+                continue
+            with open(os.path.join(path, entry)) as f:
+                doc = json.load(f)
+            template_id = doc.get("template_id", entry[:-len(".json")])
+            self.put(template_id, doc, version=doc.get("version", 1))
+            loaded += 1
+        return loaded
+
+    async def load_collection(self, collection) -> int:
+        """
+        Sync templates from a Mongo collection of
+        {"template_id", "version", "name", "fields"} documents.
+        Only templates whose stored version is newer are replaced.
+        Returns the number of templates that changed.
+        """
+        changed = 0
+        async for doc in collection.find({}, {"_id": 0}):
+            template_id = doc.get("template_id")
+            if not template_id:
+                continue
+            before = self.version(template_id)
+            try:
+                after = self.put(template_id, doc, version=doc.get("version", 1))
+            except TemplateError as e:
+                print(f"[TEMPLATES] Skipping invalid template '{template_id}': {e}")
+                continue
+            if after != before:
+                changed += 1
+        self.last_refresh = datetime.utcnow()
+        return changed
+
+
+# Process-wide registry shared by the API, run workers and validation plans
+template_registry = TemplateRegistry(SCHEMA_TEMPLATES)
+
+TEMPLATES_DIR = os.getenv("TEMPLATES_DIR")
+if TEMPLATES_DIR and os.path.isdir(TEMPLATES_DIR):
+    template_registry.load_directory(TEMPLATES_DIR)
+
+# Templates stored in Mongo are re-synced at most this often (seconds)
+TEMPLATE_REFRESH_SECONDS = int(os.getenv("TEMPLATE_REFRESH_SECONDS", "60"))
+
+
+async def refresh_templates(db, force: bool = False) -> None:
+    """Re-sync the template registry from Mongo if it is older than TEMPLATE_REFRESH_SECONDS."""
+    last = template_registry.last_refresh
+    if not force and last and (datetime.utcnow() - last).total_seconds() < TEMPLATE_REFRESH_SECONDS:
+        return
+    try:
+        changed = await template_registry.load_collection(db.schema_templates)
+        if changed:
+            print(f"[TEMPLATES] Loaded {changed} updated template(s) from database")
+    except Exception as e:
+        print(f"[TEMPLATES] Failed to load templates from database: {e}")
+
+
+async def save_template(db, template_id: str, template: Dict[str, Any]) -> int:
+    """
+    Create or replace a template in Mongo and the registry; returns its new version.
+    The version is assigned by Mongo in the same update that stores the
+    template, so processes saving at once never store one version twice. It
+    is one more than both the stored version and the registry's (which
+    may come from the built-ins or TEMPLATES_DIR).
+    Raises TemplateError if the template is invalid.
+    """
+    from pymongo import ReturnDocument
+
+    check_template(template)
+    floor = template_registry.version(template_id)
+    stored = await db.schema_templates.find_one_and_update(
+        {"template_id": template_id},
+        [{"$set": {
+            "template_id": template_id,
+            "name": {"$literal": template["name"]},
+            "fields": {"$literal": template["fields"]},
+            "version": {"$add": [{"$max": [{"$ifNull": ["$version", 0]}, -1 if floor is None else floor]}, 1]},
+            "updated_at": datetime.utcnow(),
+        }}],
+        projection={"_id": 0, "version": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    template_registry.put(template_id, template, version=stored["version"])
+    return stored["version"]
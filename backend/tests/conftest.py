@@ -0,0 +1,41 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+# The backend modules import each other by their flat names
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEST_USER = {"email": "tests@example.com", "name": "Tests", "password": "tests-password-1"}
+
+
+@pytest.fixture(scope="session")
+def api():
+    """
+    The app served by a TestClient against mongomock, with a signed-up user:
+    client, headers (the user's Authorization), user_id, db, and
+    call(async_fn, *args) to run database calls on the app's event loop.
+    """
+    import motor.motor_asyncio
+    from fastapi.testclient import TestClient
+    from mongomock_motor import AsyncMongoMockClient
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("MONGODB_URI", "mongodb://tests.invalid")
+        patch.setenv("JWT_SECRET", "tests-secret")
+        patch.setenv("RUN_WORKERS_IN_API", "false")
+        patch.setenv("RUN_EVENTS_BACKEND", "local")
+        patch.setenv("WARM_UP_IMPORTS", "false")
+        patch.setattr(motor.motor_asyncio, "AsyncIOMotorClient", AsyncMongoMockClient)
+        import database
+        import main
+
+        patch.setattr(database, "AsyncIOMotorClient", AsyncMongoMockClient)
+        with TestClient(main.app) as client:
+            token = client.post("/api/v1/auth/signup", json=TEST_USER).json()["access_token"]
+            user = client.portal.call(main.db.users.find_one, {"email": TEST_USER["email"]})
+            yield SimpleNamespace(
+                client=client, headers={"Authorization": f"Bearer {token}"}, user_id=user["_id"],
+                db=main.db, call=client.portal.call,
+            )
@@ -0,0 +1,90 @@
+"""The pigeonhole candidates of barcodes.py against brute-force Hamming distances over small lanes."""
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import barcodes
+from barcodes import _candidate_batches, _lane_collisions
+
+CASES = 300
+
+
+@pytest.fixture(autouse=True)
+def small_batches(monkeypatch):
+    # Candidates come out in several batches even for small lanes
+    monkeypatch.setattr(barcodes, "BARCODE_PAIR_BATCH", 7)
+
+
+def _hamming(a: str, b: str) -> int:
+    return sum(x != y for x, y in zip(a, b))
+
+
+def _random_lane(rng):
+    """Barcodes of one length from a small alphabet, so near and exact repeats are common."""
+    length = int(rng.integers(1, 9))
+    alphabet = list("ACGTN"[:rng.integers(2, 6)])
+    distinct = ["".join(rng.choice(alphabet, length)) for _ in range(rng.integers(1, 12))]
+    rows = rng.integers(2, 30)
+    lane = [distinct[k] for k in rng.integers(0, len(distinct), rows)]
+    positions = np.sort(rng.choice(1000, rows, replace=False))
+    # Up to length + 1, so every pair collides in some lanes
+    max_mismatches = int(rng.integers(0, length + 2))
+    return lane, positions, max_mismatches
+
+
+def _brute_force(lane, positions, max_mismatches):
+    collisions = []
+    for k, (barcode, position) in enumerate(zip(lane, positions.tolist())):
+        earlier = list(zip(lane[:k], positions[:k].tolist()))
+        same = [other for value, other in earlier if value == barcode]
+        close = [(other, _hamming(barcode, value)) for value, other in earlier
+                 if _hamming(barcode, value) <= max_mismatches]
+        if same:
+            collisions.append((position, same[0], 0))
+        elif close:
+            collisions.append((position, *close[0]))
+    return collisions
+
+
+def test_lane_collisions_match_brute_force():
+    rng = np.random.default_rng(19)
+    branches = set()
+    for _ in range(CASES):
+        lane, positions, max_mismatches = _random_lane(rng)
+        expected = _brute_force(lane, positions, max_mismatches)
+        assert _lane_collisions(pd.Series(lane), positions, max_mismatches) == expected, (lane, max_mismatches)
+        branches.add("all collide" if max_mismatches >= len(lane[0]) else "pigeonhole")
+        branches.update("duplicate" if mismatches == 0 else "near" for _, _, mismatches in expected)
+    assert branches == {"all collide", "pigeonhole", "duplicate", "near"}
+
+
+def test_candidates_cover_every_close_pair():
+    rng = np.random.default_rng(18)
+    for _ in range(CASES):
+        lane, _, max_mismatches = _random_lane(rng)
+        distinct = list(dict.fromkeys(lane))
+        length = len(distinct[0])
+        if max_mismatches >= length:
+            continue
+        codes = np.array(distinct, dtype=str).view(np.uint32).reshape(len(distinct), -1)
+        batches = list(_candidate_batches(codes, max_mismatches))
+        # A bucket's pairs are never split, so only those can exceed the batch size
+        largest = len(distinct) * (len(distinct) - 1) // 2
+        assert all(len(batch) <= max(barcodes.BARCODE_PAIR_BATCH, largest) for batch in batches)
+        candidates = {tuple(pair) for batch in batches for pair in batch.tolist()}
+        assert all(i < j for i, j in candidates)
+
+        close = {(i, j) for i, j in itertools.combinations(range(len(distinct)), 2)
+                 if _hamming(distinct[i], distinct[j]) <= max_mismatches}
+        assert close <= candidates, (distinct, max_mismatches)
+
+
+def test_exact_repeats_name_the_first_row():
+    lane = ["ACGT", "TTTT", "ACGT", "ACGA", "ACGT"]
+    positions = np.array([3, 5, 8, 9, 12])
+    assert _lane_collisions(pd.Series(lane), positions, 0) == [(8, 3, 0), (12, 3, 0)]
+    assert _lane_collisions(pd.Series(lane), positions, 1) == [(8, 3, 0), (9, 3, 1), (12, 3, 0)]
+    # At or above the barcode length every pair collides with the earliest row
+    assert _lane_collisions(pd.Series(lane), positions, 4) == [(5, 3, 3), (8, 3, 0), (9, 3, 1), (12, 3, 0)]
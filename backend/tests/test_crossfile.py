@@ -0,0 +1,85 @@
+"""Cross-file references: key hashing, the referenced-value indexes and orphan detection."""
+import numpy as np
+import pytest
+
+import crossfile
+from crossfile import Reference, build_indexes, find_orphans, key_columns, key_hashes, key_values, orphan_issues
+
+REFERENCE = Reference("tenx", "Library_ID", "illumina", "Library_ID")
+MAPPING = {"Library_ID": "library", "Sample_ID": "sample"}
+
+RUN_SHEET = b"library,sample\nL1,S1\n L2 ,S2\nL3,S3\n"
+# A second run sheet: referenced values may be in any file of the template
+MORE_RUNS = b"library,sample\nL4,S4\n"
+TENX_SHEET = b"library,sample\nL1,A\nL9,B\n,C\n  ,D\nL2,E\nL4,F\nl3,G\nL9,H\n"
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # Several chunks per file, so positions continue across chunk boundaries
+    monkeypatch.setattr(crossfile, "CROSSFILE_CHUNK_ROWS", 3)
+
+
+def _check(sources):
+    files = [(f"{template_id}-{n}.csv", template_id, MAPPING) for n, (template_id, _) in enumerate(sources)]
+    columns = key_columns([REFERENCE], "tenx", MAPPING)
+    hashes = [key_hashes(source, key_columns([REFERENCE], template_id, MAPPING)) for template_id, source in sources]
+    assert columns == {"Library_ID": "library"}
+    indexes = build_indexes([REFERENCE], files, hashes)
+    return hashes, indexes, find_orphans([REFERENCE], files, hashes, indexes)
+
+
+def test_orphans():
+    sources = [("illumina", RUN_SHEET), ("tenx", TENX_SHEET), ("illumina", MORE_RUNS)]
+    hashes, indexes, orphans = _check(sources)
+
+    # Blank cells are not keys; values are compared stripped and case-sensitively
+    positions, _ = hashes[1]["Library_ID"]
+    assert positions.tolist() == [0, 1, 4, 5, 6, 7]
+    assert len(indexes[("illumina", "Library_ID")]) == 4
+    assert list(orphans) == [1]
+    [(reference, missing)] = orphans[1]
+    assert reference == REFERENCE and missing.tolist() == [1, 6, 7]
+    assert key_values(TENX_SHEET, "library", missing) == ["L9", "l3", "L9"]
+
+    issues = orphan_issues("tenx-1.csv", [(reference, missing, ["L9", "l3", "L9"])])
+    assert [issue["rowIndex"] for issue in issues] == [3, 8, 9]
+    assert issues[1]["description"] == "Library_ID 'l3' not found in Library_ID of any illumina file"
+
+
+def test_no_orphans():
+    sources = [("illumina", RUN_SHEET + b"L9,S9\nl3,S10\n"), ("tenx", TENX_SHEET), ("illumina", MORE_RUNS)]
+    assert _check(sources)[2] == {}
+
+
+def test_target_without_the_column_is_not_checked():
+    # One run sheet lacks the referenced column: its own issues say so
+    sources = [("illumina", RUN_SHEET), ("tenx", TENX_SHEET), ("illumina", b"sample,lane\nS4,1\n")]
+    hashes, indexes, orphans = _check(sources)
+    assert "Library_ID" not in hashes[2] and hashes[2] is not None
+    assert indexes == {} and orphans == {}
+
+
+@pytest.mark.parametrize("unreadable", [b"library,sample\nL1,S1\n\"L2,S2\n", b"", "/nonexistent/sheet.csv"],
+                         ids=["unterminated-quote", "empty", "missing"])
+def test_unreadable_target_is_not_checked(unreadable):
+    sources = [("illumina", RUN_SHEET), ("tenx", TENX_SHEET), ("illumina", unreadable)]
+    hashes, indexes, orphans = _check(sources)
+    assert hashes[2] is None
+    assert indexes == {} and orphans == {}
+
+
+def test_unreadable_referencing_file_is_skipped():
+    sources = [("illumina", RUN_SHEET), ("tenx", b"library,sample\nL9,A\n\"L9,B\n")]
+    hashes, indexes, orphans = _check(sources)
+    assert hashes[1] is None
+    assert ("illumina", "Library_ID") in indexes and orphans == {}
+
+
+def test_empty_files():
+    sources = [("illumina", b"library,sample\n"), ("tenx", b"library,sample\n")]
+    hashes, indexes, orphans = _check(sources)
+    assert hashes[1]["Library_ID"][0].tolist() == []
+    assert len(indexes[("illumina", "Library_ID")]) == 0
+    assert orphans == {}
+    assert np.asarray(hashes[0]["Library_ID"][1]).dtype == np.uint64
@@ -0,0 +1,34 @@
+"""The audit log index follows AUDIT_RETENTION_DAYS, whatever it was before."""
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from db_indexes import ensure_indexes, index_specs
+
+
+def _audit_specs():
+    return [spec for spec in index_specs() if spec.collection == "audit_logs"]
+
+
+def _audit_index(db):
+    return asyncio.run(db.audit_logs.index_information()).get("timestamp_1")
+
+
+def test_audit_index_without_retention(monkeypatch):
+    monkeypatch.delenv("AUDIT_RETENTION_DAYS", raising=False)
+    db = AsyncMongoMockClient()["mdo"]
+    asyncio.run(ensure_indexes(db, _audit_specs()))
+    index = _audit_index(db)
+    assert index is not None and "expireAfterSeconds" not in index
+
+
+def test_retention_turned_off_removes_ttl(monkeypatch):
+    db = AsyncMongoMockClient()["mdo"]
+    monkeypatch.setenv("AUDIT_RETENTION_DAYS", "30")
+    asyncio.run(ensure_indexes(db, _audit_specs()))
+    assert _audit_index(db)["expireAfterSeconds"] == 30 * 24 * 3600
+
+    monkeypatch.setenv("AUDIT_RETENTION_DAYS", "0")
+    asyncio.run(ensure_indexes(db, _audit_specs()))
+    index = _audit_index(db)
+    assert index is not None and "expireAfterSeconds" not in index
@@ -0,0 +1,67 @@
+"""The mongo event backend: batched writes and the sentinel that keeps the tailable cursor open."""
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import CollectionInvalid
+
+import events
+from events import MongoBroadcast, RunEvents
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = AsyncMongoMockClient()["mdo"]
+
+    async def create_collection(name, **options):
+        # mongomock has no capped collections; behave as if another process made it
+        raise CollectionInvalid(f"collection {name} already exists")
+
+    monkeypatch.setattr(db, "create_collection", create_collection)
+    return db
+
+
+def test_collection_is_seeded_once(db):
+    async def main():
+        broadcasts = [MongoBroadcast(), MongoBroadcast()]
+        for broadcast in broadcasts:
+            await broadcast.start(RunEvents(), db)
+        docs = [doc async for doc in db.run_events.find()]
+        for broadcast in broadcasts:
+            await broadcast.stop()
+        return docs
+
+    docs = asyncio.run(main())
+    assert len(docs) == 1 and docs[0]["sentinel"] is True
+
+
+def test_events_are_written_in_batches_in_order(db, monkeypatch):
+    monkeypatch.setattr(events, "RUN_EVENTS_WRITE_BATCH", 40)
+
+    async def main():
+        broadcast = MongoBroadcast()
+        await broadcast.start(RunEvents(), db)
+        batches = []
+        insert_many = broadcast._collection.insert_many
+
+        async def counted(docs, *args, **kwargs):
+            batches.append(len(docs))
+            return await insert_many(docs, *args, **kwargs)
+
+        broadcast._collection.insert_many = counted
+        for n in range(100):
+            broadcast.publish(f"run-{n % 3}", {"n": n})
+        for _ in range(50):
+            await asyncio.sleep(0.02)
+            if sum(batches) == 100:
+                break
+        # Published one at a time, each goes out on its own
+        broadcast.publish("run-1", {"n": 100})
+        await asyncio.sleep(0.1)
+        await broadcast.stop()
+        written = [(doc["run_id"], doc["event"]["n"]) async for doc in db.run_events.find({"run_id": {"$exists": True}})]
+        return written, batches
+
+    written, batches = asyncio.run(main())
+    assert batches == [40, 40, 20, 1]
+    assert written == [(f"run-{n % 3}", n) for n in range(101)]
@@ -0,0 +1,120 @@
+"""GET /api/v1/runs/{run_id}/issues pages through a run's issues with keyset cursors."""
+import base64
+import json
+
+import pytest
+from bson import ObjectId
+
+import issues
+from issue_groups import group_issues
+from issues import GROUPED, write_issue_groups
+from validation import make_issue
+
+
+def _file_issues(file_name: str, rows: int):
+    """Issues in the order the engine emits them: rule by rule, each in row order."""
+    found = [make_issue(None, "Blocker", file_name, None, "Run_ID", "Required column 'Run_ID' is missing")]
+    found += [make_issue(None, "Warning", file_name, row, "Lane", f"Value 'L{row}' does not match pattern ^[1-8]$")
+              for row in range(2, rows, 3)]
+    found += [make_issue(None, "Blocker", file_name, row, "Sample_ID", f"Duplicate value 'S{row}' (first seen in row 2)")
+              for row in range(3, rows, 2)]
+    found += [make_issue(None, "Warning", file_name, row, "Index_I7", f"Value 'N{row}' does not match pattern ^[ACGT]+$")
+              for row in range(2, rows, 5)]
+    for n, issue in enumerate(found):
+        issue["id"] = str(n + 1)
+    return found
+
+
+FILES = [("b.csv", _file_issues("b.csv", 40)), ("a.csv", _file_issues("a.csv", 25))]
+
+
+def _in_page_order(files):
+    """Every issue with its seq, in ISSUE_SORT order (rows without a row number first)."""
+    ordered = []
+    for file_name, found in files:
+        ordered += [dict(issue, seq=len(ordered) + n) for n, issue in enumerate(found)]
+    ordered.sort(key=lambda issue: (issue["severity"], issue["fileName"], issue["rowIndex"] is not None,
+                                    issue["rowIndex"] or 0, issue["seq"]))
+    return ordered
+
+
+EXPECTED = _in_page_order(FILES)
+
+
+@pytest.fixture(params=["grouped", "per-issue"])
+def run_id(request, api, monkeypatch):
+    """A completed run holding FILES' issues, as grouped parts or one document per issue."""
+    run_id = ObjectId()
+    run = {"_id": run_id, "user_id": api.user_id, "status": "complete", "state_version": 3}
+    if request.param == "grouped":
+        run["issue_format"] = GROUPED
+        # Small parts, so pages end inside groups and parts of different groups interleave
+        monkeypatch.setattr(issues, "ISSUE_GROUP_PART_ROWS", 3)
+        files = [(file_name, group_issues(found)) for file_name, found in FILES]
+        api.call(write_issue_groups, api.db.issue_groups, run_id, files)
+    else:
+        api.call(api.db.validation_issues.insert_many, [dict(issue, run_id=run_id) for issue in EXPECTED])
+    api.call(api.db.harmonization_runs.insert_one, run)
+    return str(run_id)
+
+
+def _without_seq(found):
+    return [{key: value for key, value in issue.items() if key != "seq"} for issue in found]
+
+
+def _all_pages(api, run_id, limit, **params):
+    items, cursor, pages = [], None, 0
+    while True:
+        query = {"limit": limit, **params, **({"cursor": cursor} if cursor else {})}
+        response = api.client.get(f"/api/v1/runs/{run_id}/issues", params=query, headers=api.headers)
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page["items"]) <= limit
+        items += page["items"]
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return items, pages
+        assert len(page["items"]) == limit
+
+
+@pytest.mark.parametrize("limit", [1, 4, 7, 1000])
+def test_cursor_round_trip(api, run_id, limit):
+    items, pages = _all_pages(api, run_id, limit)
+    assert items == _without_seq(EXPECTED)
+    assert pages == max(-(-len(EXPECTED) // limit), 1)
+
+
+@pytest.mark.parametrize("limit", [2, 5])
+def test_filtered_pages(api, run_id, limit):
+    items, _ = _all_pages(api, run_id, limit, severity="Warning", file="a.csv")
+    expected = [issue for issue in EXPECTED if issue["severity"] == "Warning" and issue["fileName"] == "a.csv"]
+    assert items == _without_seq(expected)
+
+
+def test_page_boundaries(api, run_id):
+    # Starting from any issue's cursor gives exactly the issues after it
+    for n in range(0, len(EXPECTED), 3):
+        cursor = issues.encode_cursor(EXPECTED[n])
+        response = api.client.get(f"/api/v1/runs/{run_id}/issues", params={"cursor": cursor, "limit": 6},
+                                  headers=api.headers)
+        assert response.json()["items"] == _without_seq(EXPECTED[n + 1:n + 7])
+
+
+def _encoded(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor",
+    base64.urlsafe_b64encode(b"\xff\xfe").decode(),
+    _encoded({"severity": "Warning"}),
+    _encoded(["Warning", "a.csv", 5]),
+    _encoded(["Warning", "a.csv", "five", 3]),
+    _encoded(["Warning", None, 5, 3]),
+    _encoded(["Warning", "a.csv", 5, 3.5]),
+], ids=["garbage", "not-json", "object", "short", "text-row", "null-file", "float-seq"])
+def test_malformed_cursor(api, run_id, cursor):
+    response = api.client.get(f"/api/v1/runs/{run_id}/issues", params={"cursor": cursor}, headers=api.headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
@@ -0,0 +1,185 @@
+"""
+Parity of the validation paths: whole-file, streaming, split and
+incremental (revalidation.py) validation must each return exactly what
+validating the whole file parsed by pandas' C parser returns.
+
+Run from backend/ with `python -m pytest tests`.
+"""
+import asyncio
+
+import pytest
+
+import executor
+import validation
+from bench.generate import ErrorRates, generate_sheet, identity_mapping
+from issue_groups import group_issues
+from revalidation import validate_with_state
+from validation import (
+    plan_cache, read_csv_source, validate_content, validate_content_grouped, validate_csv_stream,
+    validate_dataframe, validate_with_plan, validate_with_plan_grouped,
+)
+
+TEMPLATE = "illumina-ngs-run-v1.2"
+FILE_NAME = "sheet.csv"
+ROWS = 200
+# Column positions in the generated sheet
+RUN_ID, SAMPLE_ID, LIBRARY_ID, LANE, INDEX_I1 = range(5)
+
+
+@pytest.fixture(scope="module")
+def plan():
+    return plan_cache.get(TEMPLATE, identity_mapping(TEMPLATE))
+
+
+@pytest.fixture(scope="module")
+def base(tmp_path_factory) -> bytes:
+    path = tmp_path_factory.mktemp("sheets") / "base.csv"
+    generate_sheet(str(path), TEMPLATE, ROWS, seed=3, rates=ErrorRates(0.02, 0.02, 0.02, 0.02))
+    return path.read_bytes()
+
+
+def _lines(data: bytes):
+    return data.rstrip(b"\n").split(b"\n")
+
+
+def _join(lines) -> bytes:
+    return b"\n".join(lines) + b"\n"
+
+
+def _set(lines, row: int, column: int, value: bytes) -> None:
+    """Set a cell of data row `row` (0-based, after the header)."""
+    fields = lines[row + 1].split(b",")
+    fields[column] = value
+    lines[row + 1] = b",".join(fields)
+
+
+def _new_row(n: int, lane: bytes = b"3") -> bytes:
+    return b",".join([b"RUNNEW%d" % n, b"SAMPLENEW%d" % n, b"LIBRARYNEW%d" % n, lane, b"ACGTACGTACGT", b"TTTT"])
+
+
+def inserted(data: bytes) -> bytes:
+    lines = _lines(data)
+    lines.insert(6, _new_row(1))
+    lines.insert(51, _new_row(2, lane=b"12"))
+    lines.append(_new_row(3))
+    return _join(lines)
+
+
+def deleted(data: bytes) -> bytes:
+    lines = _lines(data)
+    del lines[40:46]
+    del lines[4]
+    return _join(lines)
+
+
+def edited(data: bytes) -> bytes:
+    lines = _lines(data)
+    _set(lines, 10, LANE, b"0")
+    _set(lines, 20, INDEX_I1, b"XYZ")
+    _set(lines, 30, RUN_ID, b"")
+    return _join(lines)
+
+
+def dtype_changed(data: bytes) -> bytes:
+    lines = _lines(data)
+    _set(lines, 12, LANE, b"lane-x")
+    return _join(lines)
+
+
+def duplicate_ids(data: bytes) -> bytes:
+    lines = _lines(data)
+    sample = lines[8].split(b",")[SAMPLE_ID]
+    _set(lines, 25, SAMPLE_ID, sample)
+    _set(lines, 150, SAMPLE_ID, sample)
+    _set(lines, 60, LIBRARY_ID, lines[100].split(b",")[LIBRARY_ID])
+    return _join(lines)
+
+
+def blank_lines(data: bytes) -> bytes:
+    lines = _lines(data)
+    lines.insert(9, b"")
+    lines.insert(70, b"")
+    lines.insert(71, b"")
+    return _join(lines) + b"\n"
+
+
+def unchanged(data: bytes) -> bytes:
+    return data
+
+
+EDITS = [unchanged, inserted, deleted, edited, dtype_changed, duplicate_ids, blank_lines]
+# Edits that keep every column's dtype, so revalidation only reads the new rows
+INCREMENTAL = {unchanged, inserted, deleted, edited, duplicate_ids, blank_lines}
+
+
+def reference(data: bytes, plan):
+    """The issues of validating the whole file, parsed by pandas' C parser."""
+    return validate_dataframe(read_csv_source(data, low_memory=False), FILE_NAME, plan)
+
+
+@pytest.fixture(params=EDITS, ids=lambda edit: edit.__name__)
+def edit(request):
+    return request.param
+
+
+@pytest.fixture(params=["bytes", "path"])
+def source_of(request, tmp_path):
+    """Pass a sheet as raw bytes, or as the path of a spooled upload."""
+    def source(data: bytes, name: str = "upload.csv"):
+        if request.param == "bytes":
+            return data
+        path = tmp_path / name
+        path.write_bytes(data)
+        return str(path)
+    return source
+
+
+def test_whole_file(base, plan, edit, source_of):
+    data = edit(base)
+    expected = reference(data, plan)
+    source = source_of(data)
+    assert validate_with_plan(source, FILE_NAME, plan) == expected
+    assert validate_with_plan_grouped(source, FILE_NAME, plan) == group_issues(expected)
+    assert validate_content_grouped(source, FILE_NAME, plan) == group_issues(expected)
+
+
+@pytest.mark.parametrize("chunksize", [4, 37, 1000])
+def test_streaming(base, plan, edit, source_of, chunksize):
+    data = edit(base)
+    source = source_of(data)
+    assert validate_csv_stream(source, FILE_NAME, plan, chunksize=chunksize) == group_issues(reference(data, plan))
+
+
+def test_streamed_issues(base, plan, edit, source_of, monkeypatch):
+    # Every file counts as large, so validate_content streams it
+    monkeypatch.setattr(validation, "STREAM_THRESHOLD_BYTES", 0)
+    monkeypatch.setattr(validation, "STREAM_CHUNK_ROWS", 37)
+    data = edit(base)
+    assert validate_content(source_of(data), FILE_NAME, plan) == reference(data, plan)
+
+
+def test_split(base, plan, edit, source_of, monkeypatch):
+    async def run_inline(fn, *args, stage="parse"):
+        return fn(*args)
+
+    # Pieces are validated in this process instead of the worker pool
+    monkeypatch.setattr(executor, "_run_job", run_inline)
+    data = edit(base)
+    ranges = executor.split_ranges(data, 1024)
+    assert ranges and len(ranges) > 5
+    groups = asyncio.run(executor._validate_split(source_of(data), FILE_NAME, plan, ranges))
+    assert groups == group_issues(reference(data, plan))
+
+
+def test_revalidation(base, plan, edit, source_of, tmp_path, capsys):
+    state = str(tmp_path / "row-state.npz")
+    assert validate_with_state(source_of(base, "v1.csv"), FILE_NAME, plan, state) == reference(base, plan)
+    capsys.readouterr()
+
+    data = edit(base)
+    assert validate_with_state(source_of(data, "v2.csv"), FILE_NAME, plan, state) == reference(data, plan)
+    assert ("revalidated" in capsys.readouterr().out) == (edit in INCREMENTAL)
+
+    # The row state saved by the second upload describes it too
+    again = edited(data)
+    assert validate_with_state(source_of(again, "v3.csv"), FILE_NAME, plan, state) == reference(again, plan)
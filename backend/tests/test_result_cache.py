@@ -0,0 +1,62 @@
+"""The Mongo tier of the result cache keeps its byte total and evicts least recently used first."""
+import asyncio
+from datetime import datetime
+
+from mongomock_motor import AsyncMongoMockClient
+
+from result_cache import CACHED, TOTAL_ID, ResultCache
+
+
+def _groups(n: int):
+    return [{"column": "Lane", "severity": "Error", "message": f"bad {n}", "rows": [[n, 1]]}]
+
+
+async def _sizes(collection):
+    return {doc["_id"]: doc["size"] async for doc in collection.find(CACHED)}
+
+
+async def _total(collection):
+    return (await collection.find_one({"_id": TOTAL_ID}))["bytes"]
+
+
+def test_total_follows_writes_and_evictions():
+    async def main():
+        collection = AsyncMongoMockClient()["mdo"]["validation_cache"]
+        cache = ResultCache(memory_bytes=0, max_bytes=10_000)
+        await cache.put(collection, "a", _groups(1))
+        size = (await _sizes(collection))["a"]
+        cache = ResultCache(memory_bytes=0, max_bytes=3 * size)
+
+        # Replacing an entry does not count it twice
+        await cache.put(collection, "a", _groups(1))
+        assert await _total(collection) == size
+
+        await cache.put(collection, "b", _groups(2))
+        await cache.put(collection, "c", _groups(3))
+        assert await cache.get(collection, "a") is not None
+        # Mongo keeps milliseconds, so calls this close together can tie
+        for minute, key in enumerate("bca"):
+            await collection.update_one({"_id": key}, {"$set": {"last_used_at": datetime(2026, 1, 1, 0, minute)}})
+        await cache.put(collection, "d", _groups(4))
+
+        # b was used least recently
+        sizes = await _sizes(collection)
+        assert set(sizes) == {"a", "c", "d"}
+        assert await _total(collection) == sum(sizes.values())
+
+    asyncio.run(main())
+
+
+def test_total_is_counted_once_for_an_existing_collection():
+    async def main():
+        collection = AsyncMongoMockClient()["mdo"]["validation_cache"]
+        cache = ResultCache(memory_bytes=0, max_bytes=10_000)
+        await cache.put(collection, "a", _groups(1))
+        await cache.put(collection, "b", _groups(2))
+        # Left by code that kept no total
+        await collection.delete_one({"_id": TOTAL_ID})
+
+        await cache.put(collection, "c", _groups(3))
+        assert await _total(collection) == sum((await _sizes(collection)).values())
+
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""GET /api/v1/runs/{run_id}: conditional requests on the run's ETag, and response compression."""
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from payloads import RESPONSE_COMPRESS_MIN_BYTES
+
+
+@pytest.fixture
+def run_id(api):
+    """A completed run whose payload is large enough to be compressed."""
+    run_id = ObjectId()
+    mapping = [{"fileName": f"sheet-{n}.csv", "templateId": "illumina-ngs-run-v1.2", "mapping": {}} for n in range(40)]
+    api.call(api.db.harmonization_runs.insert_one, {
+        "_id": run_id, "user_id": api.user_id, "status": "complete", "mapping": mapping,
+        "files": [entry["fileName"] for entry in mapping], "created_at": datetime(2026, 1, 1),
+        "updated_at": datetime(2026, 1, 1, 0, 5), "state_version": 4,
+    })
+    return str(run_id)
+
+
+def _get(api, run_id, **headers):
+    return api.client.get(f"/api/v1/runs/{run_id}", headers={**api.headers, **headers})
+
+
+def test_if_none_match_gets_304(api, run_id):
+    first = _get(api, run_id)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert first.headers["Last-Modified"] == "Thu, 01 Jan 2026 00:05:00 GMT"
+
+    for if_none_match in (etag, etag.removeprefix("W/"), f'W/"other", {etag}', "*"):
+        again = _get(api, run_id, **{"If-None-Match": if_none_match})
+        assert again.status_code == 304
+        assert again.content == b""
+        assert again.headers["ETag"] == etag
+
+    assert _get(api, run_id, **{"If-None-Match": 'W/"other"'}).status_code == 200
+
+
+def test_etag_follows_state_version(api, run_id):
+    etag = _get(api, run_id).headers["ETag"]
+    api.call(api.db.harmonization_runs.update_one, {"_id": ObjectId(run_id)},
+             {"$inc": {"state_version": 1}, "$set": {"status": "running"}})
+
+    changed = _get(api, run_id, **{"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.json()["status"] == "running"
+    assert changed.headers["ETag"] != etag
+    assert _get(api, run_id, **{"If-None-Match": changed.headers["ETag"]}).status_code == 304
+
+
+def test_if_none_match_on_another_users_run(api, run_id):
+    api.call(api.db.harmonization_runs.update_one, {"_id": ObjectId(run_id)}, {"$set": {"user_id": ObjectId()}})
+    assert _get(api, run_id, **{"If-None-Match": "*"}).status_code == 404
+
+
+@pytest.mark.parametrize("accept_encoding, encoding", [
+    ("zstd", "zstd"),
+    ("gzip", "gzip"),
+    ("gzip, zstd", "zstd"),
+    ("zstd;q=0, gzip", "gzip"),
+    ("*", "zstd"),
+    ("identity", None),
+    ("br", None),
+    ("gzip;q=0", None),
+])
+def test_accept_encoding(api, run_id, accept_encoding, encoding):
+    plain = _get(api, run_id, **{"Accept-Encoding": "identity"})
+    assert len(plain.content) >= RESPONSE_COMPRESS_MIN_BYTES
+
+    response = _get(api, run_id, **{"Accept-Encoding": accept_encoding})
+    assert response.status_code == 200
+    assert response.headers.get("Content-Encoding") == encoding
+    # Decoded by the client either way
+    assert response.json() == plain.json()
+    if encoding:
+        assert "Accept-Encoding" in response.headers["Vary"]
+        assert int(response.headers["Content-Length"]) < len(plain.content)
+
+
+def test_small_responses_are_not_compressed(api):
+    response = api.client.get("/api/v1/auth/me", headers={**api.headers, "Accept-Encoding": "zstd, gzip"})
+    assert response.status_code == 200
+    assert "Content-Encoding" not in response.headers
@@ -0,0 +1,178 @@
+"""Claims, leases, heartbeats and shutdown of the durable run queue, against mongomock."""
+import asyncio
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from mongomock_motor import AsyncMongoMockClient
+
+from run_queue import RunQueue, RunWorkerPool
+
+
+def _runs():
+    return AsyncMongoMockClient()["mdo"]["harmonization_runs"]
+
+
+async def _queue_run(runs, age_seconds: int = 0):
+    run_id = ObjectId()
+    created_at = datetime.utcnow() - timedelta(seconds=age_seconds)
+    await runs.insert_one({"_id": run_id, "status": "pending", "created_at": created_at, "state_version": 1})
+    return run_id
+
+
+async def _expire_lease(runs, run_id) -> None:
+    await runs.update_one({"_id": run_id}, {"$set": {"lease_expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+
+
+def test_a_run_is_claimed_once():
+    async def main():
+        runs = _runs()
+        run_id = await _queue_run(runs)
+        queues = [RunQueue(runs, worker_id=f"w{n}") for n in range(5)]
+        claimed = [run for run in await asyncio.gather(*(queue.claim() for queue in queues)) if run]
+
+        assert [run["_id"] for run in claimed] == [run_id]
+        run = await runs.find_one({"_id": run_id})
+        assert run["status"] == "running" and run["attempts"] == 1 and run["state_version"] == 2
+        assert run["lease_owner"] == claimed[0]["lease_owner"]
+
+    asyncio.run(main())
+
+
+def test_oldest_run_first():
+    async def main():
+        runs = _runs()
+        newer = await _queue_run(runs, age_seconds=10)
+        older = await _queue_run(runs, age_seconds=20)
+        queue = RunQueue(runs)
+        assert (await queue.claim())["_id"] == older
+        assert (await queue.claim())["_id"] == newer
+        assert await queue.claim() is None
+
+    asyncio.run(main())
+
+
+def test_expired_lease_is_reclaimed():
+    async def main():
+        runs = _runs()
+        run_id = await _queue_run(runs)
+        first, second = RunQueue(runs, worker_id="first"), RunQueue(runs, worker_id="second")
+        await first.claim()
+        # A live lease is not reclaimable
+        assert await second.claim() is None
+
+        await _expire_lease(runs, run_id)
+        run = await second.claim()
+        assert run["_id"] == run_id and run["lease_owner"] == "second" and run["attempts"] == 2
+
+        # The first worker finds out through its heartbeat, and can no longer finish the run
+        assert not await first.heartbeat(run_id)
+        assert not await first.complete(run_id, {"total_issues": 0})
+        assert await second.complete(run_id, {"total_issues": 0})
+        assert (await runs.find_one({"_id": run_id}))["status"] == "complete"
+
+    asyncio.run(main())
+
+
+def test_exhausted_run_is_failed():
+    async def main():
+        runs = _runs()
+        run_id = await _queue_run(runs)
+        queue = RunQueue(runs, max_attempts=2)
+        for _ in range(2):
+            assert (await queue.claim())["_id"] == run_id
+            await _expire_lease(runs, run_id)
+
+        assert await queue.claim() is None
+        assert await queue.fail_exhausted() == 1
+        run = await runs.find_one({"_id": run_id})
+        assert run["status"] == "failed" and "lease_owner" not in run
+
+    asyncio.run(main())
+
+
+def test_heartbeat_extends_the_lease():
+    async def main():
+        runs = _runs()
+        run_id = await _queue_run(runs)
+        queue = RunQueue(runs, lease_seconds=60)
+        await queue.claim()
+        await _expire_lease(runs, run_id)
+
+        assert await queue.heartbeat(run_id)
+        run = await runs.find_one({"_id": run_id})
+        assert run["lease_expires_at"] > datetime.utcnow() + timedelta(seconds=50)
+        # Clients never see heartbeats
+        assert run["state_version"] == 2
+        assert await RunQueue(runs).claim() is None
+
+    asyncio.run(main())
+
+
+def test_pool_heartbeats_keep_a_long_run():
+    async def main():
+        runs = _runs()
+        run_id = await _queue_run(runs)
+        queue = RunQueue(runs, worker_id="pool", lease_seconds=1)
+        other = RunQueue(runs, worker_id="other")
+
+        async def handler(queue, run):
+            # Outlives the lease several times over
+            for _ in range(5):
+                await asyncio.sleep(0.5)
+                assert await other.claim() is None
+            await queue.complete(run["_id"], {"total_issues": 0})
+
+        pool = RunWorkerPool(queue, handler, concurrency=1, poll_seconds=0.05, heartbeat_seconds=0.2)
+        pool.start()
+        for _ in range(100):
+            await asyncio.sleep(0.05)
+            if (await runs.find_one({"_id": run_id}))["status"] == "complete":
+                break
+        await pool.stop(drain_seconds=0)
+        run = await runs.find_one({"_id": run_id})
+        assert run["status"] == "complete" and run["attempts"] == 1
+
+    asyncio.run(main())
+
+
+def test_stop_drains_runs_that_finish_in_time():
+    async def main():
+        runs = _runs()
+        run_id = await _queue_run(runs)
+        started = asyncio.Event()
+
+        async def handler(queue, run):
+            started.set()
+            await asyncio.sleep(0.2)
+            await queue.complete(run["_id"], {"total_issues": 0})
+
+        pool = RunWorkerPool(RunQueue(runs), handler, concurrency=2, poll_seconds=0.05)
+        pool.start()
+        await asyncio.wait_for(started.wait(), 5)
+        await pool.stop(drain_seconds=5)
+        assert (await runs.find_one({"_id": run_id}))["status"] == "complete"
+
+    asyncio.run(main())
+
+
+def test_stop_hands_back_runs_that_do_not_finish():
+    async def main():
+        runs = _runs()
+        run_id = await _queue_run(runs)
+        started = asyncio.Event()
+
+        async def handler(queue, run):
+            started.set()
+            await asyncio.sleep(60)
+
+        pool = RunWorkerPool(RunQueue(runs), handler, concurrency=1, poll_seconds=0.05)
+        pool.start()
+        await asyncio.wait_for(started.wait(), 5)
+        await pool.stop(drain_seconds=0.1)
+
+        run = await runs.find_one({"_id": run_id})
+        assert run["status"] == "pending" and run["attempts"] == 0 and "lease_owner" not in run
+        # Straight away claimable, without waiting for a lease to expire
+        assert (await RunQueue(runs).claim())["_id"] == run_id
+
+    asyncio.run(main())
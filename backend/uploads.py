@@ -0,0 +1,232 @@
+"""
+Upload spooling.
+
+Uploaded files are copied in fixed-size chunks into a per-run spool
+directory instead of being held in memory for the life of a run. The SHA-256
+of each file is computed during the copy. Validation (and anything else that
+reads a run's files) works from the spooled paths through memory-mapped
+buffers.
+
+Two byte limits guard the spool: MAX_UPLOAD_BYTES per request and
+SPOOL_MAX_BYTES across all runs this instance is still processing.
+"""
+import asyncio
+import hashlib
+import mmap
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, Optional, Union
+
+from bson import ObjectId
+
+# Root directory for spooled uploads (one sub-directory per run)
+SPOOL_DIR = os.getenv("SPOOL_DIR") or os.path.join(tempfile.gettempdir(), "mdo-spool")
+# Bytes copied per read from an upload
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+# Largest total upload accepted in one request (default: 1 GB)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(1024 * 1024 * 1024)))
+# Bytes all in-flight runs of this instance may hold in the spool (default: 4 GB),
+# split evenly between the API's WEB_CONCURRENCY worker processes
+SPOOL_MAX_BYTES = int(os.getenv("SPOOL_MAX_BYTES", str(4 * 1024 * 1024 * 1024)))
+WEB_CONCURRENCY = max(int(os.getenv("WEB_CONCURRENCY", "1")), 1)
+# Spool directories of finished runs are deleted after this many seconds
+SPOOL_RETENTION_SECONDS = int(os.getenv("SPOOL_RETENTION_SECONDS", "3600"))
+
+# Run statuses after which a run no longer needs its spooled files' budget
+FINISHED_STATUSES = ("complete", "failed")
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds the per-request or per-instance byte limit."""
+
+
+@dataclass(frozen=True)
+class SpooledFile:
+    file_name: str
+    path: str
+    size: int
+    sha256: str
+
+    def to_doc(self) -> Dict[str, object]:
+        """Run document entry; the path is stored relative to the run's spool directory."""
+        return {"fileName": self.file_name, "file": os.path.basename(self.path), "size": self.size, "sha256": self.sha256}
+
+
+def spooled_path(run_id: str, upload: Dict[str, object]) -> str:
+    """Path of a spooled file from its run document entry."""
+    return os.path.join(run_spool_dir(run_id), str(upload["file"]))
+
+
+class SpoolBudget:
+    """
+    Bytes reserved by runs that are uploading or validating.
+    Only touched from the event loop, so it needs no lock.
+    """
+
+    def __init__(self, limit: int = SPOOL_MAX_BYTES // WEB_CONCURRENCY):
+        self.limit = limit
+        self.reserved = 0
+
+    def available(self) -> int:
+        return max(self.limit - self.reserved, 0)
+
+    def reserve(self, size: int) -> None:
+        if self.reserved + size > self.limit:
+            raise UploadTooLarge("Server upload capacity exceeded, try again later")
+        self.reserved += size
+
+    def release(self, size: int) -> None:
+        self.reserved = max(self.reserved - size, 0)
+
+
+# Process-wide budget shared by all runs of this instance
+spool_budget = SpoolBudget()
+# Bytes spooled by runs of this instance that have not finished yet; their
+# spool directories are never pruned
+_active_runs: Dict[str, int] = {}
+
+
+def run_spool_dir(run_id: str) -> str:
+    return os.path.join(SPOOL_DIR, str(run_id))
+
+
+def check_upload_size(content_length: Optional[str]) -> None:
+    """
+    Reject a request from its Content-Length alone, before the body is read.
+    Requests without a usable Content-Length are checked while spooling.
+    """
+    try:
+        size = int(content_length) if content_length else 0
+    except ValueError:
+        return
+    if size > MAX_UPLOAD_BYTES:
+        raise UploadTooLarge(f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit")
+    if size > spool_budget.available():
+        raise UploadTooLarge("Server upload capacity exceeded, try again later")
+
+
+async def spool_uploads(run_id: str, files) -> Dict[str, SpooledFile]:
+    """
+    Copy uploaded files into the run's spool directory, hashing as they go.
+    Returns the spooled files by file name (a repeated name keeps the last
+    file, as before). Every byte written is reserved in spool_budget until
+    release_run() is called. On UploadTooLarge the partial spool is removed
+    and its reservation released.
+    """
+    directory = run_spool_dir(run_id)
+    os.makedirs(directory, exist_ok=True)
+    _active_runs[str(run_id)] = 0
+    spooled: Dict[str, SpooledFile] = {}
+    total = 0
+    try:
+        for n, file in enumerate(files):
+            path = os.path.join(directory, f"{n}.csv")
+            digest = hashlib.sha256()
+            size = 0
+            with open(path, "wb") as out:
+                while True:
+                    chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    if total + len(chunk) > MAX_UPLOAD_BYTES:
+                        raise UploadTooLarge(f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit")
+                    spool_budget.reserve(len(chunk))
+                    _active_runs[str(run_id)] += len(chunk)
+                    total += len(chunk)
+                    size += len(chunk)
+                    digest.update(chunk)
+                    await asyncio.to_thread(out.write, chunk)
+            spooled[file.filename] = SpooledFile(file.filename, path, size, digest.hexdigest())
+    except BaseException:
+        _active_runs.pop(str(run_id), None)
+        spool_budget.release(total)
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+    return spooled
+
+
+def release_run(run_id: str) -> None:
+    """
+    Return a finished run's bytes to the budget (once; later calls do
+    nothing). Its files are kept for SPOOL_RETENTION_SECONDS.
+    """
+    size = _active_runs.pop(str(run_id), None)
+    if size is None:
+        return
+    spool_budget.release(size)
+    directory = run_spool_dir(run_id)
+    if os.path.isdir(directory):
+        os.utime(directory)
+
+
+async def release_finished_runs(collection) -> int:
+    """
+    Release the spool bytes of this instance's runs that finished elsewhere
+    (e.g. in a separate worker process). Returns the number released.
+    """
+    if not _active_runs:
+        return 0
+    ids = [ObjectId(run_id) for run_id in _active_runs if ObjectId.is_valid(run_id)]
+    released = 0
+    async for doc in collection.find({"_id": {"$in": ids}, "status": {"$in": list(FINISHED_STATUSES)}}, {"_id": 1}):
+        release_run(str(doc["_id"]))
+        released += 1
+    return released
+
+
+def _stale_spools(retention_seconds: int) -> Dict[str, str]:
+    """Run id -> path of spool directories not modified for retention_seconds, besides this instance's runs."""
+    if not os.path.isdir(SPOOL_DIR):
+        return {}
+    cutoff = time.time() - retention_seconds
+    return {
+        entry.name: entry.path for entry in os.scandir(SPOOL_DIR)
+        if entry.name not in _active_runs and entry.is_dir() and entry.stat().st_mtime < cutoff
+    }
+
+
+def _remove_dirs(paths) -> None:
+    for path in paths:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+async def prune_spool(collection, retention_seconds: int = SPOOL_RETENTION_SECONDS) -> int:
+    """
+    Delete spool directories not modified for retention_seconds, unless
+    their run is still pending or running, or finished less than
+    retention_seconds ago. Run state comes from the runs collection, since
+    another API process (or this one before a restart) may have accepted
+    the run. Returns the number of directories removed.
+    """
+    stale = await asyncio.to_thread(_stale_spools, retention_seconds)
+    if not stale:
+        return 0
+    ids = [ObjectId(run_id) for run_id in stale if ObjectId.is_valid(run_id)]
+    since = datetime.utcnow() - timedelta(seconds=retention_seconds)
+    live = {"$or": [{"status": {"$nin": list(FINISHED_STATUSES)}}, {"updated_at": {"$gte": since}}]}
+    async for doc in collection.find({"_id": {"$in": ids}, **live}, {"_id": 1}):
+        stale.pop(str(doc["_id"]), None)
+    await asyncio.to_thread(_remove_dirs, list(stale.values()))
+    return len(stale)
+
+
+@contextmanager
+def mapped(source: Union[bytes, str]) -> Iterator[Union[bytes, mmap.mmap]]:
+    """
+    Read-only buffer over CSV input: raw bytes as they are, a spooled file
+    memory-mapped (empty files, which cannot be mapped, as b"").
+    """
+    if not isinstance(source, str):
+        yield source
+        return
+    with open(source, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield buffer
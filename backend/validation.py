@@ -0,0 +1,914 @@
+"""
+Validation engine for MDO sample sheets.
+
+Every template rule is evaluated on a whole column at once with vectorized
+pandas operations. Issue dicts are only built for the rows that fail a rule,
+so validation cost is dominated by the column scans rather than by Python
+per-cell work.
+"""
+import io
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from arrow_csv import BatchReader, read_frame, to_series
+from issue_groups import GroupBuilder, IssueGroup, group_issues
+from metrics import count_rows, timed_stage
+from templates import SCHEMA_TEMPLATES, template_registry
+
+# Issues for the same row and field are emitted in this order, which is the
+# order the checks ran in when rows were validated one at a time.
+CHECK_REQUIRED = 0
+CHECK_TYPE = 1
+CHECK_MIN = 1
+CHECK_MAX = 2
+CHECK_PATTERN = 3
+CHECK_DUPLICATE = 4
+
+# First data row is CSV line 2 (line 1 is the header)
+ROW_NUMBER_OFFSET = 2
+
+# A batch of failures for one check: (row positions, check order, severity, descriptions)
+FailureBatch = Tuple[np.ndarray, int, str, List[str]]
+
+PLAN_CACHE_SIZE = int(os.getenv("VALIDATION_PLAN_CACHE_SIZE", "256"))
+
+# Files larger than this are validated in streaming mode, in chunks of STREAM_CHUNK_ROWS rows
+STREAM_THRESHOLD_BYTES = int(os.getenv("VALIDATION_STREAM_THRESHOLD_BYTES", str(50 * 1024 * 1024)))
+STREAM_CHUNK_ROWS = int(os.getenv("VALIDATION_CHUNK_ROWS", "100000"))
+
+# ============== Compiled Validation Plans ==============
+
+
+@dataclass(frozen=True)
+class FieldRule:
+    """One template field with its rules resolved for a specific column mapping."""
+    name: str
+    csv_column: Optional[str]
+    required: bool
+    is_integer: bool
+    min: Optional[int]
+    max: Optional[int]
+    pattern: Optional[re.Pattern]
+    unique: bool
+
+
+@dataclass(frozen=True)
+class ValidationPlan:
+    """
+    A template compiled against one column mapping.
+    Plans are immutable and picklable, so they can be shared between
+    requests and shipped to worker processes.
+    """
+    template_id: str
+    template_version: int
+    rules: Tuple[FieldRule, ...]
+    # CSV columns referenced by the mapping, in field order
+    columns: Tuple[str, ...]
+    # Names of the fields checked for duplicate values
+    unique_fields: Tuple[str, ...]
+
+
+def canonical_mapping(column_mapping: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    """Order-independent, hashable form of a column mapping (unmapped entries dropped)."""
+    return tuple(sorted((k, v) for k, v in (column_mapping or {}).items() if v))
+
+
+def compile_plan(template_id: str, template: Dict[str, Any], column_mapping: Dict[str, str]) -> ValidationPlan:
+    rules = []
+    for field in template["fields"]:
+        rules.append(FieldRule(
+            name=field["name"],
+            csv_column=(column_mapping or {}).get(field["name"]) or None,
+            required=field["required"],
+            is_integer=field["type"] == "integer",
+            min=field.get("min"),
+            max=field.get("max"),
+            pattern=re.compile(field["pattern"]) if "pattern" in field else None,
+            unique=field["name"].endswith("_ID"),
+        ))
+    columns = tuple(dict.fromkeys(r.csv_column for r in rules if r.csv_column))
+    return ValidationPlan(
+        template_id=template_id,
+        template_version=template.get("version", 0),
+        rules=tuple(rules),
+        columns=columns,
+        unique_fields=tuple(r.name for r in rules if r.unique),
+    )
+
+
+class PlanCache:
+    """
+    Bounded LRU of compiled plans keyed by (template_id, version, mapping).
+    Safe to share between the event loop and worker threads.
+    """
+
+    def __init__(self, registry, maxsize: int = PLAN_CACHE_SIZE):
+        self._registry = registry
+        self._maxsize = maxsize
+        self._plans: "OrderedDict[Tuple, ValidationPlan]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        registry.on_change(self.invalidate)
+
+    def get(self, template_id: str, column_mapping: Dict[str, str]) -> Optional[ValidationPlan]:
+        """Return the plan for a template and mapping, or None if the template is unknown."""
+        template = self._registry.get(template_id)
+        if template is None:
+            return None
+        key = (template_id, template["version"], canonical_mapping(column_mapping))
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                self.hits += 1
+                return plan
+            self.misses += 1
+
+        plan = compile_plan(template_id, template, column_mapping)
+        with self._lock:
+            self._plans[key] = plan
+            self._plans.move_to_end(key)
+            while len(self._plans) > self._maxsize:
+                self._plans.popitem(last=False)
+        return plan
+
+    def invalidate(self, template_id: str) -> None:
+        """Drop every cached plan compiled from the given template."""
+        with self._lock:
+            for key in [k for k in self._plans if k[0] == template_id]:
+                del self._plans[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._plans), "maxsize": self._maxsize, "hits": self.hits, "misses": self.misses}
+
+
+plan_cache = PlanCache(template_registry)
+
+
+def make_issue(issue_id: Optional[int], severity: str, file_name: str, row_index: Optional[int],
+               column_name: Optional[str], description: str) -> Dict[str, Any]:
+    return {
+        "id": str(issue_id) if issue_id is not None else None,
+        "severity": severity,
+        "fileName": file_name,
+        "rowIndex": row_index,
+        "columnName": column_name,
+        "description": description
+    }
+
+
+def _is_text(column: pd.Series) -> bool:
+    """True when every non-null cell is already a str."""
+    if isinstance(column.dtype, pd.StringDtype):
+        return True
+    if column.dtype == object:
+        return pd.api.types.infer_dtype(column, skipna=True) in ("string", "empty")
+    return False
+
+
+def _to_int_or_none(value: Any) -> Optional[int]:
+    """Python fallback for values pd.to_numeric rejects (e.g. '1_000')."""
+    try:
+        return int(float(value))
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+
+def _integer_failures(rule: FieldRule, raw: pd.Series, positions: np.ndarray) -> List[FailureBatch]:
+    """Type and range checks for an integer field over the non-empty cells."""
+    numeric = pd.to_numeric(raw, errors="coerce").to_numpy(dtype=float, na_value=np.nan, copy=True)
+    raw_values = raw.to_numpy(dtype=object)
+
+    # Cells pandas could not parse get a second chance through int(float(value))
+    unparsed = np.flatnonzero(~np.isfinite(numeric))
+    bad_type = []
+    for i in unparsed:
+        int_val = _to_int_or_none(raw_values[i])
+        if int_val is None:
+            bad_type.append(i)
+        else:
+            numeric[i] = int_val
+    bad_type = np.asarray(bad_type, dtype=np.intp)
+
+    batches = []
+    if len(bad_type):
+        batches.append((
+            positions[bad_type], CHECK_TYPE, "Blocker",
+            [f"Expected integer, got '{v}'" for v in raw_values[bad_type]]
+        ))
+
+    truncated = np.trunc(numeric)
+    valid = np.ones(len(numeric), dtype=bool)
+    valid[bad_type] = False
+    if rule.min is not None:
+        below = np.flatnonzero(valid & (truncated < rule.min))
+        if len(below):
+            batches.append((
+                positions[below], CHECK_MIN, "Blocker",
+                [f"Value {int(float(v))} is below minimum {rule.min}" for v in raw_values[below]]
+            ))
+    if rule.max is not None:
+        above = np.flatnonzero(valid & (truncated > rule.max))
+        if len(above):
+            batches.append((
+                positions[above], CHECK_MAX, "Blocker",
+                [f"Value {int(float(v))} exceeds maximum {rule.max}" for v in raw_values[above]]
+            ))
+    return batches
+
+
+class SeenValues:
+    """
+    Compact first-seen index for uniqueness checks across chunks.
+    The 64-bit hashes of the values seen so far, kept sorted in a numpy
+    array next to the row each value was first seen in (16 bytes per
+    distinct value instead of a dict of Python strings). A chunk is sorted,
+    looked up with one pass of binary searches and merged in. Two distinct
+    values sharing a 64-bit hash would be reported as duplicates; at 10M
+    distinct values the odds of that are roughly 1 in 300,000.
+    """
+
+    def __init__(self):
+        self._keys = np.zeros(0, dtype=np.uint64)
+        self._rows = np.zeros(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _merge(self, slots: np.ndarray, hashes: np.ndarray, rows: np.ndarray) -> None:
+        """Insert sorted, distinct new hashes before the given slots of the index."""
+        self._keys = np.insert(self._keys, slots, hashes)
+        self._rows = np.insert(self._rows, slots, rows)
+
+    def check(self, values: pd.Series, row_numbers: np.ndarray) -> Tuple[np.ndarray, List[int]]:
+        """
+        Record a chunk of values in row order.
+        Returns a mask of the values already seen (in earlier chunks or earlier
+        in this chunk) and the first-seen row number of each of them.
+        """
+        return self.check_hashes(hash_values(values), row_numbers)
+
+    def check_hashes(self, hashes: np.ndarray, row_numbers: np.ndarray) -> Tuple[np.ndarray, List[int]]:
+        """check() for values that were already hashed with hash_values()."""
+        order = np.argsort(hashes)
+        hashes, rows = hashes[order], np.asarray(row_numbers)[order]
+        # Equal hashes (repeated values) are rare: put just those back in row order
+        repeats = np.flatnonzero(hashes[1:] == hashes[:-1])
+        if len(repeats):
+            runs = np.union1d(repeats, repeats + 1)
+            resorted = runs[np.lexsort((order[runs], hashes[runs]))]
+            order[runs] = order[resorted]
+            rows[runs] = rows[resorted]
+        slots = np.searchsorted(self._keys, hashes)
+        found = np.zeros(len(hashes), dtype=bool)
+        if len(self._keys):
+            found = self._keys[np.minimum(slots, len(self._keys) - 1)] == hashes
+        # The first of each run of equal hashes in the chunk
+        starts = np.ones(len(hashes), dtype=bool)
+        starts[1:] = hashes[1:] != hashes[:-1]
+        first_rows = rows[starts][np.cumsum(starts) - 1]
+        if found.any():
+            first_rows[found] = self._rows[slots[found]]
+        added = starts & ~found
+        self._merge(slots[added], hashes[added], rows[added])
+
+        duplicated = np.empty(len(hashes), dtype=bool)
+        duplicated[order] = ~added
+        unsorted_first_rows = np.empty(len(hashes), dtype=np.int64)
+        unsorted_first_rows[order] = first_rows
+        return duplicated, unsorted_first_rows[duplicated].tolist()
+
+
+# splitmix64's finalizer, applied after mixing in each 8 bytes of a value
+_MIX_SEED = np.uint64(0x9E3779B97F4A7C15)
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+_SHIFTS = (np.uint64(30), np.uint64(27), np.uint64(31))
+# The first n bytes of a little-endian word, for n = 0..8
+_BYTE_MASKS = np.array([(1 << (8 * n)) - 1 for n in range(9)], dtype=np.uint64)
+
+
+def _mix(h: np.ndarray) -> np.ndarray:
+    h ^= h >> _SHIFTS[0]
+    h *= _MIX_1
+    h ^= h >> _SHIFTS[1]
+    h *= _MIX_2
+    h ^= h >> _SHIFTS[2]
+    return h
+
+
+def hash_values(values: pd.Series) -> np.ndarray:
+    """
+    64-bit hashes of string values, never 0. Each value's UTF-8 bytes are
+    read 8 at a time straight out of its Arrow buffer, for every value at
+    once, so no Python string is created.
+    """
+    array = pa.array(values.array, type=pa.large_string())
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    offsets = np.frombuffer(array.buffers()[1], dtype=np.int64)[array.offset:array.offset + len(array) + 1]
+    starts = offsets[:-1]
+    lengths = offsets[1:] - starts
+    if not len(lengths):
+        return np.zeros(0, dtype=np.uint64)
+    data = np.zeros(int(offsets[-1]) + 8, dtype=np.uint8)
+    if array.buffers()[2] is not None:
+        data[:offsets[-1]] = np.frombuffer(array.buffers()[2], dtype=np.uint8)[:offsets[-1]]
+    # The 8 bytes starting at every byte of the data
+    words = np.ndarray((len(data) - 7,), dtype="<u8", buffer=data, strides=(1,))
+
+    hashes = _mix(lengths.astype(np.uint64) ^ _MIX_SEED)
+    rows = None
+    read = 0
+    while True:
+        left = (lengths if rows is None else lengths[rows]) - read
+        if rows is None and not (left > 0).all():
+            rows = np.flatnonzero(left > 0)
+            left = left[rows]
+        if rows is None:
+            hashes = _mix(hashes ^ (words[starts + read] & _BYTE_MASKS[np.minimum(left, 8)]))
+        elif len(rows):
+            hashes[rows] = _mix(hashes[rows] ^ (words[starts[rows] + read] & _BYTE_MASKS[np.minimum(left, 8)]))
+            rows = rows[left > 8]
+        else:
+            break
+        read += 8
+    hashes[hashes == 0] = np.uint64(1)
+    return hashes
+
+
+def present_strings(column: pd.Series) -> Tuple[np.ndarray, pd.Series]:
+    """Positions of the non-empty cells and their str(value).strip() values."""
+    if _is_text(column):
+        stripped = column.str.strip()
+        empty = column.isna().to_numpy() | stripped.eq("").to_numpy(dtype=bool, na_value=False)
+        present = np.flatnonzero(~empty)
+        return present, stripped.iloc[present]
+    present = np.flatnonzero(~column.isna().to_numpy())
+    if not len(present):
+        return present, pd.Series([], dtype=object)
+    return present, column.iloc[present].map(str).str.strip()
+
+
+def _frame_duplicates(values: pd.Series, row_numbers: np.ndarray) -> Tuple[np.ndarray, List[int]]:
+    """Exact in-memory equivalent of SeenValues.check for a whole column."""
+    # Values are told apart by hash (much faster than by string), and the
+    # few repeats are compared as strings in case two values share a hash
+    codes, _ = pd.factorize(hash_values(values))
+    duplicated = np.zeros(len(codes), dtype=bool)
+    duplicated[1:] = codes[1:] <= np.maximum.accumulate(codes)[:-1]
+    if not duplicated.any():
+        return duplicated, []
+    # Codes number the values in the order they first appear
+    first = np.flatnonzero(~duplicated)[codes[duplicated]]
+    if not (values.iloc[duplicated].to_numpy() == values.iloc[first].to_numpy()).all():
+        codes, _ = pd.factorize(values)
+        duplicated[1:] = codes[1:] <= np.maximum.accumulate(codes)[:-1]
+        first = np.flatnonzero(~duplicated)[codes[duplicated]]
+    return duplicated, np.asarray(row_numbers)[first].tolist()
+
+
+@timed_stage("validate")
+def field_failures(rule: FieldRule, column: pd.Series, seen: Optional[SeenValues] = None,
+                    row_offset: int = 0) -> List[FailureBatch]:
+    """
+    Evaluate every rule for one mapped column and return the failing rows.
+    Positions are relative to the column; row_offset is the number of data
+    rows that came before it (streaming mode), and seen carries uniqueness
+    state between chunks.
+    """
+    canonical_name = rule.name
+    row_numbers = np.arange(len(column)) + row_offset + ROW_NUMBER_OFFSET
+
+    # str(value).strip() can only be empty for text cells; numeric columns
+    # are stringified lazily, and only if a pattern or uniqueness rule needs it
+    if _is_text(column):
+        stripped = column.str.strip()
+        empty = column.isna().to_numpy() | stripped.eq("").to_numpy(dtype=bool, na_value=False)
+    else:
+        stripped = None
+        empty = column.isna().to_numpy()
+
+    batches = []
+    if rule.required:
+        empty_rows = np.flatnonzero(empty)
+        if len(empty_rows):
+            description = f"Required field '{canonical_name}' is empty"
+            batches.append((empty_rows, CHECK_REQUIRED, "Blocker", [description] * len(empty_rows)))
+
+    # Every remaining rule only looks at non-empty cells
+    present = np.flatnonzero(~empty)
+    if not len(present):
+        return batches
+    if rule.pattern is not None or rule.unique:
+        if stripped is None:
+            values = column.iloc[present].map(str).str.strip()
+        else:
+            values = stripped.iloc[present]
+
+    if rule.is_integer:
+        batches.extend(_integer_failures(rule, column.iloc[present], present))
+
+    if rule.pattern is not None:
+        matches = values.str.match(rule.pattern).to_numpy(dtype=bool, na_value=False)
+        mismatched = np.flatnonzero(~matches)
+        if len(mismatched):
+            batches.append((
+                present[mismatched], CHECK_PATTERN, "Warning",
+                [f"Value '{v}' doesn't match expected format" for v in values.iloc[mismatched].tolist()]
+            ))
+
+    if rule.unique:
+        if seen is None:
+            duplicated, first_rows = _frame_duplicates(values, row_numbers[present])
+        else:
+            duplicated, first_rows = seen.check(values, row_numbers[present])
+        if duplicated.any():
+            dup_values = values[duplicated].tolist()
+            batches.append((
+                present[duplicated], CHECK_DUPLICATE, "Warning",
+                [f"Duplicate value '{v}' (first seen in row {r})" for v, r in zip(dup_values, first_rows)]
+            ))
+    return batches
+
+
+def ordered_failures(batches: List[FailureBatch]) -> List[Tuple[int, str, str]]:
+    """Flatten failure batches into (row position, severity, description) in row order."""
+    if not batches:
+        return []
+    positions = np.concatenate([b[0] for b in batches])
+    orders = np.concatenate([np.full(len(b[0]), b[1]) for b in batches])
+    batch_ids = np.concatenate([np.full(len(b[0]), n) for n, b in enumerate(batches)])
+    descriptions = [d for b in batches for d in b[3]]
+    order = np.lexsort((orders, positions))
+    severities = [b[2] for b in batches]
+    return [
+        (position, severities[batch], descriptions[i])
+        for position, batch, i in zip(positions[order].tolist(), batch_ids[order].tolist(), order.tolist())
+    ]
+
+
+def rule_status(rule: FieldRule, columns) -> Tuple[bool, Optional[str]]:
+    """
+    Check that a rule's column is mapped and present in the CSV header.
+    Returns (whether to validate the column's rows, blocker description or None).
+    """
+    canonical_name = rule.name
+
+    # Check if required field is mapped
+    if not rule.csv_column:
+        if rule.required:
+            return False, f"Required field '{canonical_name}' is not mapped to any CSV column"
+        return False, None
+
+    # Check if mapped column exists in CSV
+    if rule.csv_column not in columns:
+        return False, f"Mapped column '{rule.csv_column}' not found in CSV file"
+
+    return True, None
+
+
+def validate_dataframe(df: pd.DataFrame, file_name: str, plan: ValidationPlan) -> List[Dict[str, Any]]:
+    """
+    Validate a parsed CSV against a compiled plan.
+    Returns issues in the same order the row-by-row engine produced them:
+    field by field, then row by row, then check by check.
+    """
+    issues = []
+    for rule in plan.rules:
+        validate_rows, description = rule_status(rule, df.columns)
+        if description:
+            issues.append(make_issue(len(issues) + 1, "Blocker", file_name, None, rule.name, description))
+        if not validate_rows:
+            continue
+
+        for position, severity, description in ordered_failures(field_failures(rule, df[rule.csv_column])):
+            issues.append(make_issue(
+                len(issues) + 1, severity, file_name, position + ROW_NUMBER_OFFSET, rule.name, description
+            ))
+
+    # If no issues found, add an info message
+    if len(issues) == 0:
+        issues.append(make_issue(1, "Info", file_name, None, None, "All validations passed successfully!"))
+
+    return issues
+
+
+def validate_dataframe_grouped(df: pd.DataFrame, file_name: str, plan: ValidationPlan) -> List[IssueGroup]:
+    """validate_dataframe's issues, grouped (issue_groups.py) without building a dict per issue."""
+    builder = GroupBuilder()
+    for rule in plan.rules:
+        validate_rows, description = rule_status(rule, df.columns)
+        if description:
+            builder.add([(rule.name, "Blocker", None, description)])
+        if not validate_rows:
+            continue
+
+        builder.add(
+            (rule.name, severity, position + ROW_NUMBER_OFFSET, description)
+            for position, severity, description in ordered_failures(field_failures(rule, df[rule.csv_column]))
+        )
+
+    # If no issues found, add an info message
+    if builder.count == 0:
+        return group_issues([make_issue(1, "Info", file_name, None, None, "All validations passed successfully!")])
+
+    return builder.groups()
+
+
+# CSV input: raw bytes, or the path of a spooled upload
+CsvSource = Union[bytes, str]
+
+
+def source_size(source: CsvSource) -> int:
+    if isinstance(source, str):
+        return os.path.getsize(source)
+    return len(source)
+
+
+def read_csv_source(source: CsvSource, **kwargs):
+    """pd.read_csv over raw bytes, or over a memory-mapped file for a path."""
+    if isinstance(source, str):
+        # mmap refuses empty files; let pandas report those as usual
+        return pd.read_csv(source, memory_map=os.path.getsize(source) > 0, **kwargs)
+    return pd.read_csv(io.BytesIO(source), **kwargs)
+
+
+def read_csv_frame(source: CsvSource) -> pd.DataFrame:
+    """
+    read_csv_source(source, low_memory=False), through pyarrow's faster
+    parser wherever that gives the same frame (arrow_csv.py).
+    """
+    df = read_frame(source)
+    return df if df is not None else read_csv_source(source, low_memory=False)
+
+
+def validate_with_plan(source: CsvSource, file_name: str, plan: ValidationPlan) -> List[Dict[str, Any]]:
+    """
+    Parse and validate a CSV with an already compiled plan.
+    """
+    # All columns are parsed (not just plan.columns) so ragged rows are still
+    # reported as parse failures. low_memory=False makes dtype inference see
+    # the whole column at once, which streaming mode reproduces exactly.
+    try:
+        df = read_csv_frame(source)
+    except Exception as e:
+        return [make_issue(1, "Blocker", file_name, None, None, f"Failed to parse CSV: {str(e)}")]
+
+    count_rows(len(df))
+    return validate_dataframe(df, file_name, plan)
+
+
+def validate_with_plan_grouped(source: CsvSource, file_name: str, plan: ValidationPlan) -> List[IssueGroup]:
+    """validate_with_plan, grouped."""
+    try:
+        df = read_csv_frame(source)
+    except Exception as e:
+        return group_issues([make_issue(1, "Blocker", file_name, None, None, f"Failed to parse CSV: {str(e)}")])
+
+    count_rows(len(df))
+    return validate_dataframe_grouped(df, file_name, plan)
+
+
+# ============== Streaming Validation ==============
+
+def column_kind(column: pd.Series) -> str:
+    """Classify how pandas parsed one chunk of a column."""
+    if column.isna().all():
+        return "empty"
+    if pd.api.types.is_bool_dtype(column.dtype):
+        return "bool"
+    if pd.api.types.is_integer_dtype(column.dtype):
+        return "int"
+    if pd.api.types.is_float_dtype(column.dtype):
+        return "float"
+    # Booleans with missing values parse as an object column of bools
+    if column.dtype == object and pd.api.types.infer_dtype(column, skipna=True) == "boolean":
+        return "bool"
+    return "text"
+
+
+def merge_kinds(current: Optional[str], chunk_kind: str) -> str:
+    """Kind a whole-column read ends up with, given the kinds of its chunks."""
+    if current is None or current == chunk_kind:
+        return chunk_kind
+    if "empty" in (current, chunk_kind):
+        other = chunk_kind if current == "empty" else current
+        # Integers with missing values become floats
+        return "float" if other == "int" else other
+    if {current, chunk_kind} <= {"int", "float"}:
+        return "float"
+    return "text"
+
+
+# pandas' C parser does not check the field count of the first line(s) of
+# each chunk, so a ragged row that lands on a chunk boundary is silently
+# truncated. Streaming reads the file twice with chunk boundaries half a chunk
+# apart, so every line is checked by at least one of the two passes.
+MIN_STREAM_CHUNK_ROWS = 4
+
+_ERROR_LINE = re.compile(r"(?:line|row) (\d+)")
+
+
+def _error_line(error: Exception) -> float:
+    match = _ERROR_LINE.search(str(error))
+    return int(match.group(1)) if match else float("inf")
+
+
+def _iter_chunks(source: CsvSource, chunksize: int, shifted: bool = False, **kwargs):
+    """Yield DataFrame chunks; shifted chunks start half a chunk into the file."""
+    size = chunksize // 2 if shifted else chunksize
+    with read_csv_source(source, iterator=True, low_memory=False, **kwargs) as reader:
+        while True:
+            try:
+                chunk = reader.get_chunk(size)
+            except StopIteration:
+                return
+            yield chunk
+            size = chunksize
+
+
+def _scan_csv(source: CsvSource, plan: ValidationPlan, chunksize: int) -> Tuple[List[str], Dict[str, Any]]:
+    """
+    First pass: check the file parses and work out the dtype a whole-file
+    read would give each mapped column.
+    Returns the header and the dtype overrides for the validating pass.
+    """
+    columns: List[str] = []
+    kinds: Dict[str, str] = {}
+    try:
+        for chunk in _iter_chunks(source, chunksize):
+            columns = list(chunk.columns)
+            for column in plan.columns:
+                if column in chunk.columns:
+                    kinds[column] = merge_kinds(kinds.get(column), column_kind(chunk[column]))
+    except Exception as error:
+        # An earlier bad line may sit on one of this pass's chunk boundaries;
+        # report whichever error a whole-file read would have hit first
+        try:
+            for _ in _iter_chunks(source, chunksize, shifted=True):
+                pass
+        except Exception as shifted_error:
+            if _error_line(shifted_error) < _error_line(error):
+                raise shifted_error
+        raise
+
+    return columns, dtype_overrides(kinds)
+
+
+def _scan_batches(reader: BatchReader) -> Optional[Dict[str, Any]]:
+    """
+    _scan_csv through pyarrow: the dtype overrides for the validating pass,
+    or None if pyarrow cannot read the file the way pandas would.
+    """
+    kinds: Dict[str, str] = {}
+    try:
+        for batch in reader.batches():
+            for column in reader.columns:
+                series = to_series(batch.column(column), column)
+                if series is None:
+                    return None
+                kinds[column] = merge_kinds(kinds.get(column), column_kind(series))
+    except (pa.ArrowException, UnicodeDecodeError):
+        return None
+    if not kinds and reader.columns:
+        # No data rows; pandas decides what those columns are
+        return None
+    return dtype_overrides(kinds)
+
+
+def _batch_chunks(reader: BatchReader, dtypes: Dict[str, Any]) -> Iterator[pd.DataFrame]:
+    """The plan's columns, a record batch at a time, as _iter_chunks would parse them with these dtypes."""
+    for batch in reader.batches():
+        yield pd.DataFrame({column: to_series(batch.column(column), column, dtypes.get(column))
+                            for column in reader.columns})
+
+
+def dtype_overrides(kinds: Dict[str, str]) -> Dict[str, Any]:
+    """
+    read_csv dtypes that make every part of a file parse the way the whole
+    column does. A part that parsed as int where the whole column is float
+    (or text) must be read that way too, so values stringify the same. Bool
+    columns need no override: every part parses them as bools already.
+    """
+    dtypes = {}
+    for column, kind in kinds.items():
+        if kind == "float":
+            dtypes[column] = "float64"
+        elif kind == "text":
+            dtypes[column] = str
+    return dtypes
+
+
+class _KindsDiffer(Exception):
+    """Raised by _single_pass_chunks when a chunk parsed differently from the file as a whole."""
+
+
+def _single_pass_chunks(reader: BatchReader) -> Iterator[pd.DataFrame]:
+    """
+    The plan's columns, a record batch at a time, without a first pass:
+    each column is parsed the way pandas parses that batch on its own.
+    That is also how the whole file parses it as long as every batch of a
+    column parses to the same kind (merge_kinds); _KindsDiffer is raised as
+    soon as one does not, or if pyarrow cannot read the file.
+    """
+    seen: Dict[str, set] = {column: set() for column in reader.columns}
+    batches = 0
+    try:
+        for batch in reader.batches():
+            chunk = {}
+            for column in reader.columns:
+                series = to_series(batch.column(column), column)
+                if series is None:
+                    raise _KindsDiffer()
+                kinds = seen[column]
+                kinds.add(column_kind(series))
+                if len(kinds) > 1:
+                    raise _KindsDiffer()
+                chunk[column] = series
+            batches += 1
+            yield pd.DataFrame(chunk)
+    except (pa.ArrowException, UnicodeDecodeError):
+        raise _KindsDiffer()
+    if not batches and reader.columns:
+        # No data rows; pandas decides what those columns are
+        raise _KindsDiffer()
+
+
+class _GroupSink:
+    """Collects a streamed file's failures as groups, one builder per rule."""
+
+    def __init__(self, plan: ValidationPlan, file_name: str, on_issues=None):
+        self.plan = plan
+        self.file_name = file_name
+        self.on_issues = on_issues
+        self.builders = [GroupBuilder() for _ in plan.rules]
+        self.found: List[Dict[str, Any]] = []
+
+    def add(self, n: int, row_offset: int, failures: List[Tuple[Optional[int], str, str]]) -> None:
+        name = self.plan.rules[n].name
+        batch = [
+            (name, severity, None if position is None else row_offset + position + ROW_NUMBER_OFFSET, description)
+            for position, severity, description in failures
+        ]
+        self.builders[n].add(batch)
+        if self.on_issues:
+            self.found.extend(make_issue(None, severity, self.file_name, row, column, description)
+                              for column, severity, row, description in batch)
+
+    def chunk_done(self, rows: int) -> None:
+        if self.on_issues:
+            self.on_issues(rows, self.found)
+            self.found = []
+
+    def result(self) -> List[IssueGroup]:
+        # The fields' groups one after the other, as the whole-file engine orders them
+        groups = []
+        position = 0
+        for builder in self.builders:
+            groups.extend(builder.groups(position))
+            position += builder.count
+        if position == 0:
+            return group_issues([make_issue(1, "Info", self.file_name, None, None, "All validations passed successfully!")])
+        return groups
+
+
+class _IssueSink:
+    """Collects a streamed file's failures and builds its issue dicts once every chunk is in."""
+
+    def __init__(self, plan: ValidationPlan, file_name: str):
+        self.plan = plan
+        self.file_name = file_name
+        self.parts: List[List[Tuple[int, List[Tuple[Optional[int], str, str]]]]] = [[] for _ in plan.rules]
+
+    def add(self, n: int, row_offset: int, failures: List[Tuple[Optional[int], str, str]]) -> None:
+        if failures:
+            self.parts[n].append((row_offset + ROW_NUMBER_OFFSET, failures))
+
+    def chunk_done(self, rows: int) -> None:
+        pass
+
+    def result(self) -> List[Dict[str, Any]]:
+        issues = []
+        for rule, parts in zip(self.plan.rules, self.parts):
+            for offset, failures in parts:
+                for position, severity, description in failures:
+                    issues.append(make_issue(
+                        len(issues) + 1, severity, self.file_name,
+                        None if position is None else position + offset, rule.name, description
+                    ))
+        if not issues:
+            issues.append(make_issue(1, "Info", self.file_name, None, None, "All validations passed successfully!"))
+        return issues
+
+
+def _stream(source: CsvSource, file_name: str, plan: ValidationPlan, chunksize: int, new_sink: Callable,
+            single_pass: bool = True):
+    """
+    Validate a CSV chunk by chunk into a sink made by new_sink(), and return
+    sink.result(), or a parse failure issue. Files pyarrow reads the way
+    pandas does take one pass (_single_pass_chunks), or two if a column's
+    chunks parse to different kinds: one to settle the dtypes, one to
+    validate. Anything else is read twice with pandas' chunked reader.
+    """
+    chunksize = max(chunksize, MIN_STREAM_CHUNK_ROWS)
+    reader = BatchReader.open(source, list(plan.columns), chunksize)
+    if reader is not None and single_pass:
+        try:
+            return _validate_chunks(_single_pass_chunks(reader), reader.header, plan, new_sink())
+        except _KindsDiffer:
+            pass
+    dtypes = _scan_batches(reader) if reader is not None else None
+    try:
+        if dtypes is not None:
+            return _validate_chunks(_batch_chunks(reader, dtypes), reader.header, plan, new_sink())
+        try:
+            columns, dtypes = _scan_csv(source, plan, chunksize)
+        except Exception as e:
+            return make_issue(1, "Blocker", file_name, None, None, f"Failed to parse CSV: {str(e)}")
+        return _validate_chunks(_iter_chunks(source, chunksize, shifted=True, dtype=dtypes), columns, plan, new_sink())
+    except Exception as e:
+        # Only a ragged row on one of the first pass's chunk boundaries gets here
+        return make_issue(1, "Blocker", file_name, None, None, f"Failed to parse CSV: {str(e)}")
+
+
+def _validate_chunks(chunks: Iterator[pd.DataFrame], columns: List[str], plan: ValidationPlan, sink):
+    """Feed every rule's failures, chunk by chunk, to the sink; returns sink.result()."""
+    active = []
+    for n, rule in enumerate(plan.rules):
+        validate_rows, description = rule_status(rule, columns)
+        if description:
+            sink.add(n, 0, [(None, "Blocker", description)])
+        if validate_rows:
+            active.append(n)
+
+    seen = {n: SeenValues() for n in active if plan.rules[n].unique}
+    rows = 0
+    for chunk in chunks:
+        for n in active:
+            rule = plan.rules[n]
+            sink.add(n, rows, ordered_failures(field_failures(rule, chunk[rule.csv_column], seen.get(n), rows)))
+        rows += len(chunk)
+        sink.chunk_done(rows)
+    count_rows(rows)
+    return sink.result()
+
+
+def validate_csv_stream(source: CsvSource, file_name: str, plan: ValidationPlan,
+                        chunksize: int = STREAM_CHUNK_ROWS,
+                        on_issues: Optional[Callable[[int, List[Dict[str, Any]]], None]] = None) -> List[IssueGroup]:
+    """
+    Validate a CSV in fixed-size row chunks so memory stays flat regardless
+    of file size. Returns the issues grouped (issue_groups.py): expanded,
+    they are exactly what validate_with_plan returns for the same file.
+
+    pyarrow parses the file when it reads it exactly as pandas would
+    (arrow_csv.py), in one pass unless a column's chunks parse to different
+    dtypes; pandas' own chunked reader reads it twice otherwise (_stream).
+    Each chunk's issues are added to one group builder per field, so only
+    the groups are kept, and the fields' groups are concatenated at the end
+    to keep the field-by-field order of the whole-file engine.
+    on_issues(rows_processed, new_issues) is called after every chunk with
+    the issues found in it, without ids; with it, the file is always read
+    twice, so no chunk is reported before its dtypes are settled.
+    """
+    result = _stream(source, file_name, plan, chunksize, lambda: _GroupSink(plan, file_name, on_issues),
+                     single_pass=on_issues is None)
+    return group_issues([result]) if isinstance(result, dict) else result
+
+
+def validate_content(source: CsvSource, file_name: str, plan: ValidationPlan) -> List[Dict[str, Any]]:
+    """Validate a CSV, streaming it in chunks when it is large."""
+    if source_size(source) > STREAM_THRESHOLD_BYTES:
+        result = _stream(source, file_name, plan, STREAM_CHUNK_ROWS, lambda: _IssueSink(plan, file_name))
+        return [result] if isinstance(result, dict) else result
+    return validate_with_plan(source, file_name, plan)
+
+
+def validate_content_grouped(source: CsvSource, file_name: str, plan: ValidationPlan) -> List[IssueGroup]:
+    """validate_content, grouped; large files are never held as per-row issues."""
+    if source_size(source) > STREAM_THRESHOLD_BYTES:
+        return validate_csv_stream(source, file_name, plan)
+    return validate_with_plan_grouped(source, file_name, plan)
+
+
+def validate_csv_data(file_content: CsvSource, file_name: str, template_id: str, column_mapping: Dict[str, str]) -> List[Dict[str, Any]]:
+    """
+    Validate CSV data against schema template rules.
+    Returns a list of validation issues.
+    """
+    plan = plan_cache.get(template_id, column_mapping)
+    if plan is None:
+        return [make_issue(1, "Blocker", file_name, None, None, f"Unknown template: {template_id}")]
+
+    return validate_content(file_content, file_name, plan)
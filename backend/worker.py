@@ -0,0 +1,66 @@
+"""
+Standalone run worker.
+
+Processes queued runs outside the API process:
+
+    python -m worker
+
+Set RUN_WORKERS_IN_API=false on the API so runs are only processed here.
+Workers need the API's SPOOL_DIR (shared storage if they run on other hosts).
+Run events reach the API's event streams through the mongo broadcast backend
+(events.py), which the worker uses unless RUN_EVENTS_BACKEND says otherwise.
+With WORKER_METRICS_PORT set, the worker serves its Prometheus metrics
+(metrics.py) on that port. On SIGINT/SIGTERM it stops claiming runs and
+gives the ones in progress RUN_DRAIN_SECONDS to finish.
+"""
+import asyncio
+import os
+import signal
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from audit import audit_log
+from database import create_client
+from db_indexes import ensure_indexes
+from events import run_events
+from executor import shutdown_pool
+from metrics import serve as serve_metrics
+from run_queue import RunQueue, RunWorkerPool
+from runs import process_run
+from templates import refresh_templates
+
+
+async def main() -> None:
+    mongodb_uri = os.getenv("MONGODB_URI")
+    if not mongodb_uri:
+        raise ValueError("MONGODB_URI environment variable is required")
+    client = create_client(mongodb_uri)
+    db = client.get_database(os.getenv("DATABASE_NAME", "mdo"))
+    metrics_port = int(os.getenv("WORKER_METRICS_PORT", "0"))
+    if metrics_port:
+        serve_metrics(metrics_port)
+
+    await refresh_templates(db, force=True)
+    await ensure_indexes(db)
+    audit_log.start(db.audit_logs)
+    await run_events.start(db, os.getenv("RUN_EVENTS_BACKEND", "mongo"))
+    queue = RunQueue(db.harmonization_runs)
+    workers = RunWorkerPool(queue, lambda queue, run: process_run(db, queue, run))
+    workers.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    await workers.stop()
+    shutdown_pool()
+    await run_events.stop()
+    await audit_log.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())